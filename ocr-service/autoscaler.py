@@ -0,0 +1,159 @@
+"""
+Queue-driven autoscaling of the OCR process pool.
+
+OCR_MAX_WORKERS used to be fixed at startup: sized for bursts it kept idle
+workers (and their memory) around all day, sized for idle it queued pages
+under load. The pool now runs between OCR_MIN_WORKERS and OCR_MAX_WORKERS
+and the main process re-evaluates the size every AUTOSCALE_INTERVAL_SECONDS:
+
+    - Scale up when pages wait in the lanes (more than UP_QUEUE_FACTOR x
+      workers, or the oldest has waited UP_WAIT_SECONDS), by half the backlog,
+      capped by the host memory available for a whole new pool of workers
+    - Scale down by one worker when the busiest moment of the last
+      DOWN_IDLE_SECONDS left at least one worker idle and nothing waited
+    - Cooldowns after every change (UP_COOLDOWN_SECONDS / DOWN_COOLDOWN_SECONDS)
+
+A resize swaps in a new warmed pool and lets the old one finish its pages
+(see main._resize_pool). Bounds can be changed at runtime (POST /admin/pool).
+OCR_MIN_WORKERS defaults to OCR_MAX_WORKERS, i.e. a fixed-size pool.
+"""
+
+from __future__ import annotations
+import os
+import math
+import time
+from collections import deque
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:  # Memory cap is skipped without psutil
+    psutil = None
+
+
+MAX_WORKERS = int(os.environ.get('OCR_MAX_WORKERS', '5'))
+MIN_WORKERS = int(os.environ.get('OCR_MIN_WORKERS', str(MAX_WORKERS)))
+# Ceiling for bounds set at runtime (POST /admin/pool): default the CPU count, never below OCR_MAX_WORKERS
+HARD_MAX_WORKERS = max(int(os.environ.get('OCR_HARD_MAX_WORKERS', '0')) or os.cpu_count() or 1, MAX_WORKERS)
+AUTOSCALE_INTERVAL_SECONDS = float(os.environ.get('OCR_AUTOSCALE_INTERVAL_SECONDS', '5'))
+UP_QUEUE_FACTOR = float(os.environ.get('OCR_AUTOSCALE_UP_QUEUE_FACTOR', '1.0'))
+UP_WAIT_SECONDS = float(os.environ.get('OCR_AUTOSCALE_UP_WAIT_SECONDS', '10'))
+UP_COOLDOWN_SECONDS = float(os.environ.get('OCR_AUTOSCALE_UP_COOLDOWN_SECONDS', '30'))
+DOWN_IDLE_SECONDS = float(os.environ.get('OCR_AUTOSCALE_DOWN_IDLE_SECONDS', '120'))
+DOWN_COOLDOWN_SECONDS = float(os.environ.get('OCR_AUTOSCALE_DOWN_COOLDOWN_SECONDS', '120'))
+# Host memory kept free when scaling up (MB)
+MEMORY_RESERVE_MB = int(os.environ.get('OCR_AUTOSCALE_MEMORY_RESERVE_MB', '1024'))
+
+
+def available_memory_mb() -> Optional[float]:
+    """Host memory available for new workers (None without psutil)."""
+    if psutil is None:
+        return None
+    return psutil.virtual_memory().available / 1024 / 1024
+
+
+class PoolAutoscaler:
+    """Decides the pool size from lane backlog, wait time and host memory (main process)."""
+
+    def __init__(self, min_workers: int, max_workers: int, worker_memory_mb: int):
+        self.min_workers = 0
+        self.max_workers = 0
+        self.set_bounds(min_workers, max_workers)
+        self.worker_memory_mb = worker_memory_mb
+        self.last_change_at = 0.0
+        self.last_decision: Optional[dict] = None
+        self.scaled_up = 0
+        self.scaled_down = 0
+        self._busy: deque[tuple[float, int]] = deque()   # (time, running + waiting)
+        self._observed_since = time.monotonic()
+
+    def set_bounds(self, min_workers: int, max_workers: int) -> None:
+        """
+        Raises:
+            ValueError: min < 1, min > max or max > HARD_MAX_WORKERS
+        """
+        if min_workers < 1 or min_workers > max_workers:
+            raise ValueError(f"Invalid bounds: need 1 <= min_workers ({min_workers}) <= max_workers ({max_workers})")
+        if max_workers > HARD_MAX_WORKERS:
+            raise ValueError(f"Invalid bounds: max_workers ({max_workers}) exceeds the hard maximum "
+                             f"of {HARD_MAX_WORKERS} (OCR_HARD_MAX_WORKERS)")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_workers < self.max_workers
+
+    def clamp(self, workers: int) -> int:
+        return max(self.min_workers, min(self.max_workers, workers))
+
+    def affordable(self, memory_mb: Optional[float]) -> Optional[int]:
+        """Largest pool host memory can take on top of the running one (None = not checked)."""
+        if memory_mb is None:
+            return None
+        # The new pool warms up while the old one is still running
+        return int((memory_mb - MEMORY_RESERVE_MB) // self.worker_memory_mb)
+
+    def decide(self, current: int, dispatch: dict, memory_mb: Optional[float] = None) -> Optional[int]:
+        """
+        Target pool size, or None to keep the current one.
+
+        Args:
+            current: Current pool size
+            dispatch: PriorityDispatcher.stats()
+            memory_mb: Host memory available (None = not checked)
+        """
+        now = time.monotonic()
+        waiting = sum(lane["waiting"] for lane in dispatch["lanes"].values())
+        oldest = dispatch.get("oldest_wait_seconds") or 0.0
+        self._busy.append((now, dispatch["running"] + waiting))
+        while self._busy and now - self._busy[0][0] > DOWN_IDLE_SECONDS:
+            self._busy.popleft()
+
+        # Bounds changed at runtime: move into them right away
+        if self.clamp(current) != current:
+            return self._changed(now, current, self.clamp(current), "bounds")
+
+        since_change = now - self.last_change_at
+        if waiting and (waiting > current * UP_QUEUE_FACTOR or oldest >= UP_WAIT_SECONDS):
+            if since_change < UP_COOLDOWN_SECONDS or current >= self.max_workers:
+                return None
+            target = self.clamp(current + max(1, math.ceil(waiting / 2)))
+            affordable = self.affordable(memory_mb)
+            if affordable is not None:
+                target = min(target, affordable)
+            if target <= current:
+                self.last_decision = {"action": "hold", "reason": "memory", "waiting": waiting,
+                                      "available_mb": round(memory_mb or 0)}
+                return None
+            return self._changed(now, current, target, f"{waiting} waiting, oldest {oldest:.1f}s")
+
+        # Only scale down after a full window observed at this size
+        window_full = now - self._observed_since >= DOWN_IDLE_SECONDS
+        peak = max(busy for _, busy in self._busy)
+        if (window_full and since_change >= DOWN_COOLDOWN_SECONDS and not waiting
+                and peak < current and current > self.min_workers):
+            return self._changed(now, current, current - 1, f"peak {peak} busy in {DOWN_IDLE_SECONDS:.0f}s")
+        return None
+
+    def _changed(self, now: float, current: int, target: int, reason: str) -> int:
+        self.last_change_at = now
+        self._observed_since = now
+        self._busy.clear()
+        if target > current:
+            self.scaled_up += 1
+        else:
+            self.scaled_down += 1
+        self.last_decision = {"action": "up" if target > current else "down",
+                              "from": current, "to": target, "reason": reason}
+        return target
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "min_workers": self.min_workers,
+            "max_workers": self.max_workers,
+            "scaled_up": self.scaled_up,
+            "scaled_down": self.scaled_down,
+            "last_decision": self.last_decision
+        }
@@ -0,0 +1,245 @@
+"""
+Record / replay of Typhoon API traffic (OCR and chat) for offline runs.
+
+Reproducing a bad page or profiling the pipeline needed live API access and
+quota, and every run came back slightly different. The pooled HTTP client
+(http_clients.py) can now sit on a cassette transport:
+
+    record  - every POST goes to the API as usual; request and response
+              (status, headers, body chunks with their arrival times) are
+              written to OCR_CASSETTE_DIR. A stream the caller aborts early
+              is recorded up to that point.
+    replay  - no network: POSTs are answered from the cassettes, either at
+              the recorded pace (OCR_CASSETTE_LATENCY=recorded, streams
+              included) or at once (zero). A request without a cassette
+              gets a 404 naming its hash; other requests (connection
+              pre-warming) get an empty 404.
+
+Cassettes are keyed by a hash of the normalized request: method, URL path
+(not host - recordings replay against any base URL) and the JSON body with
+sorted keys. Headers are not part of the key and never stored, so API keys
+stay out of the cassettes and the key a page is routed to does not matter.
+The image in an OCR request is part of the body, so the same page prepared
+the same way hits the same cassette.
+
+    <OCR_CASSETTE_DIR>/<hash[:2]>/<hash>.json
+        {"request": {method, path, body (images as sha256 + length)},
+         "response": {status, headers, seconds (to headers),
+                      chunks: [[seconds after headers, base64]], complete},
+         "recorded_at"}
+"""
+
+from __future__ import annotations
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterator, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+CASSETTE_MODE = os.environ.get('OCR_CASSETTE_MODE', 'off').lower()   # off | record | replay
+CASSETTE_DIR = Path(os.environ.get('OCR_CASSETTE_DIR', str(Path(__file__).parent / "data" / "cassettes")))
+CASSETTE_LATENCY = os.environ.get('OCR_CASSETTE_LATENCY', 'recorded').lower()   # recorded | zero
+MODES = ("off", "record", "replay")
+# Response headers worth keeping (the rest are per-request noise); chunks are stored as received
+KEPT_HEADERS = ("content-type", "content-encoding")
+_DATA_URL_RE = re.compile(r"data:image/[a-z]+;base64,([A-Za-z0-9+/=]+)")
+
+
+def normalize_request(method: str, path: str, body: bytes) -> bytes:
+    """Canonical form of a request for hashing: method, path and sorted-key JSON body."""
+    try:
+        canonical_body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    except ValueError:
+        canonical_body = body.decode("utf-8", errors="replace")
+    return f"{method.upper()} {path}\n{canonical_body}".encode()
+
+
+def request_hash(method: str, path: str, body: bytes) -> str:
+    return hashlib.sha256(normalize_request(method, path, body)).hexdigest()
+
+
+def _readable_body(body: bytes):
+    """Request body for the cassette file, with inline images replaced by their hash and size."""
+    def shrink(match: re.Match) -> str:
+        data = match.group(1)
+        return f"<image sha256={hashlib.sha256(data.encode()).hexdigest()[:16]} base64_chars={len(data)}>"
+    text = _DATA_URL_RE.sub(shrink, body.decode("utf-8", errors="replace"))
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    """Passes the live response body through and writes the cassette when the caller closes it."""
+
+    def __init__(self, transport: "CassetteTransport", response: httpx.Response, entry: dict, path: Path):
+        self._transport = transport
+        self._response = response
+        self._entry = entry
+        self._path = path
+        self._started = time.perf_counter()
+        self._complete = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._response.stream:
+            self._entry["response"]["chunks"].append(
+                [round(time.perf_counter() - self._started, 4), base64.b64encode(chunk).decode("ascii")]
+            )
+            yield chunk
+        self._complete = True
+
+    def close(self) -> None:
+        try:
+            self._response.close()
+        finally:
+            self._entry["response"]["complete"] = self._complete
+            self._transport._save(self._path, self._entry)
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    """Recorded body chunks, at the recorded pace or at once."""
+
+    def __init__(self, chunks: list, paced: bool):
+        self._chunks = chunks
+        self._paced = paced
+
+    def __iter__(self) -> Iterator[bytes]:
+        started = time.perf_counter()
+        for offset, data in self._chunks:
+            if self._paced:
+                delay = offset - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield base64.b64decode(data)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    httpx transport that records POSTs through `inner` or replays them from `directory`.
+
+    Args:
+        inner: The real transport (record mode; unused in replay)
+        mode: "record" or "replay"
+        directory: Cassette directory
+        latency: Replay pace, "recorded" or "zero"
+    """
+
+    def __init__(
+        self,
+        inner: Optional[httpx.BaseTransport],
+        mode: str = CASSETTE_MODE,
+        directory: Path = CASSETTE_DIR,
+        latency: str = CASSETTE_LATENCY
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Invalid cassette mode '{mode}', expected record or replay")
+        if latency not in ("recorded", "zero"):
+            raise ValueError(f"Invalid cassette latency '{latency}', expected recorded or zero")
+        self.inner = inner
+        self.mode = mode
+        self.directory = Path(directory)
+        self.latency = latency
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / f"{digest}.json"
+
+    def _save(self, path: Path, entry: dict) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Temp file + rename: concurrent identical requests never leave a torn cassette
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        with self._lock:
+            self.recorded += 1
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "POST":
+            if self.mode == "replay":
+                return httpx.Response(404, request=request)
+            return self.inner.handle_request(request)
+
+        body = request.read()
+        digest = request_hash(request.method, request.url.path, body)
+        path = self._path(digest)
+
+        if self.mode == "replay":
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                with self._lock:
+                    self.misses += 1
+                message = f"No cassette for {request.method} {request.url.path} (hash {digest[:16]})"
+                logger.warning(f"📼 {message}")
+                # 404, not a transport error: the OpenAI client does not retry it
+                return httpx.Response(404, json={"error": {"message": message, "type": "cassette_miss"}},
+                                      request=request)
+            with self._lock:
+                self.replayed += 1
+            response = entry["response"]
+            if self.latency == "recorded":
+                time.sleep(response.get("seconds", 0.0))
+            return httpx.Response(
+                response["status"],
+                headers=response["headers"],
+                stream=_ReplayStream(response["chunks"], paced=self.latency == "recorded"),
+                request=request
+            )
+
+        started = time.perf_counter()
+        live = self.inner.handle_request(request)
+        entry = {
+            "request": {"method": request.method, "path": request.url.path, "hash": digest,
+                        "body": _readable_body(body)},
+            "response": {"status": live.status_code, "seconds": round(time.perf_counter() - started, 4),
+                         "headers": {k: v for k, v in live.headers.items() if k.lower() in KEPT_HEADERS},
+                         "chunks": [], "complete": False},
+            "recorded_at": time.time()
+        }
+        return httpx.Response(
+            live.status_code,
+            headers=live.headers,
+            stream=_RecordingStream(self, live, entry, path),
+            extensions=live.extensions,
+            request=request
+        )
+
+    def close(self) -> None:
+        if self.inner is not None:
+            self.inner.close()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "directory": str(self.directory),
+            "latency": self.latency if self.mode == "replay" else None,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses
+        }
+
+
+def wrap_transport(inner: httpx.BaseTransport) -> httpx.BaseTransport:
+    """The transport for the pooled clients: inner as is, or behind a cassette (OCR_CASSETTE_MODE)."""
+    if CASSETTE_MODE == "off":
+        return inner
+    if CASSETTE_MODE not in MODES:
+        raise ValueError(f"Invalid OCR_CASSETTE_MODE '{CASSETTE_MODE}', expected one of {', '.join(MODES)}")
+    return CassetteTransport(inner)
@@ -0,0 +1,235 @@
+"""
+Per-key, per-endpoint circuit breakers for the Typhoon APIs.
+
+Region calls used to be pinned to keys[i], so a revoked or over-quota key
+kept getting its share of calls and every page it touched failed or slowed
+down. Breakers live in the main process; workers report the outcome of
+every API call in their result meta, and pages are routed around keys whose
+breaker is open before they are handed to a worker.
+
+States (one breaker per (key, endpoint), endpoint = "ocr" or "chat"):
+    - closed: calls flow; opens when the rolling window (BREAKER_WINDOW_SECONDS,
+      at least BREAKER_MIN_CALLS calls) has BREAKER_FAILURE_RATE failures,
+      slow calls included. Auth errors and exhausted quota open it at once.
+    - open: no traffic for BREAKER_OPEN_SECONDS
+    - half_open: one probe page at a time; a success closes the breaker,
+      a failure opens it again. A page planned onto the key claims the probe
+      (last_probe_at); if it ends without a call on that key the claim is
+      released so the next page can probe.
+
+Keys are never logged or exposed in full, only as key_id() fingerprints.
+"""
+
+from __future__ import annotations
+import os
+import time
+import hashlib
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+ENDPOINTS = ("ocr", "chat")
+BREAKER_ENABLED = os.environ.get('OCR_BREAKER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+BREAKER_WINDOW_SECONDS = float(os.environ.get('OCR_BREAKER_WINDOW_SECONDS', '120'))
+BREAKER_MIN_CALLS = int(os.environ.get('OCR_BREAKER_MIN_CALLS', '5'))
+BREAKER_FAILURE_RATE = float(os.environ.get('OCR_BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_OPEN_SECONDS = float(os.environ.get('OCR_BREAKER_OPEN_SECONDS', '30'))
+# Calls slower than this count as failures (chat streams a whole page, OCR one region)
+BREAKER_SLOW_SECONDS = {
+    "ocr": float(os.environ.get('OCR_BREAKER_OCR_SLOW_SECONDS', '60')),
+    "chat": float(os.environ.get('OCR_BREAKER_CHAT_SLOW_SECONDS', '120')),
+}
+MAX_TRACKED_KEYS = 512
+
+# Error kinds that say something about the key/endpoint (others are ignored)
+KEY_ERRORS = ("auth", "quota")
+BREAKER_ERRORS = KEY_ERRORS + ("rate_limit", "server", "timeout", "connection")
+
+
+def key_id(api_key: str) -> str:
+    """Short, stable fingerprint of an API key (safe to log and expose)."""
+    return f"…{api_key[-4:]}#{hashlib.sha256(api_key.encode()).hexdigest()[:6]}"
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Map an API call exception to an error kind.
+
+    Works on openai/httpx exceptions without importing them:
+    auth | quota | rate_limit | server | timeout | connection | other
+    """
+    status_code = getattr(error, "status_code", None)
+    text = str(error).lower()
+    name = type(error).__name__.lower()
+    if status_code in (401, 403):
+        return "auth"
+    if status_code == 429:
+        return "quota" if "quota" in text else "rate_limit"
+    if status_code is not None and status_code >= 500:
+        return "server"
+    if "timeout" in name or "timed out" in text:
+        return "timeout"
+    if "connection" in name or "connect" in text:
+        return "connection"
+    return "other"
+
+
+@dataclass
+class CircuitBreaker:
+    """Breaker for one (key, endpoint)."""
+    key: str
+    endpoint: str
+    state: str = "closed"
+    opened_at: Optional[float] = None
+    open_reason: Optional[str] = None
+    last_probe_at: Optional[float] = None
+    opened_total: int = 0
+    last_error: Optional[str] = None
+    window: deque = field(default_factory=deque)   # (time, failed)
+
+    def _prune(self, now: float) -> None:
+        while self.window and now - self.window[0][0] > BREAKER_WINDOW_SECONDS:
+            self.window.popleft()
+
+    def _open(self, now: float, reason: str) -> None:
+        self.state = "open"
+        self.opened_at = now
+        self.open_reason = reason
+        self.opened_total += 1
+
+    def allow(self, now: float) -> bool:
+        """Can a page be routed to this key? (half-open: while no probe is claimed)"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if now - self.opened_at < BREAKER_OPEN_SECONDS:
+                return False
+            self.state = "half_open"
+        return self.last_probe_at is None or now - self.last_probe_at >= BREAKER_OPEN_SECONDS
+
+    def record(self, now: float, error: Optional[str], seconds: float) -> None:
+        """Record one call outcome (error = error kind or None)."""
+        if error is not None and error not in BREAKER_ERRORS:
+            return
+        failed = error is not None or seconds > BREAKER_SLOW_SECONDS[self.endpoint]
+        if failed:
+            self.last_error = error or f"slow ({seconds:.1f}s)"
+
+        if self.state == "half_open":
+            if failed:
+                self._open(now, self.last_error)
+            else:
+                self.state = "closed"
+                self.opened_at = self.open_reason = self.last_probe_at = None
+                self.window.clear()
+            return
+        if self.state == "open":
+            return  # Straggler from a page routed before the breaker opened
+
+        self.window.append((now, failed))
+        self._prune(now)
+        if error in KEY_ERRORS:
+            self._open(now, error)
+            return
+        failures = sum(1 for _, f in self.window if f)
+        if len(self.window) >= BREAKER_MIN_CALLS and failures / len(self.window) >= BREAKER_FAILURE_RATE:
+            self._open(now, f"failure rate {failures}/{len(self.window)} ({self.last_error})")
+
+    def to_dict(self, now: float) -> dict:
+        self._prune(now)
+        failures = sum(1 for _, f in self.window if f)
+        return {
+            "key": self.key,
+            "endpoint": self.endpoint,
+            "state": self.state,
+            "open_reason": self.open_reason,
+            "open_for_seconds": round(now - self.opened_at, 1) if self.opened_at else None,
+            "window_calls": len(self.window),
+            "window_failures": failures,
+            "opened_total": self.opened_total,
+            "last_error": self.last_error
+        }
+
+
+class BreakerBoard:
+    """All breakers of this service instance, keyed by (key_id, endpoint)."""
+
+    def __init__(self):
+        self._breakers: OrderedDict[tuple[str, str], CircuitBreaker] = OrderedDict()
+
+    def _get(self, kid: str, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get((kid, endpoint))
+        if breaker is None:
+            breaker = CircuitBreaker(kid, endpoint)
+            self._breakers[(kid, endpoint)] = breaker
+            if len(self._breakers) > MAX_TRACKED_KEYS:
+                # Forget the least recently used healthy breaker
+                for stale, candidate in self._breakers.items():
+                    if candidate.state == "closed":
+                        del self._breakers[stale]
+                        break
+        else:
+            self._breakers.move_to_end((kid, endpoint))
+        return breaker
+
+    def plan(self, keys: list[str], endpoints: tuple[str, ...] = ENDPOINTS) -> dict[str, list[str]]:
+        """
+        Keys a page may use per endpoint, in the caller's order.
+
+        Plan only the endpoints the stage will call: a planned half-open key
+        claims its probe until release(). When every key of an endpoint is
+        open, all of them are returned: trying is better than failing the
+        page without a call.
+        """
+        now = time.monotonic()
+        unique = list(dict.fromkeys(keys))
+        plan = {}
+        for endpoint in endpoints:
+            allowed = []
+            for key in unique:
+                breaker = self._get(key_id(key), endpoint)
+                if breaker.allow(now):
+                    if breaker.state == "half_open":
+                        breaker.last_probe_at = now
+                    allowed.append(key)
+            plan[endpoint] = allowed or unique
+        return plan
+
+    def release(self, plan: Optional[dict[str, list[str]]]) -> None:
+        """
+        Give back probe claims a finished stage did not use.
+
+        Call after the stage's calls went through record(): a probe call on a
+        half-open breaker has closed or re-opened it, so one that is still
+        half-open was not probed by this page.
+        """
+        for endpoint, keys in (plan or {}).items():
+            for key in keys:
+                breaker = self._breakers.get((key_id(key), endpoint))
+                if breaker is not None and breaker.state == "half_open":
+                    breaker.last_probe_at = None
+
+    def record(self, calls: Optional[list[dict]]) -> None:
+        """Fold worker call outcomes ({key, endpoint, error, seconds}) into the breakers."""
+        now = time.monotonic()
+        for call in calls or []:
+            self._get(call["key"], call["endpoint"]).record(now, call.get("error"), call.get("seconds", 0.0))
+
+    def reset(self, kid: Optional[str] = None) -> int:
+        """Force breakers closed (all, or those of one key id). Returns how many were reset."""
+        targets = [b for (k, _), b in self._breakers.items() if kid is None or k == kid]
+        for breaker in targets:
+            breaker.state = "closed"
+            breaker.opened_at = breaker.open_reason = breaker.last_probe_at = None
+            breaker.window.clear()
+        return len(targets)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        breakers = [b.to_dict(now) for b in self._breakers.values()]
+        return {
+            "enabled": True,
+            "open": sum(1 for b in breakers if b["state"] != "closed"),
+            "breakers": breakers
+        }
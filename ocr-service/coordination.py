@@ -0,0 +1,289 @@
+"""
+Host-wide coordination between uvicorn workers (multi-process deployment).
+
+main.py runs one process pool, one set of priority lanes and one merge stage
+per uvicorn worker. With `uvicorn main:app --workers N` (or WEB_CONCURRENCY=N)
+there are N of each, so N x OCR_MAX_WORKERS pages call the same API keys at
+once and no worker knows about the others. Processes on one host now share
+their limits through lock files in OCR_COORDINATION_DIR (fcntl.flock):
+
+    HostSemaphore   N slot files; holding a slot = holding an exclusive lock on
+                    one of them. Every acquire opens its own file, so slots are
+                    shared by uvicorn workers, their pool workers and threads
+                    alike. A slot held by a process that dies is released by
+                    the kernel - nothing to clean up after a crash.
+        - OCR_HOST_SLOTS: pages in the OCR stage at once on the whole host
+          (taken after the page's lane slot, see main._run_ocr_worker)
+        - OCR_HOST_KEY_CONCURRENCY: API calls in flight per key on the whole
+          host (taken around every call, see ocr_pipeline._call_with_failover)
+    Leadership      one lock held by one process: host-wide singletons (the
+                    webhook sender) run in whichever worker holds it, another
+                    takes over when that worker exits
+    write_shared_json  atomic replace under a lock (organizations.json), so a
+                    worker never reads a half-written file
+
+Waiters poll every OCR_COORDINATION_POLL_MS (no FIFO across processes; within
+a worker the lanes still decide the order). Both limits default to 0 = off.
+Linux / macOS only (fcntl).
+"""
+
+from __future__ import annotations
+import os
+import json
+import time
+import fcntl
+import random
+import asyncio
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+from pathlib import Path
+from typing import Optional
+
+
+def _default_dir() -> str:
+    # tmpfs when there is one: lock files never touch the disk
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "ocr-flow")
+
+
+COORDINATION_DIR = Path(os.environ.get('OCR_COORDINATION_DIR', '') or _default_dir())
+# Pages in the OCR stage at once across all uvicorn workers on this host (0 = off)
+HOST_SLOTS = int(os.environ.get('OCR_HOST_SLOTS', '0'))
+# API calls in flight per key across all processes on this host (0 = off)
+HOST_KEY_CONCURRENCY = int(os.environ.get('OCR_HOST_KEY_CONCURRENCY', '0'))
+# A call waiting longer than this for its key fails instead of exceeding the limit
+HOST_KEY_WAIT_SECONDS = float(os.environ.get('OCR_HOST_KEY_WAIT_SECONDS', '60'))
+POLL_SECONDS = float(os.environ.get('OCR_COORDINATION_POLL_MS', '20')) / 1000
+# uvicorn reads the same variable for its default --workers
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+
+class HostSlotTimeout(TimeoutError):
+    """No host slot became free within the wait limit."""
+    pass
+
+
+def _try_lock(path: Path) -> Optional[int]:
+    """Exclusive non-blocking lock on path: the open fd, or None when another holder has it."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+
+def _unlock(fd: int) -> None:
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+class HostSemaphore:
+    """
+    A semaphore of `slots` lock files shared by every process on the host.
+
+    Usage:
+        with semaphore.hold(timeout=60):        # threads (pool workers, merge stage)
+        async with semaphore.hold_async():      # event loop
+    """
+
+    def __init__(self, name: str, slots: int, directory: Path = COORDINATION_DIR, poll_seconds: float = POLL_SECONDS):
+        if slots < 1:
+            raise ValueError(f"HostSemaphore '{name}' needs at least 1 slot, got {slots}")
+        directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.slots = slots
+        self.poll_seconds = poll_seconds
+        self.paths = [directory / f"{name}.{i}.lock" for i in range(slots)]
+        self._lock = threading.Lock()
+        self.held = 0
+        self.acquired = 0
+        self.waited = 0
+        self._wait_seconds = 0.0
+
+    def _try(self) -> Optional[int]:
+        # Random start spreads concurrent acquirers over the files
+        start = random.randrange(self.slots)
+        for i in range(self.slots):
+            fd = _try_lock(self.paths[(start + i) % self.slots])
+            if fd is not None:
+                return fd
+        return None
+
+    def _granted(self, fd: int, waited: float) -> int:
+        with self._lock:
+            self.held += 1
+            self.acquired += 1
+            self.waited += 1 if waited > 0 else 0
+            self._wait_seconds += waited
+        return fd
+
+    def _release(self, fd: int) -> None:
+        _unlock(fd)
+        with self._lock:
+            self.held -= 1
+
+    def acquire(self, timeout: Optional[float] = None) -> int:
+        """
+        Block until a slot is free. Returns the slot's fd (pass it to release).
+
+        Raises:
+            HostSlotTimeout: No slot within timeout seconds
+        """
+        fd = self._try()
+        if fd is not None:
+            return self._granted(fd, 0.0)
+        started = time.monotonic()
+        while fd is None:
+            if timeout is not None and time.monotonic() - started >= timeout:
+                raise HostSlotTimeout(f"No '{self.name}' slot free on this host after {timeout:.0f}s "
+                                      f"({self.slots} slot(s))")
+            time.sleep(self.poll_seconds)
+            fd = self._try()
+        return self._granted(fd, time.monotonic() - started)
+
+    def release(self, fd: int) -> None:
+        self._release(fd)
+
+    @contextmanager
+    def hold(self, timeout: Optional[float] = None):
+        fd = self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self._release(fd)
+
+    @asynccontextmanager
+    async def hold_async(self):
+        """Wait for a slot without blocking the event loop (cancellation gives up the wait)."""
+        fd = self._try()
+        waited = 0.0
+        if fd is None:
+            started = time.monotonic()
+            while fd is None:
+                await asyncio.sleep(self.poll_seconds)
+                fd = self._try()
+            waited = time.monotonic() - started
+        self._granted(fd, waited)
+        try:
+            yield
+        finally:
+            self._release(fd)
+
+    def in_use(self) -> int:
+        """Slots held host-wide right now (probes every file; for /metrics only)."""
+        busy = 0
+        for path in self.paths:
+            fd = _try_lock(path)
+            if fd is None:
+                busy += 1
+            else:
+                _unlock(fd)
+        return busy
+
+    def stats(self) -> dict:
+        return {
+            "slots": self.slots,
+            "in_use": self.in_use(),
+            "held_here": self.held,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "mean_wait_seconds": round(self._wait_seconds / self.acquired, 3) if self.acquired else None
+        }
+
+
+# =============================================================================
+# PER-KEY CALL LIMIT
+# =============================================================================
+
+_key_semaphores: dict[str, HostSemaphore] = {}
+_key_semaphores_lock = threading.Lock()
+
+
+def _key_name(api_key: str) -> str:
+    # Same 6 hex digits as circuit_breaker.key_id(); the key itself never reaches the file system
+    return f"key-{hashlib.sha256(api_key.encode()).hexdigest()[:6]}"
+
+
+def key_slot(api_key: str):
+    """
+    Context manager around one API call with this key (no-op when OCR_HOST_KEY_CONCURRENCY=0).
+
+    Raises:
+        HostSlotTimeout: The key stayed busy for OCR_HOST_KEY_WAIT_SECONDS
+    """
+    if HOST_KEY_CONCURRENCY <= 0:
+        return nullcontext()
+    name = _key_name(api_key)
+    semaphore = _key_semaphores.get(name)
+    if semaphore is None:
+        with _key_semaphores_lock:
+            semaphore = _key_semaphores.setdefault(name, HostSemaphore(name, HOST_KEY_CONCURRENCY))
+    return semaphore.hold(timeout=HOST_KEY_WAIT_SECONDS)
+
+
+def key_stats(directory: Path = COORDINATION_DIR) -> dict:
+    """Calls in flight per key fingerprint host-wide (keys seen by any process on the host)."""
+    if HOST_KEY_CONCURRENCY <= 0:
+        return {"enabled": False}
+    keys = {}
+    for first in sorted(directory.glob("key-*.0.lock")):
+        name = first.name[:-len(".0.lock")]
+        probe = HostSemaphore(name, HOST_KEY_CONCURRENCY, directory)
+        keys["#" + name[len("key-"):]] = probe.in_use()
+    return {
+        "enabled": True,
+        "concurrency_per_key": HOST_KEY_CONCURRENCY,
+        "wait_limit_seconds": HOST_KEY_WAIT_SECONDS,
+        "in_flight": keys
+    }
+
+
+# =============================================================================
+# LEADERSHIP / SHARED FILES
+# =============================================================================
+
+class Leadership:
+    """One holder per host for a named role; is_leader() takes the role as soon as it is free."""
+
+    def __init__(self, name: str, directory: Path = COORDINATION_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.path = directory / f"leader-{name}.lock"
+        self._fd: Optional[int] = None
+
+    def is_leader(self) -> bool:
+        if self._fd is None:
+            self._fd = _try_lock(self.path)
+        return self._fd is not None
+
+    def release(self) -> None:
+        if self._fd is not None:
+            _unlock(self._fd)
+            self._fd = None
+
+
+def write_shared_json(path: Path, data, directory: Path = COORDINATION_DIR) -> None:
+    """Replace a JSON file read by other processes atomically, one writer at a time."""
+    path = Path(path)
+    directory.mkdir(parents=True, exist_ok=True)
+    lock_name = f"write-{hashlib.sha256(str(path.resolve()).encode()).hexdigest()[:8]}.lock"
+    lock_fd = os.open(directory / lock_name, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        os.fchmod(fd, 0o644)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    finally:
+        _unlock(lock_fd)
@@ -0,0 +1,205 @@
+"""
+Cost and token accounting per page, per batch and per key.
+
+Responses said nothing about what a page cost, so a caller could not tell
+what a document or batch cost, or which document types are expensive.
+Every API call record (ocr_pipeline._call_with_failover) now carries the
+key fingerprint, the bytes uploaded (OCR) and the token usage the API
+reported (estimated from chars when it did not, e.g. an aborted stream).
+
+    page_cost      per-page summary returned with the result ("cost"):
+                   OCR calls + bytes + tokens, LLM calls + tokens, retries
+                   (failed attempts), calls per key. A page merged in a
+                   multi-page LLM request carries its share of that request.
+    CostLedger     service-wide totals per endpoint and key (every API call,
+                   including failed pages and batch requests) and per
+                   task_type / tier (per completed page) - /metrics "cost"
+    TokenBudget    optional token budget of one /ocr/batch or /ocr/pdf
+                   request (token_budget): once used up, the remaining pages
+                   run at tier full_only (no section crops, no LLM merge)
+
+There is no "hedges" count: the pipeline never sends a duplicate request
+while one is in flight. Every extra attempt is a failover after an error
+(counted in retries); a crop call left running at the deadline is counted
+as a call, estimated, not as a retry.
+"""
+
+from __future__ import annotations
+from typing import Optional
+
+
+ENDPOINTS = ("ocr", "llm")
+# Error kind of a call still in flight when its page stopped waiting (crop dropped at the deadline):
+# sent and billed, but neither a retry nor a key failure
+ABANDONED = "abandoned"
+
+
+def _empty_cost() -> dict:
+    return {
+        "ocr": {"calls": 0, "bytes": 0, "prompt_tokens": 0, "completion_tokens": 0},
+        "llm": {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0},
+        "tokens": 0,
+        "retries": 0,
+        "keys": {},
+        "estimated": False
+    }
+
+
+def _add_call(cost: dict, call: dict, share: float = 1.0) -> None:
+    part = cost["ocr" if call.get("endpoint") == "ocr" else "llm"]
+    part["calls"] += share
+    if "bytes" in part:
+        part["bytes"] += (call.get("bytes") or 0) * share
+    part["prompt_tokens"] += (call.get("prompt_tokens") or 0) * share
+    part["completion_tokens"] += (call.get("completion_tokens") or 0) * share
+    if call.get("error") == ABANDONED:
+        cost["estimated"] = True  # Usage never arrived
+    elif call.get("error"):
+        cost["retries"] += share
+    elif call.get("tokens_estimated") or call.get("prompt_tokens") is None:
+        cost["estimated"] = True
+    key = call.get("key") or "unknown"
+    cost["keys"][key] = cost["keys"].get(key, 0) + share
+
+
+def _rounded(value: float):
+    return int(value) if float(value).is_integer() else round(value, 3)
+
+
+def _finish(cost: dict) -> dict:
+    for endpoint in ENDPOINTS:
+        part = cost[endpoint]
+        for field in part:
+            part[field] = _rounded(part[field])
+    cost["tokens"] = _rounded(sum(cost[endpoint]["prompt_tokens"] + cost[endpoint]["completion_tokens"]
+                                  for endpoint in ENDPOINTS))
+    cost["retries"] = _rounded(cost["retries"])
+    cost["keys"] = {key: _rounded(calls) for key, calls in cost["keys"].items()}
+    return cost
+
+
+def page_cost(calls: Optional[list[dict]], batch: Optional[dict] = None) -> dict:
+    """
+    Cost of one page from its API call records.
+
+    Args:
+        calls: The page's own call records (meta["calls"])
+        batch: Multi-page LLM request the page was merged in
+               ({"pages", "share", "calls"}, see ocr_pipeline.merge_batch)
+
+    Returns:
+        {"ocr": {calls, bytes, prompt_tokens, completion_tokens},
+         "llm": {calls, prompt_tokens, completion_tokens},
+         "tokens", "retries", "keys": {key_id: calls}, "estimated"}
+    """
+    cost = _empty_cost()
+    for call in calls or []:
+        _add_call(cost, call)
+    if batch:
+        for call in batch.get("calls") or []:
+            _add_call(cost, call, batch["share"])
+    return _finish(cost)
+
+
+def sum_costs(costs: list[Optional[dict]]) -> dict:
+    """Total of several page costs (a batch or document)."""
+    total = _empty_cost()
+    for cost in costs:
+        if not cost:
+            continue
+        for endpoint in ENDPOINTS:
+            for field, value in cost[endpoint].items():
+                total[endpoint][field] += value
+        total["retries"] += cost["retries"]
+        total["estimated"] = total["estimated"] or cost["estimated"]
+        for key, calls in cost["keys"].items():
+            total["keys"][key] = total["keys"].get(key, 0) + calls
+    return _finish(total)
+
+
+class TokenBudget:
+    """Token budget of one batch request; pages past it are capped to tier full_only."""
+
+    def __init__(self, tokens: int):
+        self.limit = tokens
+        self.spent = 0
+        self.capped_pages = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent >= self.limit
+
+    def add(self, cost: Optional[dict]) -> None:
+        self.spent += (cost or {}).get("tokens", 0)
+
+    def stats(self) -> dict:
+        return {
+            "token_budget": self.limit,
+            "spent_tokens": _rounded(self.spent),
+            "exhausted": self.exhausted,
+            "capped_pages": self.capped_pages
+        }
+
+
+class CostLedger:
+    """Service-wide cost totals (main process)."""
+
+    def __init__(self):
+        self.endpoints = {endpoint: {"calls": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                     "estimated_calls": 0}
+                          for endpoint in ENDPOINTS}
+        self.endpoints["ocr"]["bytes"] = 0
+        self.keys: dict[str, dict] = {}
+        self.task_types: dict[str, dict] = {}
+        self.tiers: dict[str, dict] = {}
+        self.capped_pages = 0
+
+    def record_calls(self, calls: Optional[list[dict]]) -> None:
+        """Every API call once, wherever it was made (page, failed page or batch request)."""
+        for call in calls or []:
+            endpoint = "ocr" if call.get("endpoint") == "ocr" else "llm"
+            totals = self.endpoints[endpoint]
+            tokens = (call.get("prompt_tokens") or 0) + (call.get("completion_tokens") or 0)
+            totals["calls"] += 1
+            totals["failed"] += 1 if call.get("error") else 0
+            if endpoint == "ocr":
+                totals["bytes"] += call.get("bytes") or 0
+            totals["prompt_tokens"] += call.get("prompt_tokens") or 0
+            totals["completion_tokens"] += call.get("completion_tokens") or 0
+            totals["estimated_calls"] += 1 if call.get("tokens_estimated") else 0
+            key = self.keys.setdefault(call.get("key") or "unknown",
+                                       {"ocr_calls": 0, "llm_calls": 0, "failed": 0, "bytes": 0, "tokens": 0})
+            key[f"{endpoint}_calls"] += 1
+            key["failed"] += 1 if call.get("error") else 0
+            key["bytes"] += call.get("bytes") or 0
+            key["tokens"] += tokens
+
+    def record_page(self, cost: dict, task_type: str, tier: Optional[str], success: bool = True) -> None:
+        """A finished page, grouped by task_type and tier (failed pages under tier "failed")."""
+        for group, name in ((self.task_types, task_type), (self.tiers, tier if success else "failed")):
+            entry = group.setdefault(name or "unknown", {"pages": 0, "tokens": 0, "bytes": 0, "retries": 0})
+            entry["pages"] += 1
+            entry["tokens"] += cost["tokens"]
+            entry["bytes"] += cost["ocr"]["bytes"]
+            entry["retries"] += cost["retries"]
+
+    @staticmethod
+    def _per_page(groups: dict[str, dict]) -> dict:
+        return {
+            name: {
+                **{field: _rounded(value) for field, value in entry.items()},
+                "tokens_per_page": round(entry["tokens"] / entry["pages"]),
+                "bytes_per_page": round(entry["bytes"] / entry["pages"])
+            }
+            for name, entry in groups.items()
+        }
+
+    def stats(self) -> dict:
+        return {
+            "endpoints": self.endpoints,
+            "tokens": sum(e["prompt_tokens"] + e["completion_tokens"] for e in self.endpoints.values()),
+            "keys": self.keys,
+            "task_types": self._per_page(self.task_types),
+            "tiers": self._per_page(self.tiers),
+            "budget_capped_pages": self.capped_pages
+        }
@@ -0,0 +1,287 @@
+"""
+Whitespace-aware crop planning for the multi-scale OCR step.
+
+The pipeline used to cut every page into exact thirds with a fixed 20 px
+overlap. Cuts regularly went through a text line (garbage at the seams, which
+made the LLM distrust the crops), and tall legal-size scans got only three
+crops however dense they were.
+
+plan_crops() instead:
+    - builds a horizontal projection profile (ink per row) on a small
+      grayscale copy of the page - PIL only, no numpy
+    - picks the number of crops from page height and number of text lines
+    - cuts in the inter-line whitespace gap closest to each even split
+    - trims every crop to its text (blank margins and blank bands between
+      crops are not uploaded) and drops crops without any text
+
+When the page has no usable profile (blank, dark photo, no background) the
+original fixed thirds are used.
+"""
+
+from __future__ import annotations
+import os
+import math
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+
+from PIL import Image
+
+
+ADAPTIVE_CROPS = os.environ.get('OCR_ADAPTIVE_CROPS', 'true').lower() in ('1', 'true', 'yes')
+MIN_CROPS = 2
+MAX_CROPS = int(os.environ.get('OCR_CROP_MAX', '6'))
+# Crop height / width before another crop is added (A4 content -> 3 crops)
+CROP_MAX_ASPECT = float(os.environ.get('OCR_CROP_MAX_ASPECT', '0.5'))
+# Text lines per crop before another crop is added
+CROP_MAX_LINES = int(os.environ.get('OCR_CROP_MAX_LINES', '20'))
+FIXED_OVERLAP = 20         # px, fixed-thirds fallback / cuts without whitespace
+
+# Projection profile
+PROFILE_MAX_WIDTH = 512
+PROFILE_MAX_HEIGHT = 2000
+INK_CONTRAST = 40          # Gray levels below the page background that count as ink
+MIN_BACKGROUND = 120       # Darker median = photo/inverted page, no profile
+ROW_INK_FRACTION = 0.004   # Rows with less ink are whitespace
+COL_INK_FRACTION = 0.002
+BORDER_INK_FRACTION = 0.8  # Columns/rows inked almost end to end are scan borders or rules, not text
+BLANK_BAND_FRACTION = 0.04 # Gaps taller than this (fraction of page height) are never uploaded
+PAD_FRACTION = 0.01        # Padding around trimmed text, fraction of page width
+
+
+@dataclass
+class CropSection:
+    """One crop sent to Typhoon OCR."""
+    name: str                               # English label used in logs / LLM prompt
+    label: str                              # Thai position label for the LLM prompt section header
+    hint: str                               # Thai "which part of the page" for the prompt's mapping rule
+    box: tuple[int, int, int, int]          # (left, upper, right, lower) in decoded pixels
+
+
+@dataclass
+class CropPlan:
+    sections: list[CropSection]
+    adaptive: bool
+    lines: int = 0
+    whitespace_cuts: int = 0
+    fallback_reason: Optional[str] = None
+    pixel_ratio: float = 1.0                # Crop pixels / page pixels
+    detail: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["sections"] = [{"name": s.name, "box": list(s.box)} for s in self.sections]
+        return data
+
+
+def _section_names(count: int) -> list[tuple[str, str, str]]:
+    """(name, label, hint) per section - three sections keep the original prompt wording."""
+    if count == 3:
+        return [
+            ("Top Section", "1/3 บน", "ส่วนบน (1/3 บน)"),
+            ("Middle Section", "1/3 กลาง", "ส่วนกลาง (1/3 กลาง)"),
+            ("Bottom Section", "1/3 ล่าง", "ส่วนล่าง (1/3 ล่าง)"),
+        ]
+    return [
+        (f"Section {i}/{count}", f"ส่วนที่ {i} จาก {count} นับจากบน", f"ส่วนที่ {i} (จาก {count} ส่วน นับจากบน)")
+        for i in range(1, count + 1)
+    ]
+
+
+def fixed_thirds(width: int, height: int, overlap: int = FIXED_OVERLAP, reason: Optional[str] = None) -> CropPlan:
+    """Original layout: exact thirds with a fixed overlap."""
+    section_height = height // 3
+    boxes = [
+        (0, 0, width, section_height + overlap),
+        (0, section_height - overlap, width, 2 * section_height + overlap),
+        (0, 2 * section_height - overlap, width, height),
+    ]
+    sections = [CropSection(*names, box) for names, box in zip(_section_names(3), boxes)]
+    return CropPlan(sections=sections, adaptive=False, fallback_reason=reason,
+                    pixel_ratio=round(sum((b[3] - b[1]) * b[2] for b in boxes) / (width * height), 3))
+
+
+def _runs(values: list[float], threshold: float) -> list[tuple[int, int]]:
+    """[start, end) index runs where value > threshold."""
+    runs = []
+    start = None
+    for i, value in enumerate(values):
+        if value > threshold and start is None:
+            start = i
+        elif value <= threshold and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(values)))
+    return runs
+
+
+def _ink_mask(img: Image.Image) -> Optional[Image.Image]:
+    """Small binary image (255 = ink) for projection profiles, or None if the page has no clear background."""
+    size = (min(img.width, PROFILE_MAX_WIDTH), min(img.height, PROFILE_MAX_HEIGHT))
+    small = img.resize(size, Image.Resampling.BOX).convert("L")
+    histogram = small.histogram()
+    half = size[0] * size[1] / 2
+    seen = 0
+    median = 255
+    for level, count in enumerate(histogram):
+        seen += count
+        if seen >= half:
+            median = level
+            break
+    if median < MIN_BACKGROUND:
+        return None
+    threshold = median - INK_CONTRAST
+    mask = small.point(lambda v: 255 if v < threshold else 0)
+
+    # Dark scan edges and full-width rules would make every row/column look like text
+    for start, end in _runs(_profile(mask, "cols"), BORDER_INK_FRACTION):
+        mask.paste(0, (start, 0, end, mask.height))
+    for start, end in _runs(_profile(mask, "rows"), BORDER_INK_FRACTION):
+        mask.paste(0, (0, start, mask.width, end))
+    return mask
+
+
+def _profile(mask: Image.Image, axis: str) -> list[float]:
+    """Ink fraction per row (axis="rows") or per column (axis="cols")."""
+    size = (1, mask.height) if axis == "rows" else (mask.width, 1)
+    return [v / 255 for v in mask.resize(size, Image.Resampling.BOX).getdata()]
+
+
+def _text_lines(mask: Image.Image) -> list[tuple[int, int]]:
+    """Text lines = runs of ink rows (a one-row gap is noise inside a line)."""
+    lines: list[tuple[int, int]] = []
+    for start, end in _runs(_profile(mask, "rows"), ROW_INK_FRACTION):
+        if lines and start - lines[-1][1] <= 1:
+            lines[-1] = (lines[-1][0], end)
+        else:
+            lines.append((start, end))
+    return lines
+
+
+def _blocks(lines: list[tuple[int, int]], blank_rows: float) -> list[list[tuple[int, int]]]:
+    """Group lines into blocks separated by blank bands, at most MAX_CROPS blocks."""
+    blocks = [[lines[0]]]
+    for line in lines[1:]:
+        if line[0] - blocks[-1][-1][1] > blank_rows:
+            blocks.append([line])
+        else:
+            blocks[-1].append(line)
+    while len(blocks) > MAX_CROPS:
+        # Merge across the narrowest blank band
+        i = min(range(len(blocks) - 1), key=lambda j: blocks[j + 1][0][0] - blocks[j][-1][1])
+        blocks[i:i + 2] = [blocks[i] + blocks[i + 1]]
+    return blocks
+
+
+def _allocate(heights: list[int], count: int) -> list[int]:
+    """Split `count` crops over blocks proportionally to height (>= 1 each, MIN_CROPS..MAX_CROPS total)."""
+    total = sum(heights) or 1
+    shares = [max(1, round(count * h / total)) for h in heights]
+    while sum(shares) > MAX_CROPS:
+        shares[max(range(len(shares)), key=lambda i: shares[i])] -= 1
+    while sum(shares) < MIN_CROPS:
+        shares[max(range(len(shares)), key=lambda i: heights[i])] += 1
+    return shares
+
+
+def _split_block(lines: list[tuple[int, int]], parts: int, overlap_rows: int) -> tuple[list[tuple[int, int]], int]:
+    """
+    Split a block of lines into `parts` row segments, cutting in whitespace.
+
+    Returns:
+        Tuple of (segments as (top, bottom) profile rows, number of whitespace cuts)
+    """
+    top, bottom = lines[0][0], lines[-1][1]
+    gaps = [(lines[i][1], lines[i + 1][0]) for i in range(len(lines) - 1)]
+    window = (bottom - top) / parts / 2
+    bounds = [top]
+    whitespace_cuts = 0
+    for k in range(1, parts):
+        target = top + (bottom - top) * k / parts
+        # Closest gap to the even split within half a crop; wider gaps win ties
+        candidates = [g for g in gaps if abs((g[0] + g[1]) / 2 - target) <= window and g[0] >= bounds[-1]]
+        if candidates:
+            gap = min(candidates, key=lambda g: (abs((g[0] + g[1]) / 2 - target), -(g[1] - g[0])))
+            bounds += [gap[0], gap[1]]
+            whitespace_cuts += 1
+        else:
+            # Dense or skewed text: split mid-line with the fixed overlap
+            row = int(target)
+            bounds += [row + overlap_rows, row - overlap_rows]
+    bounds.append(bottom)
+    return [(bounds[i], bounds[i + 1]) for i in range(0, len(bounds), 2)], whitespace_cuts
+
+
+def plan_crops(img: Image.Image, overlap: int = FIXED_OVERLAP) -> CropPlan:
+    """
+    Choose crop boxes for a decoded page.
+
+    Args:
+        img: Decoded page (RGB or L)
+        overlap: Overlap used where no whitespace gap is available
+
+    Returns:
+        CropPlan with boxes in img coordinates
+    """
+    width, height = img.size
+    if not ADAPTIVE_CROPS:
+        return fixed_thirds(width, height, overlap)
+
+    mask = _ink_mask(img)
+    if mask is None:
+        return fixed_thirds(width, height, overlap, reason="no_background")
+    lines = _text_lines(mask)
+    if not lines:
+        return fixed_thirds(width, height, overlap, reason="no_text")
+    scale_x = width / mask.width
+    scale_y = height / mask.height
+
+    # Crop count from text height (blank bands excluded) and line count
+    blocks = _blocks(lines, BLANK_BAND_FRACTION * mask.height)
+    heights = [block[-1][1] - block[0][0] for block in blocks]
+    count = max(
+        math.ceil(sum(heights) * scale_y / (width * CROP_MAX_ASPECT)),
+        math.ceil(len(lines) / CROP_MAX_LINES)
+    )
+    count = max(MIN_CROPS, min(MAX_CROPS, count))
+
+    segments: list[tuple[int, int]] = []
+    whitespace_cuts = 0
+    overlap_rows = max(1, math.ceil(overlap / scale_y))
+    for block, parts in zip(blocks, _allocate(heights, count)):
+        block_segments, cuts = _split_block(block, parts, overlap_rows)
+        segments += block_segments
+        whitespace_cuts += cuts
+
+    # Trim every segment to its ink; blank segments are not uploaded
+    pad_x = int(width * PAD_FRACTION)
+    pad_y = int(width * PAD_FRACTION)
+    boxes: list[tuple[int, int, int, int]] = []
+    for seg_top, seg_bottom in segments:
+        if seg_bottom <= seg_top:
+            continue
+        band = mask.crop((0, seg_top, mask.width, seg_bottom))
+        rows = _runs(_profile(band, "rows"), ROW_INK_FRACTION)
+        cols = _runs(_profile(band, "cols"), COL_INK_FRACTION)
+        if not rows or not cols:
+            continue
+        boxes.append((
+            max(0, int(cols[0][0] * scale_x) - pad_x),
+            max(0, int((seg_top + rows[0][0]) * scale_y) - pad_y),
+            min(width, math.ceil(cols[-1][1] * scale_x) + pad_x),
+            min(height, math.ceil((seg_top + rows[-1][1]) * scale_y) + pad_y),
+        ))
+
+    if len(boxes) < MIN_CROPS:
+        return fixed_thirds(width, height, overlap, reason="too_few_sections")
+
+    sections = [CropSection(*names, box) for names, box in zip(_section_names(len(boxes)), boxes)]
+    pixels = sum((b[2] - b[0]) * (b[3] - b[1]) for b in boxes)
+    return CropPlan(
+        sections=sections,
+        adaptive=True,
+        lines=len(lines),
+        whitespace_cuts=whitespace_cuts,
+        pixel_ratio=round(pixels / (width * height), 3),
+        detail={"blocks": len(blocks)}
+    )
@@ -0,0 +1,135 @@
+"""
+Request deadlines and graceful stage skipping.
+
+Callers have their own budgets (the backend gives up after 300 s, the
+review UI much sooner) but the service used to run every stage regardless
+and answer 504 when it ran out of time. A caller can now send its deadline
+(X-Request-Deadline header, or deadline_seconds on the job API); the worker
+checks the remaining budget before each optional stage and skips it when the
+remainder cannot cover the stage's p95 duration:
+
+    tier          stages run
+    multi_scale   Full OCR + section crops OCR + LLM merge   (no deadline: always)
+    full_llm      Full OCR + LLM merge                       (crops skipped)
+    full_only     Full OCR                                   (LLM skipped or cut off)
+
+A batch request with a token_budget (cost.TokenBudget) caps the tier
+instead: once its budget is used up, the remaining pages run full_only.
+
+Stage p95s are rolling values measured by the main process from worker
+meta["stages"]; until enough samples exist the defaults below are used.
+"""
+
+from __future__ import annotations
+import os
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+DEADLINE_HEADER = "X-Request-Deadline"
+STAGES = ("full_ocr", "crop_ocr", "llm")
+TIERS = ("multi_scale", "full_llm", "full_only")
+
+# Cold-start p95 estimates (seconds), replaced by measurements after STAGE_MIN_SAMPLES pages
+DEFAULT_P95_SECONDS = {
+    "full_ocr": float(os.environ.get('OCR_P95_FULL_OCR_SECONDS', '15')),
+    "crop_ocr": float(os.environ.get('OCR_P95_CROP_OCR_SECONDS', '15')),
+    "llm": float(os.environ.get('OCR_P95_LLM_SECONDS', '30')),
+}
+STAGE_WINDOW = 200
+STAGE_MIN_SAMPLES = 20
+# Kept free for returning the response after the last stage
+DEADLINE_MARGIN_SECONDS = float(os.environ.get('OCR_DEADLINE_MARGIN_SECONDS', '1.0'))
+# Header values above this are absolute Unix timestamps, below it relative seconds
+_EPOCH_THRESHOLD = 1_000_000_000
+
+
+def parse_deadline(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    Parse an X-Request-Deadline value into an absolute Unix timestamp.
+
+    Accepts relative seconds ("25", "2.5") or an absolute Unix timestamp
+    ("1761300000.5").
+
+    Raises:
+        ValueError: Not a positive number
+    """
+    if value is None or str(value).strip() == "":
+        return None
+    seconds = float(value)
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError(f"{DEADLINE_HEADER} must be a positive number of seconds or a Unix timestamp")
+    if seconds >= _EPOCH_THRESHOLD:
+        return seconds
+    return (now or time.time()) + seconds
+
+
+@dataclass
+class Budget:
+    """Deadline plus stage p95s, handed to the worker with the page (picklable)."""
+    deadline: Optional[float] = None            # Unix timestamp, None = unbounded
+    p95: dict = field(default_factory=lambda: dict(DEFAULT_P95_SECONDS))
+    margin: float = DEADLINE_MARGIN_SECONDS
+    max_tier: str = "multi_scale"               # Most expensive tier allowed (token budget)
+
+    def remaining(self) -> float:
+        if self.deadline is None:
+            return math.inf
+        return self.deadline - time.time() - self.margin
+
+    def can_afford(self, seconds: float) -> bool:
+        return self.remaining() >= seconds
+
+    def plan_tier(self) -> str:
+        """Tier to start with: crops only if Full/crops in parallel plus the LLM still fit."""
+        ocr = max(self.p95["full_ocr"], self.p95["crop_ocr"])
+        if self.can_afford(ocr + self.p95["llm"]):
+            tier = "multi_scale"
+        elif self.can_afford(self.p95["full_ocr"] + self.p95["llm"]):
+            tier = "full_llm"
+        else:
+            tier = "full_only"
+        return max(tier, self.max_tier, key=TIERS.index)
+
+    def allows_llm(self) -> bool:
+        """LLM merge within the tier cap and the remaining time."""
+        return self.max_tier != "full_only" and self.can_afford(self.p95["llm"])
+
+    def skip_reason(self, stage: str) -> str:
+        """Why a stage was skipped: the token budget cap, else the deadline."""
+        capped = self.max_tier == "full_only" or (stage == "crop_ocr" and self.max_tier != "multi_scale")
+        return "token_budget" if capped else "deadline"
+
+
+class StageTimings:
+    """Rolling per-stage durations reported by workers (main process)."""
+
+    def __init__(self, window: int = STAGE_WINDOW):
+        self._samples: dict[str, deque] = {stage: deque(maxlen=window) for stage in STAGES}
+
+    def record(self, stages: Optional[dict]) -> None:
+        for stage, seconds in (stages or {}).items():
+            if stage in self._samples and seconds is not None:
+                self._samples[stage].append(seconds)
+
+    def p95(self) -> dict[str, float]:
+        result = {}
+        for stage, samples in self._samples.items():
+            if len(samples) < STAGE_MIN_SAMPLES:
+                result[stage] = DEFAULT_P95_SECONDS[stage]
+            else:
+                ordered = sorted(samples)
+                result[stage] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3)
+        return result
+
+    def budget(self, deadline: Optional[float]) -> Budget:
+        return Budget(deadline=deadline, p95=self.p95())
+
+    def stats(self) -> dict:
+        return {
+            "p95_seconds": self.p95(),
+            "samples": {stage: len(samples) for stage, samples in self._samples.items()}
+        }
@@ -0,0 +1,211 @@
+"""
+Priority lanes in front of the OCR process pool.
+
+The pool used to be a single FIFO: an interactive re-OCR of one page from
+the review UI waited behind every page of a bulk stage-01 run that arrived
+first. Now pages wait here, and only as many pages as there are workers are
+handed to the pool, so the dispatcher decides what runs next:
+
+    - Lanes: interactive, normal, bulk
+    - Weighted dispatch between lanes with waiting pages (smooth weighted
+      round-robin, default 8:3:1), so bulk keeps moving under interactive load
+    - Starvation protection: a page that has waited LANE_MAX_WAIT_SECONDS
+      goes next regardless of lane or size
+    - Within a lane, optional shortest-job-first by estimated cost (job_cost:
+      encoded image size - denser pages compress worse and produce more
+      tokens - weighted by the tier the page is planned to run at)
+
+Pure asyncio, single event loop; no locks needed.
+"""
+
+from __future__ import annotations
+import os
+import time
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Literal, Optional
+
+
+LANES = ("interactive", "normal", "bulk")
+DEFAULT_LANE = "normal"
+Priority = Literal["interactive", "normal", "bulk"]
+
+
+def _parse_weights(spec: str) -> dict[str, int]:
+    """"interactive=8,normal=3,bulk=1" -> {lane: weight}; missing lanes get weight 1."""
+    weights = {lane: 1 for lane in LANES}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        lane, value = part.split("=", 1)
+        if lane.strip() in weights:
+            weights[lane.strip()] = max(1, int(value))
+    return weights
+
+
+LANE_WEIGHTS = _parse_weights(os.environ.get('OCR_LANE_WEIGHTS', 'interactive=8,normal=3,bulk=1'))
+# A page waiting this long is dispatched next, whatever its lane or size
+LANE_MAX_WAIT_SECONDS = float(os.environ.get('OCR_LANE_MAX_WAIT_SECONDS', '60'))
+SJF_ENABLED = os.environ.get('OCR_SJF', 'true').lower() in ('1', 'true', 'yes')
+# Relative work per tier: multi_scale adds the section crops (OCR calls + crop encoding) to the
+# Full Image OCR, full_llm adds the LLM merge (in the pool slot unless the stages are split)
+TIER_COST_FACTORS = {"multi_scale": 2.0, "full_llm": 1.2, "full_only": 1.0}
+
+
+def job_cost(image_bytes: int, tier: Optional[str] = None) -> float:
+    """SJF cost of a page: encoded size times its planned tier's factor (None = multi_scale)."""
+    return image_bytes * TIER_COST_FACTORS.get(tier or "multi_scale", 1.0)
+
+
+@dataclass
+class _Waiter:
+    lane: str
+    cost: float
+    seq: int
+    enqueued_at: float
+    future: asyncio.Future = field(repr=False)
+
+
+class PriorityDispatcher:
+    """
+    Admit at most `slots` pages into the pool, choosing the next by lane and size.
+
+    Usage:
+        async with dispatcher.slot("interactive", cost=job_cost(len(image_data), tier)):
+            await loop.run_in_executor(process_pool, ...)
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        weights: Optional[dict[str, int]] = None,
+        max_wait_seconds: float = LANE_MAX_WAIT_SECONDS,
+        sjf: bool = SJF_ENABLED
+    ):
+        self.slots = slots
+        self.weights = weights or LANE_WEIGHTS
+        self.max_wait_seconds = max_wait_seconds
+        self.sjf = sjf
+        self.running = 0
+        self._queues: dict[str, list[_Waiter]] = {lane: [] for lane in LANES}
+        self._credit: dict[str, int] = {lane: 0 for lane in LANES}
+        self._seq = itertools.count()
+        self._stats = {lane: {"dispatched": 0, "waited_seconds": 0.0, "max_wait_seconds": 0.0} for lane in LANES}
+        self.aged = 0
+
+    @staticmethod
+    def lane(priority: Optional[str]) -> str:
+        """Validate a priority class (None = DEFAULT_LANE)."""
+        if priority is None:
+            return DEFAULT_LANE
+        if priority not in LANES:
+            raise ValueError(f"Invalid priority '{priority}', expected one of {', '.join(LANES)}")
+        return priority
+
+    def _pick_lane(self) -> Optional[str]:
+        """Smooth weighted round-robin over lanes that have waiting pages."""
+        active = [lane for lane in LANES if self._queues[lane]]
+        if not active:
+            return None
+        total = 0
+        for lane in active:
+            self._credit[lane] += self.weights[lane]
+            total += self.weights[lane]
+        chosen = max(active, key=lambda lane: self._credit[lane])
+        self._credit[chosen] -= total
+        return chosen
+
+    def _next(self) -> Optional[_Waiter]:
+        now = time.monotonic()
+        waiting = [w for queue in self._queues.values() for w in queue]
+        if not waiting:
+            return None
+
+        # Starvation protection: the oldest overdue page goes first
+        overdue = [w for w in waiting if now - w.enqueued_at >= self.max_wait_seconds]
+        if overdue:
+            self.aged += 1
+            return min(overdue, key=lambda w: w.seq)
+
+        queue = self._queues[self._pick_lane()]
+        if self.sjf:
+            return min(queue, key=lambda w: (w.cost, w.seq))
+        return min(queue, key=lambda w: w.seq)
+
+    def _dispatch(self) -> None:
+        while self.running < self.slots:
+            waiter = self._next()
+            if waiter is None:
+                return
+            self._queues[waiter.lane].remove(waiter)
+            if waiter.future.done():
+                continue  # Cancelled while waiting
+            self._grant(waiter.lane, time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def _grant(self, lane: str, waited: float) -> None:
+        self.running += 1
+        stats = self._stats[lane]
+        stats["dispatched"] += 1
+        stats["waited_seconds"] += waited
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def _release(self) -> None:
+        self.running -= 1
+        self._dispatch()
+
+    def resize(self, slots: int) -> None:
+        """Change the number of slots (pool resized); pages already running keep theirs."""
+        self.slots = slots
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: str = DEFAULT_LANE, cost: float = 0.0):
+        """Wait for a pool slot in the given lane; cost orders pages within the lane (SJF)."""
+        lane = self.lane(lane)
+        idle = self.running < self.slots and not any(self._queues.values())
+        if idle:
+            self._grant(lane, 0.0)
+        else:
+            waiter = _Waiter(lane, cost, next(self._seq), time.monotonic(),
+                             asyncio.get_running_loop().create_future())
+            self._queues[lane].append(waiter)
+            self._dispatch()
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter in self._queues[lane]:
+                    self._queues[lane].remove(waiter)
+                elif not waiter.future.cancelled():
+                    self._release()  # Granted just before the cancel
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        lanes = {}
+        for lane in LANES:
+            stats = self._stats[lane]
+            dispatched = stats["dispatched"]
+            lanes[lane] = {
+                "weight": self.weights[lane],
+                "waiting": len(self._queues[lane]),
+                "dispatched": dispatched,
+                "mean_wait_seconds": round(stats["waited_seconds"] / dispatched, 3) if dispatched else None,
+                "max_wait_seconds": round(stats["max_wait_seconds"], 3)
+            }
+        now = time.monotonic()
+        oldest = min((w.enqueued_at for queue in self._queues.values() for w in queue), default=None)
+        return {
+            "slots": self.slots,
+            "running": self.running,
+            "sjf": self.sjf,
+            "max_wait_seconds": self.max_wait_seconds,
+            "aged_dispatches": self.aged,
+            "oldest_wait_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "lanes": lanes
+        }
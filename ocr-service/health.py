@@ -0,0 +1,112 @@
+"""
+Liveness and readiness checks.
+
+/health used to answer "healthy" whatever the state of the instance, so the
+load balancer kept routing to replicas whose pool was broken, whose lanes
+were hundreds of pages deep or whose keys were all throttled.
+
+    - Liveness (GET /health/live): the event loop answers and the process
+      pool is not stuck broken (a rebuild that keeps failing) - restart me
+    - Readiness (GET /health/ready): worth sending new traffic to - pool
+      ready, waiting pages within OCR_READY_MAX_QUEUE_FACTOR x slots, not
+      every tracked key's OCR breaker open, recent error rate below
+      OCR_READY_MAX_ERROR_RATE
+
+Checks are pure functions over the stats the main process already keeps.
+"""
+
+from __future__ import annotations
+import os
+import time
+from collections import deque
+from typing import Optional
+
+
+READY_MAX_QUEUE_FACTOR = float(os.environ.get('OCR_READY_MAX_QUEUE_FACTOR', '4'))
+READY_MAX_ERROR_RATE = float(os.environ.get('OCR_READY_MAX_ERROR_RATE', '0.5'))
+READY_ERROR_WINDOW_SECONDS = float(os.environ.get('OCR_READY_ERROR_WINDOW_SECONDS', '60'))
+READY_MIN_REQUESTS = int(os.environ.get('OCR_READY_MIN_REQUESTS', '10'))
+# A pool broken (rebuilds failing) this long fails liveness
+LIVE_MAX_BROKEN_SECONDS = float(os.environ.get('OCR_LIVE_MAX_BROKEN_SECONDS', '120'))
+
+
+class OutcomeWindow:
+    """Rolling window of pipeline outcomes (True = success) for the error-rate check."""
+
+    def __init__(self, window_seconds: float = READY_ERROR_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._outcomes: deque[tuple[float, bool]] = deque()
+
+    def record(self, ok: bool) -> None:
+        self._outcomes.append((time.monotonic(), ok))
+        self._prune()
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def counts(self) -> tuple[int, int]:
+        """(requests, errors) within the window."""
+        self._prune()
+        return len(self._outcomes), sum(1 for _, ok in self._outcomes if not ok)
+
+
+def check_liveness(pool: dict) -> tuple[bool, dict]:
+    """
+    Liveness from the pool lifecycle state ({state, broken_since, ...}).
+
+    Returns:
+        Tuple of (alive, checks)
+    """
+    broken_since = pool.get("broken_since")
+    broken_for = time.time() - broken_since if broken_since else 0.0
+    alive = pool["state"] != "broken" or broken_for < LIVE_MAX_BROKEN_SECONDS
+    return alive, {"pool": {"ok": alive, "state": pool["state"], "broken_seconds": round(broken_for, 1)}}
+
+
+def check_readiness(
+    pool: dict,
+    dispatch: Optional[dict],
+    breakers: Optional[dict],
+    outcomes: OutcomeWindow
+) -> tuple[bool, dict]:
+    """
+    Readiness from pool state, lane backlog, key health and recent errors.
+
+    Args:
+        pool: Pool lifecycle state ({state, ...})
+        dispatch: PriorityDispatcher.stats() (None before startup)
+        breakers: BreakerBoard.stats() (None when breakers are disabled)
+        outcomes: Recent pipeline outcomes
+
+    Returns:
+        Tuple of (ready, checks) - every check has "ok" plus its numbers
+    """
+    checks: dict[str, dict] = {"pool": {"ok": pool["state"] == "ready", "state": pool["state"]}}
+
+    if dispatch is None:
+        checks["queue"] = {"ok": False, "waiting": None, "limit": None}
+    else:
+        waiting = sum(lane["waiting"] for lane in dispatch["lanes"].values())
+        limit = int(dispatch["slots"] * READY_MAX_QUEUE_FACTOR)
+        checks["queue"] = {"ok": waiting <= limit, "waiting": waiting, "running": dispatch["running"], "limit": limit}
+
+    if breakers is None:
+        checks["keys"] = {"ok": True, "tracked": None, "open": None}
+    else:
+        ocr = [b for b in breakers["breakers"] if b["endpoint"] == "ocr"]
+        blocked = sum(1 for b in ocr if b["state"] == "open")
+        # Half-open keys still take probe traffic, so only fully open keys count
+        checks["keys"] = {"ok": not ocr or blocked < len(ocr), "tracked": len(ocr), "open": blocked}
+
+    requests, errors = outcomes.counts()
+    rate = errors / requests if requests else 0.0
+    checks["errors"] = {
+        "ok": requests < READY_MIN_REQUESTS or rate < READY_MAX_ERROR_RATE,
+        "requests": requests,
+        "errors": errors,
+        "rate": round(rate, 3),
+        "window_seconds": outcomes.window_seconds
+    }
+    return all(check["ok"] for check in checks.values()), checks
@@ -0,0 +1,149 @@
+"""
+Long-lived pooled HTTP clients for the Typhoon OCR and chat APIs.
+
+Each pool worker process keeps one httpx connection pool (HTTP/1.1
+keep-alive, or HTTP/2 when enabled) shared by one OpenAI client per
+(base_url, api_key). Connections to api.opentyphoon.ai are reused across
+region calls and pages instead of paying TCP + TLS handshakes on every call.
+
+Connection reuse is measured with httpcore trace events: every request is
+counted, and every completed TCP connect is a new connection.
+
+With OCR_CASSETTE_MODE=record|replay the pool's transport records the API
+traffic or replays it offline (see cassette.py).
+"""
+
+from __future__ import annotations
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import httpx
+from openai import OpenAI
+
+import cassette
+
+logger = logging.getLogger(__name__)
+
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get('OCR_HTTP_MAX_CONNECTIONS', '16'))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get('OCR_HTTP_KEEPALIVE_SECONDS', '120'))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get('OCR_HTTP_TIMEOUT_SECONDS', '300'))
+HTTP2_ENABLED = os.environ.get('OCR_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+HTTP_PREWARM_CONNECTIONS = int(os.environ.get('OCR_HTTP_PREWARM_CONNECTIONS', '4'))
+
+
+class PooledClients:
+    """Per-process connection pool plus cached OpenAI clients per key."""
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        keepalive_seconds: float = HTTP_KEEPALIVE_SECONDS,
+        timeout_seconds: float = HTTP_TIMEOUT_SECONDS,
+        http2: bool = HTTP2_ENABLED
+    ):
+        self.max_connections = max_connections
+        self.keepalive_seconds = keepalive_seconds
+        self.http2 = http2
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._new_connections = 0
+        self._clients: dict[tuple[str, str], OpenAI] = {}
+
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("OCR_HTTP2=true but the 'h2' package is missing - using HTTP/1.1 keep-alive")
+                self.http2 = False
+
+        self.transport = cassette.wrap_transport(httpx.HTTPTransport(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_seconds
+            )
+        ))
+        self.http = httpx.Client(
+            transport=self.transport,
+            timeout=httpx.Timeout(timeout_seconds, connect=10.0),
+            event_hooks={"request": [self._on_request]}
+        )
+
+    def _trace(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self._new_connections += 1
+
+    def _on_request(self, request: httpx.Request) -> None:
+        request.extensions["trace"] = self._trace
+        with self._lock:
+            self._requests += 1
+
+    def openai(self, api_key: str, base_url: str) -> OpenAI:
+        """OpenAI client for this key, sharing the process-wide connection pool."""
+        cache_key = (base_url, api_key)
+        with self._lock:
+            client = self._clients.get(cache_key)
+            if client is None:
+                client = OpenAI(base_url=base_url, api_key=api_key, http_client=self.http)
+                self._clients[cache_key] = client
+        return client
+
+    def prewarm(self, base_url: str, connections: int = HTTP_PREWARM_CONNECTIONS) -> int:
+        """
+        Open `connections` keep-alive connections to the API host.
+
+        Any HTTP response (even 401/404) leaves a warmed TLS connection in the
+        pool. Failures are ignored - warming is best effort.
+
+        Returns:
+            Number of connections that completed a request
+        """
+        if connections <= 0:
+            return 0
+
+        def touch(_: int) -> bool:
+            try:
+                self.http.get(f"{base_url.rstrip('/')}/models", timeout=10.0)
+                return True
+            except Exception as e:
+                logger.debug(f"Connection pre-warm failed: {e}")
+                return False
+
+        # Concurrent requests force distinct connections
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            return sum(executor.map(touch, range(connections)))
+
+    def stats(self) -> dict:
+        """Cumulative counters for this process."""
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "new_connections": self._new_connections,
+                "clients": len(self._clients)
+            }
+
+    def config(self) -> dict:
+        return {
+            "max_connections": self.max_connections,
+            "keepalive_seconds": self.keepalive_seconds,
+            "http2": self.http2,
+            "cassette": cassette.CASSETTE_MODE if isinstance(self.transport, cassette.CassetteTransport) else None
+        }
+
+
+_pool: Optional[PooledClients] = None
+
+
+def get_pool() -> PooledClients:
+    """Process-wide pool (created on first use)."""
+    global _pool
+    if _pool is None:
+        _pool = PooledClients()
+    return _pool
+
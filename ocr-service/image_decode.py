@@ -0,0 +1,177 @@
+"""
+Memory-bounded image decoding for the OCR workers.
+
+Typhoon OCR never sees more than TARGET_SIDE pixels on the longest side of a
+region, but phone photos from uploaders are often 40+ MP. Decoding those at
+full size (plus an RGBA copy and three crop copies) in five workers at once
+is what got workers OOM-killed.
+
+Decode policy:
+    - Work out the smallest resolution that still gives every region (full
+      page and each crop) TARGET_SIDE pixels on its longest side
+    - JPEG: decode straight to that resolution with draft mode (DCT scaling
+      by 1/2, 1/4 or 1/8 - the full-size bitmap is never allocated)
+    - Other formats: full decode, then an integer reduce() and the original
+      is released right away
+    - Alpha is flattened on white after the reduction, not before
+
+The main process uses probe() + estimate_task_bytes() from the header alone
+(no pixel decode) to reserve memory before a page is sent to a worker, see
+MemoryBudget in main.py.
+"""
+
+from __future__ import annotations
+import io
+import os
+import gc
+import ctypes
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+# Longest side sent to Typhoon OCR (typhoon_client.TARGET_IMAGE_DIM)
+TARGET_SIDE = int(os.environ.get('OCR_DECODE_TARGET_SIDE', '1800'))
+# Region buffers resized + encoded at the same time inside one worker (Full + 3 crops;
+# adaptive crops are at most half as tall as wide, so up to 6 fit the same budget)
+CONCURRENT_REGIONS = 4
+# Per-worker memory budget for one page (decoded bitmap + region buffers)
+WORKER_MEMORY_MB = int(os.environ.get('OCR_WORKER_MEMORY_MB', '512'))
+
+_BANDS = {"1": 1, "L": 1, "P": 1, "LA": 2, "RGB": 3, "YCbCr": 3, "RGBA": 4, "CMYK": 4, "I": 4, "F": 4, "I;16": 2}
+_JPEG_REDUCTIONS = (8, 4, 2, 1)
+
+
+@dataclass
+class ImageInfo:
+    """Header-only facts about an encoded image."""
+    width: int
+    height: int
+    format: Optional[str]
+    mode: str
+
+    @property
+    def bands(self) -> int:
+        return _BANDS.get(self.mode, 4)
+
+
+def probe(image_data: bytes) -> ImageInfo:
+    """Read size/format/mode from the image header without decoding pixels."""
+    with Image.open(io.BytesIO(image_data)) as img:
+        return ImageInfo(img.width, img.height, img.format, img.mode)
+
+
+def required_scale(width: int, height: int, sections: int = 3, target_side: int = TARGET_SIDE) -> float:
+    """
+    Smallest scale (<= 1) at which every region still reaches target_side.
+
+    Crops span the full width and 1/sections of the height, so the crop with
+    the shortest longest-side decides.
+    """
+    crop_longest = max(width, height / max(sections, 1))
+    return min(1.0, target_side / crop_longest) if crop_longest > 0 else 1.0
+
+
+def _page_bytes(info: ImageInfo, factor: int, target_side: int) -> int:
+    reduced = -(-info.width // factor) * -(-info.height // factor) * info.bands
+    full = 0 if info.format == "JPEG" or factor == 1 else info.width * info.height * info.bands
+    return full + reduced + CONCURRENT_REGIONS * target_side * target_side * 3
+
+
+def reduction_factor(
+    info: ImageInfo,
+    sections: int = 3,
+    target_side: int = TARGET_SIDE,
+    budget_bytes: int = WORKER_MEMORY_MB * 1024 * 1024
+) -> int:
+    """
+    Integer downscale applied while decoding (1 = full size).
+
+    JPEGs that would still exceed the per-worker budget at the quality-preserving
+    scale are decoded one draft step smaller (up to 1/8) rather than risking OOM.
+    """
+    scale = required_scale(info.width, info.height, sections, target_side)
+    wanted = (max(1, int(info.width * scale)), max(1, int(info.height * scale)))
+    factor = min(info.width // wanted[0], info.height // wanted[1])
+    if info.format != "JPEG":
+        return max(1, factor)
+
+    # Same choice as JpegImageFile.draft()
+    factor = next(s for s in _JPEG_REDUCTIONS if factor >= s)
+    while factor < _JPEG_REDUCTIONS[0] and _page_bytes(info, factor, target_side) > budget_bytes:
+        factor *= 2
+    return factor
+
+
+def estimate_task_bytes(info: ImageInfo, sections: int = 3, target_side: int = TARGET_SIDE) -> int:
+    """
+    Estimated peak image memory of one page inside a worker.
+
+    Decoded bitmap at the reduced size (plus the full-size bitmap for formats
+    without draft decoding) and the resized RGB region buffers.
+    """
+    return _page_bytes(info, reduction_factor(info, sections, target_side), target_side)
+
+
+def decode_for_ocr(
+    image_data: bytes,
+    sections: int = 3,
+    target_side: int = TARGET_SIDE
+) -> tuple[Image.Image, dict]:
+    """
+    Decode an image at the smallest resolution that keeps OCR quality.
+
+    Args:
+        image_data: Encoded image bytes
+        sections: Number of horizontal crops the page will be cut into
+        target_side: Longest side each region is sent at
+
+    Returns:
+        Tuple of (image in RGB or L mode, decode stats dict)
+    """
+    img = Image.open(io.BytesIO(image_data))
+    info = ImageInfo(img.width, img.height, img.format, img.mode)
+    factor = reduction_factor(info, sections, target_side)
+
+    if info.format == "JPEG" and factor > 1:
+        img.draft(img.mode, (info.width // factor, info.height // factor))
+        img.load()
+    else:
+        img.load()
+        if factor > 1:
+            reduced = img.reduce(factor)
+            img.close()
+            img = reduced
+
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        img.close()
+        flattened = Image.new("RGB", rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.getchannel("A"))
+        rgba.close()
+        img = flattened
+    elif img.mode not in ("RGB", "L"):
+        converted = img.convert("RGB")
+        img.close()
+        img = converted
+
+    stats = {
+        "source_size": [info.width, info.height],
+        "decoded_size": list(img.size),
+        "reduction": factor,
+        "decoded_mb": round(img.width * img.height * len(img.getbands()) / 1024 / 1024, 1)
+    }
+    return img, stats
+
+
+def release_memory() -> None:
+    """Collect garbage and hand freed heap pages back to the OS (glibc only)."""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
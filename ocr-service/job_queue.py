@@ -0,0 +1,477 @@
+"""
+Shared Postgres job queue for distributed OCR workers.
+
+Any service instance can accept page jobs (POST /jobs) and any instance
+running in worker mode can execute them, so one host's cores and memory no
+longer cap throughput.
+
+Protocol:
+    - Claim: UPDATE ... WHERE id = (SELECT ... FOR UPDATE SKIP LOCKED LIMIT 1)
+      so concurrent claimers never block on or double-claim the same row
+    - Lease: a claimed job is owned until lease_expires_at; the owner extends
+      it with heartbeats while the page is being processed
+    - Re-queue: every instance periodically returns jobs with expired leases
+      to 'queued' (crashed or partitioned worker), up to max_attempts
+    - Priority: jobs are claimed in claim_at order, set at enqueue to
+      created_at shifted by the priority class - interactive as if enqueued
+      priority_seconds earlier, bulk as if priority_seconds later - so bulk
+      is delayed, never starved; (status, claim_at) is indexed
+    - Completion: jobs that reach a final state are reported to on_finished
+      (webhook callbacks, see webhooks.py)
+
+Requires psycopg 3 (psycopg[binary,pool]); imported lazily so the service
+runs without it when the queue is not configured.
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS ocr_jobs (
+    id TEXT PRIMARY KEY,
+    batch_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    image BYTEA,
+    params JSONB NOT NULL,
+    result JSONB,
+    error TEXT,
+    error_type TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    lease_owner TEXT,
+    lease_expires_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    claim_at TIMESTAMPTZ,
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+ALTER TABLE ocr_jobs ADD COLUMN IF NOT EXISTS claim_at TIMESTAMPTZ;
+DROP INDEX IF EXISTS idx_ocr_jobs_queued;
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_claim ON ocr_jobs (status, claim_at);
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_running_lease ON ocr_jobs (lease_expires_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_batch ON ocr_jobs (batch_id);
+"""
+
+# Rows enqueued before claim_at existed: the priority shift the claim query used to apply
+BACKFILL_CLAIM_AT_SQL = """
+UPDATE ocr_jobs SET claim_at = created_at + make_interval(secs => CASE params->>'priority'
+           WHEN 'interactive' THEN -%s
+           WHEN 'bulk' THEN %s
+           ELSE 0 END)
+ WHERE claim_at IS NULL
+"""
+
+# Advisory lock key guarding CREATE TABLE/INDEX at startup
+SCHEMA_LOCK_ID = 0x0C5_0B5
+
+# Columns returned to API clients (never the image or the API keys)
+_STATUS_COLUMNS = (
+    "id, batch_id, item_id, status, result, error, error_type, attempts, "
+    "lease_owner, created_at, started_at, finished_at"
+)
+
+
+@dataclass
+class QueuedJob:
+    """A job claimed by this instance."""
+    id: str
+    batch_id: str
+    item_id: str
+    image: bytes
+    params: dict
+    attempts: int
+    max_attempts: int
+
+
+class JobQueue:
+    """Postgres-backed page job queue with leases and heartbeats."""
+
+    def __init__(
+        self,
+        dsn: str,
+        lease_seconds: float = 360.0,
+        max_attempts: int = 3,
+        pool_size: int = 10,
+        priority_seconds: float = 60.0
+    ):
+        self.dsn = dsn
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.priority_seconds = priority_seconds
+        self.pool_size = pool_size
+        self._pool = None
+
+    async def open(self) -> None:
+        """Open the connection pool and create the table if needed."""
+        from psycopg_pool import AsyncConnectionPool
+
+        self._pool = AsyncConnectionPool(self.dsn, min_size=1, max_size=self.pool_size, open=False)
+        await self._pool.open(wait=True)
+        async with self._pool.connection() as conn:
+            async with conn.transaction():
+                # Serialize schema creation when several instances start at once
+                await conn.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+                await conn.execute(SCHEMA_SQL)
+                await conn.execute(BACKFILL_CLAIM_AT_SQL, (self.priority_seconds, self.priority_seconds))
+        logger.info(f"Job queue ready (lease {self.lease_seconds:.0f}s, max attempts {self.max_attempts})")
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _fetchall(self, sql: str, params: tuple = ()) -> list[dict]:
+        from psycopg.rows import dict_row
+
+        async with self._pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(sql, params)
+                return await cur.fetchall() if cur.description else []
+
+    # -------------------------------------------------------------------------
+    # Producer side
+    # -------------------------------------------------------------------------
+
+    async def enqueue(
+        self,
+        items: list[tuple[str, bytes]],
+        params: dict,
+        batch_id: Optional[str] = None,
+        item_params: Optional[dict[str, dict]] = None
+    ) -> tuple[str, list[tuple[str, str]]]:
+        """
+        Insert one job per page.
+
+        Args:
+            items: [(item_id, image_bytes), ...]
+            params: Pipeline parameters shared by all pages (api_key, task_type, ...)
+            batch_id: Existing batch to append to (a new one is created if None)
+            item_params: Per-item overrides merged into params ({item_id: {...}})
+
+        Returns:
+            Tuple of (batch_id, [(item_id, job_id), ...])
+        """
+        from psycopg.types.json import Jsonb
+
+        batch_id = batch_id or uuid.uuid4().hex
+        jobs = [(item_id, uuid.uuid4().hex, image, {**params, **(item_params or {}).get(item_id, {})})
+                for item_id, image in items]
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(
+                    "INSERT INTO ocr_jobs (id, batch_id, item_id, image, params, max_attempts, claim_at) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, now() + make_interval(secs => %s))",
+                    [(job_id, batch_id, item_id, image, Jsonb(job_params), self.max_attempts,
+                      self._priority_shift(job_params.get("priority")))
+                     for item_id, job_id, image, job_params in jobs]
+                )
+        return batch_id, [(item_id, job_id) for item_id, job_id, _, _ in jobs]
+
+    def _priority_shift(self, priority: Optional[str]) -> float:
+        """Seconds added to the enqueue time to get a job's place in the claim order."""
+        return {"interactive": -self.priority_seconds, "bulk": self.priority_seconds}.get(priority, 0.0)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        rows = await self._fetchall(f"SELECT {_STATUS_COLUMNS} FROM ocr_jobs WHERE id = %s", (job_id,))
+        return rows[0] if rows else None
+
+    async def list_batch(self, batch_id: str) -> list[dict]:
+        return await self._fetchall(
+            f"SELECT {_STATUS_COLUMNS} FROM ocr_jobs WHERE batch_id = %s ORDER BY created_at, item_id",
+            (batch_id,)
+        )
+
+    async def stats(self) -> dict[str, int]:
+        rows = await self._fetchall("SELECT status, count(*) AS n FROM ocr_jobs GROUP BY status")
+        return {row["status"]: row["n"] for row in rows}
+
+    # -------------------------------------------------------------------------
+    # Worker side
+    # -------------------------------------------------------------------------
+
+    async def claim(self, worker_id: str) -> Optional[QueuedJob]:
+        """Claim the next queued job (oldest, shifted by priority), or None if the queue is empty."""
+        rows = await self._fetchall(
+            """
+            UPDATE ocr_jobs
+               SET status = 'running',
+                   lease_owner = %s,
+                   lease_expires_at = now() + make_interval(secs => %s),
+                   attempts = attempts + 1,
+                   started_at = now()
+             WHERE id = (
+                   SELECT id FROM ocr_jobs
+                    WHERE status = 'queued'
+                    ORDER BY claim_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+             )
+            RETURNING id, batch_id, item_id, image, params, attempts, max_attempts
+            """,
+            (worker_id, self.lease_seconds)
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        return QueuedJob(
+            id=row["id"],
+            batch_id=row["batch_id"],
+            item_id=row["item_id"],
+            image=bytes(row["image"]),
+            params=row["params"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"]
+        )
+
+    async def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extend the lease. False means the lease was lost (re-queued elsewhere)."""
+        rows = await self._fetchall(
+            "UPDATE ocr_jobs SET lease_expires_at = now() + make_interval(secs => %s) "
+            "WHERE id = %s AND lease_owner = %s AND status = 'running' RETURNING id",
+            (self.lease_seconds, job_id, worker_id)
+        )
+        return bool(rows)
+
+    async def provisional(self, job_id: str, result: dict) -> bool:
+        """Publish a provisional result (two-phase jobs) while the job is still running."""
+        from psycopg.types.json import Jsonb
+
+        rows = await self._fetchall(
+            "UPDATE ocr_jobs SET result = %s WHERE id = %s AND status = 'running' RETURNING id",
+            (Jsonb(result), job_id)
+        )
+        return bool(rows)
+
+    async def complete(self, job_id: str, worker_id: str, result: dict) -> bool:
+        """Store the result. API keys and image are dropped once the job is done."""
+        from psycopg.types.json import Jsonb
+
+        rows = await self._fetchall(
+            "UPDATE ocr_jobs SET status = 'succeeded', result = %s, error = NULL, error_type = NULL, "
+            "image = NULL, params = params - 'api_key', lease_owner = NULL, lease_expires_at = NULL, "
+            "finished_at = now() WHERE id = %s AND lease_owner = %s RETURNING id",
+            (Jsonb(result), job_id, worker_id)
+        )
+        return bool(rows)
+
+    async def fail(self, job_id: str, worker_id: str, error: str, error_type: str, retry: bool) -> str:
+        """
+        Record a failed attempt.
+
+        Returns:
+            New status: 'queued' if it will be retried, 'failed' otherwise,
+            '' if the lease was lost in the meantime
+        """
+        rows = await self._fetchall(
+            """
+            UPDATE ocr_jobs
+               SET status = CASE WHEN %s AND attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                   error = %s,
+                   error_type = %s,
+                   lease_owner = NULL,
+                   lease_expires_at = NULL,
+                   finished_at = CASE WHEN %s AND attempts < max_attempts THEN NULL ELSE now() END
+             WHERE id = %s AND lease_owner = %s
+            RETURNING status
+            """,
+            (retry, error, error_type, retry, job_id, worker_id)
+        )
+        if not rows:
+            return ""
+        if rows[0]["status"] == "failed":
+            await self._fetchall(
+                "UPDATE ocr_jobs SET image = NULL, params = params - 'api_key' WHERE id = %s", (job_id,)
+            )
+        return rows[0]["status"]
+
+    async def release(self, job_id: str, worker_id: str) -> None:
+        """Hand a job back without counting the attempt (graceful shutdown)."""
+        await self._fetchall(
+            "UPDATE ocr_jobs SET status = 'queued', attempts = GREATEST(attempts - 1, 0), "
+            "lease_owner = NULL, lease_expires_at = NULL WHERE id = %s AND lease_owner = %s",
+            (job_id, worker_id)
+        )
+
+    async def requeue_expired(self) -> tuple[int, list[dict]]:
+        """
+        Return jobs whose lease expired to the queue (or fail them after max_attempts).
+
+        Returns:
+            Tuple of (requeued count, failed jobs as {id, batch_id, item_id, attempts, params})
+        """
+        requeued = await self._fetchall(
+            "UPDATE ocr_jobs SET status = 'queued', lease_owner = NULL, lease_expires_at = NULL "
+            "WHERE status = 'running' AND lease_expires_at < now() AND attempts < max_attempts RETURNING id"
+        )
+        failed = await self._fetchall(
+            "UPDATE ocr_jobs SET status = 'failed', error = 'Lease expired after final attempt', "
+            "error_type = 'lease_expired', image = NULL, params = params - 'api_key', "
+            "lease_owner = NULL, lease_expires_at = NULL, finished_at = now() "
+            "WHERE status = 'running' AND lease_expires_at < now() AND attempts >= max_attempts "
+            "RETURNING id, batch_id, item_id, attempts, params"
+        )
+        return len(requeued), failed
+
+
+# =============================================================================
+# WORKER MODE
+# =============================================================================
+
+class QueueWorker:
+    """
+    Claims jobs from the shared queue and runs them through the local pipeline.
+
+    Runs `concurrency` consumer loops plus a sweeper that re-queues expired
+    leases. Errors are classified by the caller so retryable failures
+    (timeouts, API errors, crashed workers) go back to the queue.
+
+    on_finished is awaited once per job that reached a final state here:
+    {job_id, batch_id, id, status, attempts, params, result | error + error_type}
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        execute: Callable[[QueuedJob], Awaitable[dict]],
+        classify: Callable[[Exception], tuple[str, bool]],
+        concurrency: int,
+        poll_interval: float = 1.0,
+        on_finished: Optional[Callable[[dict], Awaitable[None]]] = None
+    ):
+        self.queue = queue
+        self.execute = execute
+        self.classify = classify  # exception -> (error_type, retryable)
+        self.on_finished = on_finished
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+        self.active_jobs = 0
+
+    def start(self) -> None:
+        for slot in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._consume(f"{self.instance_id}:{slot}")))
+        self._tasks.append(asyncio.create_task(self._sweep()))
+        logger.info(f"Queue worker {self.instance_id} started with {self.concurrency} consumer(s)")
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _idle(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _heartbeat(self, job: QueuedJob, worker_id: str) -> None:
+        interval = self.queue.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await self.queue.heartbeat(job.id, worker_id):
+                    logger.warning(f"Lease lost for job {job.id} - result will be discarded")
+                    return
+            except Exception as e:
+                logger.warning(f"Heartbeat failed for job {job.id}: {e}")
+
+    async def _consume(self, worker_id: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = await self.queue.claim(worker_id)
+            except Exception as e:
+                logger.error(f"Queue claim failed: {e}")
+                await self._idle(self.poll_interval * 5)
+                continue
+
+            if job is None:
+                await self._idle(self.poll_interval)
+                continue
+
+            logger.info(f"Claimed job {job.id} (batch {job.batch_id}, item {job.item_id}, attempt {job.attempts}/{job.max_attempts})")
+            self.active_jobs += 1
+            heartbeat = asyncio.create_task(self._heartbeat(job, worker_id))
+            try:
+                result = await self.execute(job)
+                if await self.queue.complete(job.id, worker_id, result):
+                    logger.info(f"✓ Job {job.id} succeeded")
+                    await self._finished(job.id, job.batch_id, job.item_id, "succeeded", job.attempts,
+                                         job.params, result=result)
+                else:
+                    logger.warning(f"Job {job.id} finished after its lease was lost - result discarded")
+            except asyncio.CancelledError:
+                # Shutting down - let another instance pick the page up right away
+                try:
+                    await asyncio.shield(self.queue.release(job.id, worker_id))
+                except Exception:
+                    pass
+                raise
+            except Exception as e:
+                error_type, retryable = self.classify(e)
+                try:
+                    status = await self.queue.fail(job.id, worker_id, str(e), error_type, retryable)
+                except Exception as fail_error:
+                    # Database unavailable: keep consuming, the sweeper re-queues the job once its lease expires
+                    logger.error(f"✗ Job {job.id} failed ({error_type}) and could not be recorded: {fail_error}")
+                    continue
+                logger.error(f"✗ Job {job.id} failed ({error_type}) → {status or 'lease lost'}")
+                if status == "failed":
+                    await self._finished(job.id, job.batch_id, job.item_id, "failed", job.attempts,
+                                         job.params, error=str(e), error_type=error_type)
+            finally:
+                heartbeat.cancel()
+                self.active_jobs -= 1
+
+    async def _finished(
+        self,
+        job_id: str,
+        batch_id: str,
+        item_id: str,
+        status: str,
+        attempts: int,
+        params: dict,
+        **outcome
+    ) -> None:
+        """Report a final job state to on_finished (never raises)."""
+        if self.on_finished is None:
+            return
+        try:
+            await self.on_finished({
+                "job_id": job_id,
+                "batch_id": batch_id,
+                "id": item_id,
+                "status": status,
+                "attempts": attempts,
+                "params": params,
+                **outcome
+            })
+        except Exception as e:
+            logger.error(f"Job {job_id} completion hook failed: {e}")
+
+    async def _sweep(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                requeued, failed = await self.queue.requeue_expired()
+                if requeued or failed:
+                    logger.warning(f"Expired leases: {requeued} job(s) re-queued, {len(failed)} job(s) failed")
+                for row in failed:
+                    await self._finished(row["id"], row["batch_id"], row["item_id"], "failed", row["attempts"],
+                                         row["params"], error="Lease expired after final attempt",
+                                         error_type="lease_expired")
+            except Exception as e:
+                logger.error(f"Lease sweep failed: {e}")
+            await self._idle(max(1.0, self.queue.lease_seconds / 4))
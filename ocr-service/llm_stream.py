@@ -0,0 +1,251 @@
+"""
+Streaming LLM ensemble call with early abort.
+
+The combine step used to request max_tokens=20000 and wait for the whole
+response before the MIN_LLM_RATIO check. A runaway generation (the model
+looping on one line, or rewriting far past the page) cost the full wait and
+was then thrown away anyway.
+
+Now the chat call streams and is guarded while it runs:
+    - max_tokens is sized from the expected output length plus a margin:
+      the Full OCR, or the section crop texts together when they hold more
+      (lines the Full OCR missed end up in the merged text)
+    - the stream is aborted as soon as the output repeats itself (a unit
+      repeated back-to-back more often than it appears in the Full OCR) or
+      runs far past the expected length
+    - a response cut off by max_tokens is treated as truncated
+    - with a request deadline, the call is cut off when the deadline passes
+
+The caller falls back to the Full OCR result on abort; the estimated time
+saved (remaining tokens at the observed generation rate) is reported.
+
+Token usage comes from the response's `usage` (streams ask for it with
+stream_options.include_usage). An aborted stream never gets its usage chunk,
+so its tokens are estimated from chars and flagged tokens_estimated.
+"""
+
+from __future__ import annotations
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Sequence
+
+import httpx
+from openai import OpenAI, APITimeoutError, NOT_GIVEN
+
+
+LLM_STREAM_ENABLED = os.environ.get('OCR_LLM_STREAM', 'true').lower() in ('1', 'true', 'yes')
+# Ask for a final usage chunk on streams (disable for servers that reject stream_options)
+LLM_STREAM_USAGE = os.environ.get('OCR_LLM_STREAM_USAGE', 'true').lower() in ('1', 'true', 'yes')
+# Conservative chars per token for Thai text (sizing + estimates; Thai often runs under 2 chars per token)
+CHARS_PER_TOKEN = float(os.environ.get('OCR_LLM_CHARS_PER_TOKEN', '1.5'))
+LLM_MAX_TOKENS_FACTOR = float(os.environ.get('OCR_LLM_MAX_TOKENS_FACTOR', '1.5'))
+LLM_MAX_TOKENS_MIN = 1024
+LLM_MAX_TOKENS_CAP = int(os.environ.get('OCR_LLM_MAX_TOKENS_CAP', '20000'))
+# Abort once the output is this many times longer than expected (see expected_chars)
+LLM_MAX_LENGTH_RATIO = float(os.environ.get('OCR_LLM_MAX_LENGTH_RATIO', '1.6'))
+
+# Repetition detector
+REPEAT_MIN_UNIT = 8        # Shortest repeated unit considered (chars)
+REPEAT_MAX_UNIT = 300      # Longest repeated unit considered (chars)
+REPEAT_MIN_COUNT = 4       # Back-to-back repeats before a unit is suspicious
+CHECK_EVERY_CHARS = 64     # Run the checks after this many new chars
+
+
+def expected_chars(reference: str, sources: Sequence[str] = ()) -> int:
+    """Expected length of a combine output: the Full OCR, or all crop texts together when longer."""
+    return max(len(reference), sum(len(source) for source in sources))
+
+
+def max_tokens_for(reference: str, sources: Sequence[str] = ()) -> int:
+    """max_tokens for a combine call merging reference (Full OCR) with the section texts in sources."""
+    expected = expected_chars(reference, sources) / CHARS_PER_TOKEN
+    return int(min(LLM_MAX_TOKENS_CAP, max(LLM_MAX_TOKENS_MIN, expected * LLM_MAX_TOKENS_FACTOR + 256)))
+
+
+def find_repetition(text: str, reference: str = "") -> Optional[str]:
+    """
+    Return a unit that the tail of text repeats back-to-back, if it looks like a loop.
+
+    A unit counts when it is repeated at least REPEAT_MIN_COUNT times in a row
+    at the end of text and occurs fewer times in the reference (tables and
+    dotted leaders legitimately repeat when the source page does).
+    """
+    tail = text[-REPEAT_MAX_UNIT * REPEAT_MIN_COUNT:]
+    for unit_len in range(REPEAT_MIN_UNIT, REPEAT_MAX_UNIT + 1):
+        if unit_len * REPEAT_MIN_COUNT > len(tail):
+            break
+        unit = tail[-unit_len:]
+        if not unit.strip() or not tail.endswith(unit * REPEAT_MIN_COUNT):
+            continue
+        repeats = REPEAT_MIN_COUNT
+        while text.endswith(unit * (repeats + 1)):
+            repeats += 1
+        if reference.count(unit) < repeats:
+            return unit
+    return None
+
+
+@dataclass
+class StreamStats:
+    """Outcome of one guarded LLM call (returned in worker meta["llm"])."""
+    streamed: bool
+    max_tokens: int
+    chars: int = 0
+    seconds: float = 0.0
+    first_token_seconds: Optional[float] = None
+    finish_reason: Optional[str] = None
+    aborted: Optional[str] = None          # repetition | too_long | truncated | deadline
+    saved_seconds: float = 0.0             # Estimated generation time avoided by aborting
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    tokens_estimated: bool = False         # No usage from the API - estimated from chars
+    detail: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def usage(self) -> dict:
+        """Token fields for the call record (see cost.py)."""
+        return {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "tokens_estimated": self.tokens_estimated}
+
+
+def _fill_usage(stats: StreamStats, usage, messages: list[dict]) -> StreamStats:
+    """Token counts from the API's usage, else estimated from the prompt / output chars."""
+    if usage is not None:
+        stats.prompt_tokens = usage.prompt_tokens
+        stats.completion_tokens = usage.completion_tokens
+    else:
+        prompt_chars = sum(len(message.get("content") or "") for message in messages)
+        stats.prompt_tokens = int(prompt_chars / CHARS_PER_TOKEN)
+        stats.completion_tokens = int(stats.chars / CHARS_PER_TOKEN)
+        stats.tokens_estimated = True
+    return stats
+
+
+def _saved_seconds(chars: int, max_tokens: int, first_token_at: Optional[float]) -> float:
+    """Time the model would have needed to reach max_tokens at the observed rate."""
+    if first_token_at is None or chars == 0:
+        return 0.0
+    rate = chars / max(time.perf_counter() - first_token_at, 1e-3)
+    remaining = max(0.0, max_tokens * CHARS_PER_TOKEN - chars)
+    return round(remaining / rate, 2)
+
+
+def guarded_completion(
+    client: OpenAI,
+    model: str,
+    messages: list[dict],
+    reference: str,
+    temperature: float = 0.1,
+    deadline: Optional[float] = None,
+    sources: Sequence[str] = ()
+) -> tuple[str, StreamStats]:
+    """
+    Run the combine chat completion, streaming and aborting runaway output.
+
+    Args:
+        client: OpenAI client for the Typhoon chat API
+        model: Chat model name
+        messages: Chat messages
+        reference: Full OCR text the output is expected to resemble
+        deadline: Unix timestamp after which the call is abandoned (None = no limit)
+        sources: Section crop texts merged with the reference (size the length limits)
+
+    Returns:
+        Tuple of (generated text, StreamStats). When stats.aborted is set the
+        text is partial and should not be used.
+    """
+    max_tokens = max_tokens_for(reference, sources)
+    started = time.perf_counter()
+    # Per-read HTTP timeout: a stalled stream must not outlive the deadline either
+    timeout = max(0.1, deadline - time.time()) if deadline is not None else NOT_GIVEN
+
+    if not LLM_STREAM_ENABLED:
+        try:
+            response = client.chat.completions.create(
+                model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, timeout=timeout
+            )
+        except APITimeoutError:
+            if deadline is None:
+                raise
+            return "", _fill_usage(StreamStats(streamed=False, max_tokens=max_tokens, aborted="deadline",
+                                               seconds=round(time.perf_counter() - started, 3)), None, messages)
+        text = response.choices[0].message.content or ""
+        stats = StreamStats(streamed=False, max_tokens=max_tokens, chars=len(text),
+                            seconds=round(time.perf_counter() - started, 3),
+                            finish_reason=response.choices[0].finish_reason)
+        if stats.finish_reason == "length":
+            stats.aborted = "truncated"
+        return text, _fill_usage(stats, response.usage, messages)
+
+    stats = StreamStats(streamed=True, max_tokens=max_tokens)
+    length_limit = expected_chars(reference, sources) * LLM_MAX_LENGTH_RATIO + 200
+    parts: list[str] = []
+    chars = 0
+    next_check = CHECK_EVERY_CHARS
+    first_token_at: Optional[float] = None
+    usage = None
+
+    try:
+        stream = client.chat.completions.create(
+            model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, stream=True,
+            stream_options={"include_usage": True} if LLM_STREAM_USAGE else NOT_GIVEN, timeout=timeout
+        )
+    except APITimeoutError:
+        if deadline is None:
+            raise
+        return "", _fill_usage(StreamStats(streamed=True, max_tokens=max_tokens, aborted="deadline",
+                                           seconds=round(time.perf_counter() - started, 3)), None, messages)
+    try:
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage  # Final chunk, no choices
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                stats.finish_reason = choice.finish_reason
+            delta = choice.delta.content if choice.delta else None
+            if not delta:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                stats.first_token_seconds = round(first_token_at - started, 3)
+            parts.append(delta)
+            chars += len(delta)
+
+            if deadline is not None and time.time() >= deadline:
+                stats.aborted = "deadline"
+                break
+
+            if chars < next_check:
+                continue
+            next_check = chars + CHECK_EVERY_CHARS
+            if chars > length_limit:
+                stats.aborted = "too_long"
+                stats.detail = {"limit_chars": int(length_limit)}
+                break
+            text = "".join(parts)
+            unit = find_repetition(text, reference)
+            if unit is not None:
+                stats.aborted = "repetition"
+                stats.detail = {"unit": unit[:80]}
+                break
+    except (APITimeoutError, httpx.TimeoutException):
+        if deadline is None:
+            raise
+        stats.aborted = "deadline"
+    finally:
+        # Closing mid-stream drops the connection, which stops generation server-side
+        stream.close()
+
+    text = "".join(parts)
+    stats.chars = len(text)
+    stats.seconds = round(time.perf_counter() - started, 3)
+    if stats.aborted:
+        stats.saved_seconds = _saved_seconds(chars, max_tokens, first_token_at)
+    elif stats.finish_reason == "length":
+        stats.aborted = "truncated"
+    return text, _fill_usage(stats, usage, messages)
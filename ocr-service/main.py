@@ -11,31 +11,135 @@ Architecture:
     - 4× Typhoon OCR calls per image (Full, Top, Middle, Bottom sections)
     - 1× Typhoon LLM call for combining and correcting results
     - ProcessPoolExecutor for parallel processing
+    - Pipeline lives in ocr_pipeline.py (lean module loaded by spawned workers);
+      all workers are pre-spawned and warmed during startup
+
+Request coalescing:
+    - Identical requests (same image bytes + task_type + figure_language +
+      priority lane + API key set) arriving while the first is still running share its result instead of
+      taking another pool slot (see SingleFlight)
+
+Pipeline stages:
+    - OCR (decode, crops, region OCR) runs in the process pool, the LLM merge
+      on its own threads with its own concurrency limit and bounded queue, so
+      OCR of the next page overlaps with the LLM of this one (see stages.py)
+
+Priority lanes:
+    - Requests carry a priority class (interactive, normal, bulk); at most
+      one page per worker is handed to the pool and the next one is picked
+      by weighted lane dispatch + shortest-job-first (see dispatcher.py)
+
+Circuit breakers:
+    - One breaker per (API key, endpoint); workers report every API call and
+      pages are routed around keys whose breaker is open (see circuit_breaker.py)
+    - GET /admin/breakers, POST /admin/breakers/reset
+
+Deadlines:
+    - X-Request-Deadline (or deadline_seconds on /jobs) bounds the request;
+      the worker skips section crops / the LLM merge when the remaining time
+      can't cover their p95 and reports the tier it ran (see deadline.py)
+
+Cost accounting:
+    - Every result carries its cost (OCR calls, bytes uploaded, LLM tokens,
+      retries, calls per key); /metrics "cost" aggregates them per endpoint,
+      key, task_type and tier. token_budget on /ocr/batch and /ocr/pdf stops
+      escalating to the expensive tiers once used up (see cost.py)
+
+Two-phase results:
+    - POST /ocr/stream (SSE) and two_phase jobs get the Full Image OCR text as
+      a provisional result as soon as it exists, the LLM-refined text as the
+      final result later (see provisional.py)
+
+Webhooks:
+    - Jobs with a callback_url get signed (HMAC) completion / failure POSTs,
+      retried with backoff from a local SQLite outbox (see webhooks.py)
+
+Autoscaling:
+    - The pool runs between OCR_MIN_WORKERS and OCR_MAX_WORKERS, resized from
+      lane backlog, wait time and host memory (see autoscaler.py)
+    - GET /admin/pool, POST /admin/pool (change the bounds at runtime)
+
+Health:
+    - GET /health/live (event loop + pool not stuck broken), GET /health/ready
+      (pool ready, lane backlog, key health, recent error rate; see health.py)
+    - A broken process pool (a worker died) is rebuilt in the background
+
+Multi-worker deployment:
+    - uvicorn --workers N (WEB_CONCURRENCY=N) runs N copies of this app; they
+      share a host-wide page limit (OCR_HOST_SLOTS) and per-key call limit
+      (OCR_HOST_KEY_CONCURRENCY) through lock files, one webhook sender and an
+      atomically replaced organizations.json (see coordination.py)
+
+Image references:
+    - /ocr, /ocr/stream and /ocr/batch take a MinIO {bucket, key} or a
+      shared-volume path instead of image_base64; the service fetches the
+      bytes through one pooled client (see object_store.py)
+
+Near-duplicate detection:
+    - Perceptual hash (dHash) per image, looked up in a Hamming-distance index
+      of previously OCR'd pages (see phash_index.py)
+    - A near-duplicate reuses the stored text instead of calling the APIs
+      (opt-in per request with dedup=true; only pages OCR'd with the same
+      API key set, at most OCR_PHASH_TTL_DAYS old)
+    - Only dedup=true requests store their text in the index
 
 Usage:
     POST /ocr - OCR a single image (base64 or file upload)
+    POST /ocr/stream - OCR a single image, provisional + final results as SSE
     POST /ocr/batch - OCR multiple images in parallel
-    GET /health - Health check
+    POST /ocr/pdf - OCR a multi-page PDF, streaming results per page
+    POST /jobs - Enqueue page jobs on the shared Postgres queue (any instance executes)
+    GET /jobs/{job_id} - Job status/result
+    GET /health - Health summary (GET /health/live, GET /health/ready for probes)
 """
 
 from __future__ import annotations
 import os
 import base64
+import hmac
+import hashlib
 import tempfile
 import asyncio
 import logging
 import sys
+import json
+import time
+import multiprocessing
+from collections import deque
 from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional, Union, List
+from typing import Callable, Optional, Union, List
+import contextlib
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Header, Form, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
 import uvicorn
 
+from ocr_pipeline import ocr_worker, ocr_stage, merge_stage, merge_batch, init_merge_stage, init_worker, worker_status, TYPHOON_BASE_URL
+from phash_index import PHashIndex, DuplicateMatch, compute_dhash, dedup_scope
+from pdf_ingest import PdfError, get_page_count, rasterize_page, MIN_DPI, MAX_DPI
+from job_queue import JobQueue, QueueWorker, QueuedJob
+from dispatcher import PriorityDispatcher, Priority, DEFAULT_LANE, job_cost
+from circuit_breaker import BreakerBoard, BREAKER_ENABLED, ENDPOINTS
+from deadline import Budget, StageTimings, parse_deadline, DEADLINE_HEADER
+from cost import CostLedger, TokenBudget, page_cost, sum_costs
+from object_store import ObjectFetcher, FetchError, InvalidReferenceError, reference_of
+from coordination import (HostSemaphore, Leadership, write_shared_json, key_stats, HOST_SLOTS, HOST_KEY_CONCURRENCY,
+                          WEB_CONCURRENCY, COORDINATION_DIR)
+from provisional import ProvisionalChannel
+from webhooks import WebhookOutbox, WebhookSender, resolve_callback_url
+from health import OutcomeWindow, check_liveness, check_readiness
+from stages import PipelineStage, MergeBatcher, STAGE_SPLIT, LLM_CONCURRENCY, LLM_QUEUE_SIZE, LLM_BATCH_ENABLED
+from autoscaler import PoolAutoscaler, MIN_WORKERS, MAX_WORKERS, AUTOSCALE_INTERVAL_SECONDS, available_memory_mb
+import image_decode
+import cassette
+
 
 # =============================================================================
 # LOGGING CONFIGURATION
@@ -84,6 +188,10 @@ class ProcessPoolCrashError(OcrError):
     """Worker process crashed unexpectedly."""
     pass
 
+class DeadlineExceededError(OcrTimeoutError):
+    """The caller's deadline passed before a usable result existed."""
+    pass
+
 
 # =============================================================================
 # PROCESS POOL (Global)
@@ -93,6 +201,91 @@ class ProcessPoolCrashError(OcrError):
 # Each process has its own environment, avoiding race conditions with API keys
 process_pool: Optional[ProcessPoolExecutor] = None
 
+# Pool lifecycle (liveness/readiness): starting → ready; broken (a worker died) → rebuilding → ready
+pool_state = {"state": "starting", "broken_since": None, "rebuilds": 0, "last_error": None}
+pool_rebuild_task: Optional[asyncio.Task] = None
+POOL_REBUILD_RETRY_SECONDS = 5.0
+# Rebuilds and autoscaler resizes replace the pool one at a time
+pool_swap_lock = asyncio.Lock()
+
+# Pool size between OCR_MIN_WORKERS and OCR_MAX_WORKERS, driven by lane backlog (see autoscaler.py)
+autoscaler = PoolAutoscaler(MIN_WORKERS, MAX_WORKERS, image_decode.WORKER_MEMORY_MB)
+autoscale_task: Optional[asyncio.Task] = None
+
+# Recent pipeline outcomes for the readiness error rate (invalid images / deadlines not counted)
+recent_outcomes = OutcomeWindow()
+SERVICE_VERSION = os.environ.get('OCR_SERVICE_VERSION', '2.0.0')
+
+# Readiness reported by each pre-spawned worker during warm-up (see ocr_pipeline.worker_status)
+worker_readiness: list[dict] = []
+
+# Aggregated pipeline metrics (exposed on GET /metrics)
+http_metrics = {"pages": 0, "requests": 0, "new_connections": 0}
+WORKER_WARMUP_TIMEOUT = float(os.environ.get('OCR_WORKER_WARMUP_TIMEOUT', '120'))
+
+# Hamming-distance index of previously OCR'd pages (near-duplicate reuse)
+phash_index: Optional[PHashIndex] = None
+PHASH_ENABLED = os.environ.get('OCR_PHASH_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+PHASH_DB_PATH = Path(os.environ.get('OCR_PHASH_DB_PATH', str(Path(__file__).parent / "data" / "phash_index.db")))
+PHASH_MAX_DISTANCE = int(os.environ.get('OCR_PHASH_MAX_DISTANCE', '16'))
+PHASH_MAX_ENTRIES = int(os.environ.get('OCR_PHASH_MAX_ENTRIES', '100000'))
+PHASH_TTL_DAYS = float(os.environ.get('OCR_PHASH_TTL_DAYS', '30'))
+
+# Shared Postgres job queue (distributed worker mode). Disabled when no DSN is set.
+job_queue: Optional[JobQueue] = None
+queue_worker: Optional[QueueWorker] = None
+QUEUE_DSN = os.environ.get('OCR_QUEUE_DSN', '')
+QUEUE_WORKER_ENABLED = os.environ.get('OCR_QUEUE_WORKER', 'true').lower() in ('1', 'true', 'yes')
+QUEUE_CONCURRENCY = int(os.environ.get('OCR_QUEUE_CONCURRENCY', '0'))  # 0 = OCR_MAX_WORKERS
+QUEUE_LEASE_SECONDS = float(os.environ.get('OCR_QUEUE_LEASE_SECONDS', '360'))
+QUEUE_MAX_ATTEMPTS = int(os.environ.get('OCR_QUEUE_MAX_ATTEMPTS', '3'))
+QUEUE_POLL_INTERVAL = float(os.environ.get('OCR_QUEUE_POLL_INTERVAL', '1.0'))
+# Claim-order head start of interactive jobs (and delay of bulk jobs) on the shared queue
+QUEUE_PRIORITY_SECONDS = float(os.environ.get('OCR_QUEUE_PRIORITY_SECONDS', '60'))
+
+# Job callbacks: outbox of undelivered webhook events (enabled together with the queue)
+webhooks: Optional[WebhookSender] = None
+WEBHOOK_DB_PATH = Path(os.environ.get('OCR_WEBHOOK_DB_PATH', str(Path(__file__).parent / "data" / "webhook_outbox.db")))
+
+# Pages of one PDF rasterized + OCR'd at the same time (only these are held in memory)
+PDF_MAX_CONCURRENCY = int(os.environ.get('OCR_PDF_MAX_CONCURRENCY', '2'))
+
+# Image memory admitted into the pool at once (0 = OCR_WORKER_MEMORY_MB x OCR_MAX_WORKERS)
+MEMORY_BUDGET_MB = int(os.environ.get('OCR_MEMORY_BUDGET_MB', '0'))
+memory_budget: Optional["MemoryBudget"] = None
+memory_metrics = {"peak_rss_mb": 0.0, "reduced_pages": 0}
+llm_metrics = {"calls": 0, "streamed": 0, "seconds": 0.0, "aborted": {}, "saved_seconds": 0.0}
+# Pages handed to the pool at once (one per worker), ordered by priority lane
+dispatcher: Optional[PriorityDispatcher] = None
+
+# Pages in the OCR stage at once across all uvicorn workers on the host (None = OCR_HOST_SLOTS=0)
+host_slots: Optional[HostSemaphore] = None
+
+# Per-key / per-endpoint circuit breakers (None = OCR_BREAKER_ENABLED=false)
+breakers: Optional[BreakerBoard] = BreakerBoard() if BREAKER_ENABLED else None
+
+# Rolling stage durations (p95s drive deadline stage skipping) and tiers served
+stage_timings = StageTimings()
+tier_metrics = {"deadline_requests": 0, "tiers": {}, "skipped": {}, "deadline_exceeded": 0}
+# API calls, bytes and tokens per endpoint / key / task_type / tier
+cost_ledger = CostLedger()
+# Images referenced by MinIO bucket + key or shared-volume path (see object_store.py)
+object_fetcher = ObjectFetcher()
+
+# Admin endpoints (/admin/*) require this token in X-Admin-Token when set
+ADMIN_TOKEN = os.environ.get('OCR_ADMIN_TOKEN', '')
+
+# Identical in-flight requests share one pipeline run
+COALESCE_ENABLED = os.environ.get('OCR_COALESCE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+single_flight: Optional["SingleFlight"] = None
+# LLM merge stage: own threads, concurrency limit and bounded queue (None = OCR_STAGE_SPLIT=false)
+merge_stage_pool: Optional[PipelineStage] = None
+# Short pages share multi-page LLM merge requests (None = OCR_LLM_BATCH=false)
+merge_batcher: Optional[MergeBatcher] = None
+# Worker → main process channel for two-phase (provisional) results
+provisional_channel: Optional[ProvisionalChannel] = None
+crop_metrics = {"pages": 0, "adaptive": 0, "sections": 0, "pixel_ratio": 0.0, "whitespace_cuts": 0, "fallback": {}}
+
 
 # =============================================================================
 # MODELS
@@ -100,37 +293,59 @@ process_pool: Optional[ProcessPoolExecutor] = None
 
 class OcrRequest(BaseModel):
     """Request model for OCR endpoint."""
-    image_base64: str
+    image_base64: Optional[str] = None
+    bucket: Optional[str] = None  # MinIO object instead of image_base64 (with key)
+    key: Optional[str] = None
+    path: Optional[str] = None  # File on the shared volume instead of image_base64
     api_key: Union[str, List[str]]  # Single key or list of 4 keys for load balancing
     task_type: str = "v1.5"  # v1.5 (faster) or default/structure
     figure_language: str = "Thai"
+    dedup: bool = False  # Opt-in: reuse (and store for reuse) near-duplicate text of this key set
+    dedup_max_distance: Optional[int] = None  # Hamming distance threshold (default: OCR_PHASH_MAX_DISTANCE)
+    priority: Priority = DEFAULT_LANE  # interactive (review UI) | normal | bulk (stage runs)
 
 
 class OcrResponse(BaseModel):
     """Response model for OCR endpoint."""
     text: str
-    confidence: float = 0.0
+    confidence: float = 0.0  # Always 0.0: the Typhoon APIs return no score (kept for client compatibility)
     success: bool = True
     error: Optional[str] = None
+    near_duplicate: bool = False  # True if text was reused from a previously OCR'd page
+    match_distance: Optional[int] = None  # Hamming distance to the matched page
+    tier: Optional[str] = None  # multi_scale | full_llm | full_only (None for near-duplicates)
+    skipped_stages: list[str] = []  # Stages skipped to meet X-Request-Deadline
+    cost: Optional[dict] = None  # OCR calls / bytes / tokens, LLM calls / tokens, retries, keys (see cost.py)
 
 
 class BatchOcrRequest(BaseModel):
     """Request model for batch OCR endpoint."""
-    images: list[dict]  # [{image_base64, id}, ...]
+    images: list[dict]  # [{id, image_base64 | bucket + key | path}, ...]
     api_key: Union[str, List[str]]  # Single key or list of 4 keys for load balancing
     task_type: str = "v1.5"
     figure_language: str = "Thai"
+    dedup: bool = False
+    dedup_max_distance: Optional[int] = None
+    priority: Priority = DEFAULT_LANE
+    token_budget: Optional[int] = Field(None, gt=0)  # Pages past it run Full OCR only (tier full_only)
 
 
 class BatchOcrResponse(BaseModel):
     """Response model for batch OCR endpoint."""
-    results: list[dict]  # [{id, text, success, error}, ...]
+    results: list[dict]  # [{id, text, success, error, near_duplicate, match_distance, cost}, ...]
+    cost: Optional[dict] = None  # Total of the pages
+    budget: Optional[dict] = None  # token_budget use, when one was given
 
 
 class HealthResponse(BaseModel):
     """Health check response."""
-    status: str
+    status: str  # healthy | degraded (not ready) | unhealthy (not live)
     version: str
+    workers_ready: int = 0
+    workers_total: int = 0
+    pool_state: str = "starting"
+    ready: bool = False
+    checks: dict = {}  # {pool, queue, keys, errors}: {"ok": bool, ...}
 
 
 class SyncOrganizationsRequest(BaseModel):
@@ -145,457 +360,531 @@ class SyncOrganizationsResponse(BaseModel):
     message: str
 
 
-# =============================================================================
-# OCR FUNCTIONS (Multi-Scale Typhoon OCR + LLM Ensemble)
-# =============================================================================
+class JobRequest(BaseModel):
+    """Request model for enqueueing page jobs on the shared queue."""
+    images: list[dict]  # [{image_base64, id, callback_url?}, ...]
+    api_key: Union[str, List[str]]
+    task_type: str = "v1.5"
+    figure_language: str = "Thai"
+    dedup: bool = False
+    priority: Priority = DEFAULT_LANE  # Claim order on the shared queue + local lane
+    deadline_seconds: Optional[float] = None  # Per-page budget from submission (see X-Request-Deadline)
+    two_phase: bool = False  # Publish the Full Image OCR as a provisional result while running
+    callback_url: Optional[str] = None  # Webhook for every job of the batch (items may set their own)
+    batch_id: Optional[str] = None  # Append to an existing batch
+
+
+class JobSubmitResponse(BaseModel):
+    """Response model for job submission."""
+    batch_id: str
+    jobs: list[dict]  # [{id, job_id}, ...]
+
+
+class JobStatusResponse(BaseModel):
+    """Status of one queued page job."""
+    job_id: str
+    batch_id: str
+    id: str
+    status: str  # queued | running | succeeded | failed
+    attempts: int
+    result: Optional[dict] = None  # {text, confidence, near_duplicate, match_distance} ({text, provisional} while running)
+    error: Optional[str] = None
+    error_type: Optional[str] = None
+    worker: Optional[str] = None
+    created_at: Optional[str] = None
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
 
-def _ocr_worker(
+@dataclass
+class OcrResult:
+    """Result of perform_ocr()."""
+    text: str
+    confidence: float = 0.0
+    near_duplicate: Optional[DuplicateMatch] = None
+    tier: Optional[str] = None
+    skipped_stages: list[str] = field(default_factory=list)
+    cost: Optional[dict] = None
+
+
+async def _lookup_near_duplicate(
     image_data: bytes,
-    api_key: Union[str, List[str]],
+    scope: str,
     task_type: str,
-    figure_language: str
-) -> tuple[str, float]:
+    figure_language: str,
+    max_distance: Optional[int]
+) -> tuple[Optional[int], Optional[DuplicateMatch]]:
     """
-    Worker function that runs in a separate process.
-    Uses Solution 5: Multi-Scale Typhoon (Full + 3 Crops) + 2-Step LLM Ensemble.
+    Compute the perceptual hash of an image and look it up in the index.
 
-    Uses multithreading (4 threads) inside this process for parallel OCR.
-
-    Args:
-        api_key: Single key or list of 4 keys [key_full, key_top, key_mid, key_bot]
-                 If list: OCR uses different keys, LLM uses random 2 keys
+    Returns:
+        Tuple of (phash, match). phash is None if the image could not be
+        hashed; the worker will then report the real decode error.
     """
-    import os
-    import sys
-    import tempfile
-    import concurrent.futures
-    import logging
-    from PIL import Image
-    from typhoon_ocr import ocr_document
-    from openai import OpenAI
-
-    # Configure logging for child process
-    worker_logger = logging.getLogger(f"{__name__}.worker")
-    if not worker_logger.handlers:
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setFormatter(logging.Formatter(
-            '%(asctime)s | %(levelname)-8s | PID:%(process)d | %(name)s | %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        ))
-        worker_logger.addHandler(handler)
-        worker_logger.setLevel(logging.INFO)
-
-    # Log memory usage
     try:
-        import psutil
-        process = psutil.Process()
-        mem_info = process.memory_info()
-        worker_logger.info("=" * 80)
-        worker_logger.info("OCR Worker started")
-        worker_logger.info(f"Image size: {len(image_data)} bytes, task_type: {task_type}, language: {figure_language}")
-        worker_logger.info(f"Memory usage: RSS={mem_info.rss / 1024 / 1024:.2f} MB, VMS={mem_info.vms / 1024 / 1024:.2f} MB")
-    except ImportError:
-        worker_logger.info("=" * 80)
-        worker_logger.info("OCR Worker started")
-        worker_logger.info(f"Image size: {len(image_data)} bytes, task_type: {task_type}, language: {figure_language}")
-        worker_logger.info("psutil not available, memory logging disabled")
-
-    # Normalize api_key to list of 4 keys
-    if isinstance(api_key, str):
-        # Single key → use for all
-        keys = [api_key, api_key, api_key, api_key]
-        worker_logger.info("Using single API key for all OCR calls")
-    else:
-        # List of keys
-        if len(api_key) < 4:
-            # Pad with first key if not enough
-            keys = api_key + [api_key[0]] * (4 - len(api_key))
-            worker_logger.info(f"API keys padded from {len(api_key)} to 4 keys")
-        else:
-            keys = api_key[:4]
-            worker_logger.info("Using 4 different API keys for load balancing")
+        phash = await asyncio.to_thread(compute_dhash, image_data)
+    except Exception as e:
+        logger.warning(f"Perceptual hash failed, skipping near-duplicate lookup: {e}")
+        return None, None
 
-    # Save image to temp file
-    worker_logger.info("Saving image to temporary file...")
-    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-        tmp.write(image_data)
-        tmp_path = tmp.name
-    worker_logger.info(f"Temporary file created: {tmp_path}")
+    match = await asyncio.to_thread(phash_index.lookup, phash, scope, task_type, figure_language, max_distance)
+    return phash, match
 
-    try:
-        # [1/5] Crop image into 3 sections
-        worker_logger.info("[Step 1/5] Loading and cropping image...")
-        img = Image.open(tmp_path)
-        worker_logger.info(f"Image loaded: mode={img.mode}, size={img.size}")
-
-        # Convert RGBA to RGB (for PNG)
-        if img.mode == 'RGBA':
-            worker_logger.info("Converting RGBA to RGB...")
-            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-            rgb_img.paste(img, mask=img.split()[3])
-            img = rgb_img
-            worker_logger.info("Conversion completed")
-
-        width, height = img.size
-        section_height = height // 3
-        overlap = 20
-        worker_logger.info(f"Image dimensions: {width}x{height}, section_height: {section_height}, overlap: {overlap}")
-
-        # Crop sections
-        worker_logger.info("Cropping image into 3 sections (top, middle, bottom)...")
-        top = img.crop((0, 0, width, section_height + overlap))
-        middle = img.crop((0, section_height - overlap, width, 2 * section_height + overlap))
-        bottom = img.crop((0, 2 * section_height - overlap, width, height))
-        worker_logger.info(f"Cropping completed: top={top.size}, middle={middle.size}, bottom={bottom.size}")
-
-        # Save cropped sections
-        worker_logger.info("Saving cropped sections to temporary files...")
-        top_path = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False).name
-        mid_path = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False).name
-        bot_path = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False).name
-
-        top.save(top_path, "JPEG")
-        middle.save(mid_path, "JPEG")
-        bottom.save(bot_path, "JPEG")
-        worker_logger.info(f"Cropped sections saved: top={top_path}, mid={mid_path}, bot={bot_path}")
-
-        # [2/5] Run 5 OCR tasks in parallel using ThreadPoolExecutor
-        worker_logger.info("[Step 2/5] Running 4 parallel Typhoon OCR tasks...")
-
-        def run_typhoon(path, key, name):
-            worker_logger.info(f"  → Starting OCR task: {name} (path={path})")
-            try:
-                result = ocr_document(
-                    pdf_or_image_path=path,
-                    api_key=key,  # ✅ แยก key ตาม index
-                    model="typhoon-ocr",
-                    task_type=task_type,
-                    figure_language=figure_language
-                )
-                worker_logger.info(f"  ✓ OCR task completed: {name} ({len(result)} chars)")
-                return result
-            except Exception as e:
-                worker_logger.error(f"  ✗ OCR task failed: {name} - {str(e)}")
-                raise
-
-        # Run 4 Typhoon OCR tasks concurrently (4 threads with different keys)
-        worker_logger.info("Submitting 4 OCR tasks to ThreadPoolExecutor...")
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            future_full = executor.submit(run_typhoon, tmp_path, keys[0], "Full Image")
-            future_top = executor.submit(run_typhoon, top_path, keys[1], "Top Section")
-            future_mid = executor.submit(run_typhoon, mid_path, keys[2], "Middle Section")
-            future_bot = executor.submit(run_typhoon, bot_path, keys[3], "Bottom Section")
 
-            # Wait for all results
-            worker_logger.info("Waiting for all OCR tasks to complete...")
-            try:
-                full_result = future_full.result()
-                top_result = future_top.result()
-                mid_result = future_mid.result()
-                bot_result = future_bot.result()
-            except Exception as ocr_error:
-                worker_logger.error("=" * 80)
-                worker_logger.error("❌ One or more OCR tasks failed!")
-                worker_logger.error(f"Error: {str(ocr_error)}")
-                worker_logger.error("=" * 80)
-                raise RuntimeError(f"OCR task failed: {str(ocr_error)}") from ocr_error
-
-        worker_logger.info("All 4 OCR tasks completed successfully")
-
-        # [VALIDATION] Check if OCR results are valid (basic checks only - length check moved to final result)
-        worker_logger.info("Validating OCR results (basic checks)...")
-
-        ocr_results = [
-            ("Full Image", full_result),
-            ("Top Section", top_result),
-            ("Middle Section", mid_result),
-            ("Bottom Section", bot_result)
-        ]
-
-        validation_errors = []
-
-        for name, result in ocr_results:
-            if result is None:
-                validation_errors.append(f"{name}: Result is None")
-            elif not isinstance(result, str):
-                validation_errors.append(f"{name}: Result is not a string (type: {type(result)})")
-            # Note: Empty string is allowed - will be validated at final result
-
-        if validation_errors:
-            worker_logger.error("=" * 80)
-            worker_logger.error("❌ OCR VALIDATION FAILED!")
-            worker_logger.error("The following OCR results are invalid:")
-            for err in validation_errors:
-                worker_logger.error(f"  - {err}")
-            worker_logger.error("")
-            worker_logger.error("This may indicate:")
-            worker_logger.error("  1. API returned None/invalid response")
-            worker_logger.error("  2. API key quota exceeded")
-            worker_logger.error("=" * 80)
-            raise RuntimeError(f"OCR validation failed: {'; '.join(validation_errors)}")
-
-        worker_logger.info("✓ OCR basic validation passed")
-        worker_logger.info(f"  Full: {len(full_result)} chars, Top: {len(top_result)} chars, "
-                          f"Mid: {len(mid_result)} chars, Bot: {len(bot_result)} chars")
-
-        # Cleanup cropped images
-        worker_logger.info("Cleaning up temporary cropped images...")
-        try:
-            os.unlink(top_path)
-            os.unlink(mid_path)
-            os.unlink(bot_path)
-            worker_logger.info("Temporary files cleaned up")
-        except Exception as cleanup_error:
-            worker_logger.warning(f"Failed to cleanup temp files: {cleanup_error}")
-
-        # [3/5] Load organizations
-        worker_logger.info("[Step 3/5] Loading organization names...")
-        org_section = ""
-        org_json_path = Path(__file__).parent / "organizations.json"
-        if org_json_path.exists():
-            import json
-            try:
-                with open(org_json_path, "r", encoding="utf-8") as f:
-                    org_list = json.load(f)
+async def perform_ocr(
+    image_data: bytes,
+    api_key: Union[str, List[str]],
+    task_type: str = "v1.5",
+    figure_language: str = "Thai",
+    dedup: bool = False,
+    dedup_max_distance: Optional[int] = None,
+    priority: str = DEFAULT_LANE,
+    deadline: Optional[float] = None,
+    on_provisional: Optional[Callable[[str], None]] = None,
+    token_budget: Optional[TokenBudget] = None
+) -> OcrResult:
+    """
+    Perform OCR on image data using Multi-OCR + LLM Ensemble.
 
-                if org_list and len(org_list) > 0:
-                    worker_logger.info(f"Loaded {len(org_list)} organization names from organizations.json")
-                    org_names = "\n".join([f"- {name}" for name in org_list])
-                    org_section = f"""
-## รายชื่อมูลนิธิที่ถูกต้อง (ใช้แก้ชื่อที่ OCR อ่านผิด):
-```
-{org_names}
-```
+    Runs in a separate process with 5 parallel OCR engines (multithreading).
+    If dedup is requested and a near-duplicate page was OCR'd before with
+    the same API key set, its stored text is returned without calling the APIs.
+    Only dedup requests store their text in the index.
 
-**กฎ:** ถ้า OCR อ่านชื่อมูลนิธิผิดเล็กน้อย → จับคู่กับรายชื่อที่ถูกต้องข้างบน
+    Args:
+        image_data: Raw image bytes
+        api_key: Single API key or list of 4 keys [full, top, mid, bot]
+                 LLM uses keys[0] and keys[1]
+        task_type: OCR task type (v1.5, default, structure)
+        figure_language: Language for figure analysis
+        dedup: Reuse text of a near-duplicate page and store this page's (opt-in)
+        dedup_max_distance: Hamming distance threshold override
+        priority: Dispatch lane (interactive, normal, bulk)
+        deadline: Caller's deadline as a Unix timestamp (stages are skipped to meet it)
+        on_provisional: Two-phase callback for the Full Image OCR text (not called
+                        for near-duplicates; such requests are not coalesced)
+        token_budget: Token budget of the batch the page belongs to; once used
+                      up the page runs at tier full_only (see cost.py). Requests
+                      with a deadline or token budget are not coalesced.
 
----
-"""
-                else:
-                    worker_logger.info("organizations.json is empty, skipping organization matching")
-            except Exception as org_error:
-                worker_logger.warning(f"Failed to load organizations.json: {org_error}")
-        else:
-            worker_logger.info("organizations.json not found, skipping organization matching")
-
-        # [4/5] Step 1: Combine Typhoon Multi-Scale
-        worker_logger.info("[Step 4/5] Running LLM Ensemble (Step 1: Combine Multi-Scale)...")
-        # Random 2 keys จาก 4 keys สำหรับ LLM
-        import random
-        llm_keys = random.sample(keys, 2)  # เลือก 2 keys แบบสุ่ม
-        worker_logger.info("Selected 2 random API keys for LLM calls")
-
-        worker_logger.info("Initializing OpenAI client for Typhoon LLM...")
-        client_step1 = OpenAI(
-            base_url="https://api.opentyphoon.ai/v1",
-            api_key=llm_keys[0]  # LLM Step 1 ใช้ key แรก
+    Returns:
+        OcrResult with text, confidence, near-duplicate match (if any) and cost.
+        A coalesced request reports zero cost (the run's cost is on the request that ran it).
+    """
+    phash: Optional[int] = None
+    scope = dedup_scope(api_key)
+    if phash_index is not None and dedup:
+        phash, match = await _lookup_near_duplicate(image_data, scope, task_type, figure_language, dedup_max_distance)
+        if match is not None:
+            logger.info(f"♻️  Near-duplicate found: phash={match.phash[:16]}…, distance={match.distance}, "
+                        f"reusing {len(match.text)} chars")
+            return OcrResult(text=match.text, confidence=0.0, near_duplicate=match, cost=page_cost([]))
+
+    async def run_pipeline() -> tuple[str, float, dict]:
+        text, confidence, meta = await _run_ocr_worker(
+            image_data, api_key, task_type, figure_language, priority, deadline, on_provisional, token_budget
         )
+        _record_worker_meta(meta)
 
-        worker_logger.info("Preparing LLM prompt with OCR results...")
-        prompt_step1 = f"""คุณเป็นผู้เชี่ยวชาญในการรวมผลลัพธ์ OCR จากหลาย scales สำหรับเอกสารภาษาไทย
-{org_section}
-## ผลลัพธ์ Typhoon OCR:
-
-### Full Image OCR (**ใช้เป็นหลัก**):
-```
-{full_result}
-```
-
-### Top Section OCR (1/3 บน):
-```
-{top_result}
-```
-
-### Middle Section OCR (1/3 กลาง):
-```
-{mid_result}
-```
-
-### Bottom Section OCR (1/3 ล่าง):
-```
-{bot_result}
-```
-
----
-
-## ⚠️ กฎสำคัญ (ต้องปฏิบัติตาม):
-
-### 1. **ห้ามลบหรือข้ามข้อความใดๆ**
-   - ❌ ห้ามลบบรรทัด ห้ามข้ามบรรทัด ห้ามสรุป
-   - ❌ ห้ามตัดทิ้ง ห้ามย่อ ห้ามเปลี่ยนโครงสร้าง
-   - ✅ ต้องเก็บ**ทุกคำ ทุกบรรทัด ทุกข้อความ**จาก Full Image OCR
-   - ✅ Output ต้องมีจำนวนบรรทัดใกล้เคียงกับ Full Image OCR
+        # Remember this page for future near-duplicates (phash is only set for dedup requests:
+        # callers that did not opt in never have their text kept on disk).
+        # Only complete results: a degraded tier would be served to every later near-duplicate.
+        complete = meta.get("tier") == "multi_scale" and not meta.get("skipped")
+        if phash_index is not None and phash is not None and complete and text.strip():
+            try:
+                await asyncio.to_thread(phash_index.add, phash, scope, task_type, figure_language, text)
+            except Exception as e:
+                logger.warning(f"Failed to record page in perceptual-hash index: {e}")
+        return text, confidence, meta
+
+    coalesced = False
+    if single_flight is None or on_provisional is not None or deadline is not None or token_budget is not None:
+        # Two-phase: the provisional result only reaches the request that ran the pipeline.
+        # Deadline / token budget: the run's tier depends on the caller, so its result is not shared.
+        text, confidence, meta = await run_pipeline()
+    else:
+        (text, confidence, meta), coalesced = await single_flight.run(
+            SingleFlight.key(image_data, task_type, figure_language, priority, scope), run_pipeline
+        )
+    return OcrResult(
+        text=text,
+        confidence=confidence,
+        tier=meta.get("tier"),
+        skipped_stages=sorted(meta.get("skipped") or {}),
+        # The run is billed once, to the request that ran it
+        cost=page_cost([]) if coalesced else meta.get("cost")
+    )
 
-### 2. **ทำได้เฉพาะ: แก้คำผิด**
-   - แก้เฉพาะคำที่ OCR อ่านผิด (typo, คำสะกดผิด)
-   - เปรียบเทียบกับ Section OCRs เพื่อหาคำที่ถูกต้อง:
-     * ส่วนบน (1/3 บน) → เทียบกับ Top Section OCR
-     * ส่วนกลาง (1/3 กลาง) → เทียบกับ Middle Section OCR
-     * ส่วนล่าง (1/3 ล่าง) → เทียบกับ Bottom Section OCR
-   - ตัวอย่าง: Full อ่าน "วัดภูพระสงฆ์" แต่ Mid อ่าน "วัตถุประสงค์" → ใช้ "วัตถุประสงค์"
 
-### 3. **แก้ชื่อมูลนิธิ (ถ้ามี):**
-   - **ถ้าชื่อใน OCR คล้ายกับชื่อในรายชื่อ** (เช่น แค่ผิด 1-2 ตัวอักษร) → แก้ให้ตรงกับรายชื่อ
-   - **ถ้าชื่อไม่เหมือนกันเลย** → **ห้ามแก้** ให้เก็บชื่อเดิมจาก OCR
+async def _load_image(item: dict) -> bytes:
+    """
+    Image bytes of a request body or batch item: image_base64, bucket + key, or path.
 
-### 4. **แก้การสะกดภาษาไทย**
-   - แก้คำที่สะกดผิดชัดเจน (เช่น เคหะชุมชน → ถูกต้อง, เคหะชุมนน → ผิด)
-   - ใช้ความรู้ภาษาไทยในการแก้
+    Raises:
+        InvalidImageError: Invalid base64
+        InvalidReferenceError: Malformed, not allowed, missing or too large reference
+        FetchError: Object store / shared volume unavailable
+    """
+    ref = reference_of(item)
+    if ref is None:
+        try:
+            return base64.b64decode(item["image_base64"])
+        except Exception as decode_error:
+            raise InvalidImageError(f"Invalid base64 image data: {str(decode_error)}") from decode_error
+    return await object_fetcher.fetch(ref)
+
+
+def _record_batch_calls(calls: Optional[list[dict]]) -> None:
+    """API call outcomes of a multi-page LLM request (shared by its pages) into breakers + cost ledger."""
+    if breakers:
+        breakers.record(calls)
+    cost_ledger.record_calls(calls)
+
+
+def _record_worker_meta(meta: dict) -> None:
+    """Fold per-page worker counters into the service-wide metrics."""
+    http = meta.get("http") or {}
+    http_metrics["pages"] += 1
+    http_metrics["requests"] += http.get("requests", 0)
+    http_metrics["new_connections"] += http.get("new_connections", 0)
+
+    memory = meta.get("memory") or {}
+    memory_metrics["peak_rss_mb"] = max(memory_metrics["peak_rss_mb"], memory.get("peak_rss_mb") or 0.0)
+    if memory.get("reduction", 1) > 1:
+        memory_metrics["reduced_pages"] += 1
+
+    llm = meta.get("llm")
+    if llm:
+        llm_metrics["calls"] += 1
+        llm_metrics["streamed"] += int(llm.get("streamed", False))
+        llm_metrics["seconds"] += llm.get("seconds", 0.0)
+        if llm.get("aborted"):
+            llm_metrics["aborted"][llm["aborted"]] = llm_metrics["aborted"].get(llm["aborted"], 0) + 1
+            llm_metrics["saved_seconds"] += llm.get("saved_seconds", 0.0)
+
+    stage_timings.record(meta.get("stages"))
+    if meta.get("tier"):
+        tier_metrics["tiers"][meta["tier"]] = tier_metrics["tiers"].get(meta["tier"], 0) + 1
+    for stage in meta.get("skipped") or {}:
+        tier_metrics["skipped"][stage] = tier_metrics["skipped"].get(stage, 0) + 1
+
+    crops = meta.get("crops")
+    if crops:
+        crop_metrics["pages"] += 1
+        crop_metrics["adaptive"] += int(crops.get("adaptive", False))
+        crop_metrics["sections"] += len(crops.get("sections", []))
+        crop_metrics["pixel_ratio"] += crops.get("pixel_ratio", 1.0)
+        crop_metrics["whitespace_cuts"] += crops.get("whitespace_cuts", 0)
+        if crops.get("fallback_reason"):
+            reason = crops["fallback_reason"]
+            crop_metrics["fallback"][reason] = crop_metrics["fallback"].get(reason, 0) + 1
 
----
 
-## 📋 Output Requirements:
-1. ต้องมีจำนนวนบรรทัดใกล้เคียงกับ Full Image OCR (ห้ามน้อยกว่า 70% ของจำนวนบรรทัดต้นฉบับ)
-2. ต้องครบทุกส่วนของเอกสาร (หัวเรื่อง, เนื้อหา, หมายเลข, วันที่, ฯลฯ)
-3. ตอบเฉพาะข้อความที่รวมแล้ว (ไม่ต้องอธิบาย ไม่ต้องแสดงความคิดเห็น)
+# =============================================================================
+# MEMORY BUDGET
+# =============================================================================
 
-ให้ผลลัพธ์ที่รวมและแก้ไขแล้ว (ต้องครบทุกบรรทัด):"""
+class MemoryBudget:
+    """
+    FIFO admission gate on the estimated image memory of pages in the pool.
 
-        worker_logger.info("Calling Typhoon LLM API (typhoon-v2.5-30b-a3b-instruct)...")
-        try:
-            response_step1 = client_step1.chat.completions.create(
-                model="typhoon-v2.5-30b-a3b-instruct",
-                messages=[
-                    {"role": "system", "content": "รวม OCR จาก scales ต่างๆ โดย**ห้ามลบหรือข้ามข้อความใดๆ** ต้องเก็บทุกบรรทัดจาก Full Image OCR และแก้เฉพาะคำผิดเท่านั้น ตอบเฉพาะข้อความที่รวมแล้ว"},
-                    {"role": "user", "content": prompt_step1}
-                ],
-                temperature=0.1,
-                max_tokens=20000
-            )
-            worker_logger.info("LLM API call completed successfully")
-        except Exception as llm_error:
-            worker_logger.error(f"LLM API call failed: {str(llm_error)}")
-            raise
+    Each page reserves its estimate (image_decode.estimate_task_bytes) before
+    it is handed to a worker. When the budget is used up, pages wait here in
+    arrival order instead of overcommitting worker memory. A page larger than
+    the whole budget runs alone.
+    """
 
-        typhoon_combined = response_step1.choices[0].message.content
-        worker_logger.info(f"LLM combined result: {len(typhoon_combined)} chars")
-
-        # [VALIDATION] Check LLM output
-        worker_logger.info("Validating LLM output...")
-        if not typhoon_combined or len(typhoon_combined.strip()) == 0:
-            worker_logger.error("=" * 80)
-            worker_logger.error("❌ LLM VALIDATION FAILED!")
-            worker_logger.error("LLM returned empty result!")
-            worker_logger.error("")
-            worker_logger.error("Input lengths:")
-            worker_logger.error(f"  Full: {len(full_result)} chars")
-            worker_logger.error(f"  Top: {len(top_result)} chars")
-            worker_logger.error(f"  Mid: {len(mid_result)} chars")
-            worker_logger.error(f"  Bot: {len(bot_result)} chars")
-            worker_logger.error("=" * 80)
-            raise RuntimeError("LLM returned empty result")
-
-        # Check if LLM output is too short compared to input (should be at least 50% of Full Image OCR)
-        MIN_LLM_RATIO = 0.5  # LLM output ต้องมีความยาวอย่างน้อย 50% ของ Full Image OCR
-        full_length = len(full_result.strip())
-        llm_length = len(typhoon_combined.strip())
-        llm_ratio = llm_length / full_length if full_length > 0 else 0
-
-        if llm_ratio < MIN_LLM_RATIO:
-            worker_logger.warning("=" * 80)
-            worker_logger.warning("⚠️  LLM OUTPUT TOO SHORT!")
-            worker_logger.warning(f"Full Image OCR: {full_length} chars")
-            worker_logger.warning(f"LLM Output: {llm_length} chars ({llm_ratio:.1%})")
-            worker_logger.warning(f"Expected: At least {MIN_LLM_RATIO:.0%} of Full Image OCR ({int(full_length * MIN_LLM_RATIO)} chars)")
-            worker_logger.warning("")
-            worker_logger.warning("LLM may have removed content! Using Full Image OCR as fallback.")
-            worker_logger.warning("=" * 80)
-
-            # Fallback to Full Image OCR
-            final_result = full_result
-            worker_logger.info(f"✓ Using Full Image OCR as final result: {len(final_result)} chars")
+    def __init__(self, total_bytes: int):
+        self.total = total_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.waited = 0
+        self._waiters: deque[tuple[int, asyncio.Future]] = deque()
+
+    def _fits(self, amount: int) -> bool:
+        return self.in_use == 0 or self.in_use + amount <= self.total
+
+    def _grant(self, amount: int) -> None:
+        self.in_use += amount
+        self.peak = max(self.peak, self.in_use)
+
+    def _release(self, amount: int) -> None:
+        self.in_use -= amount
+        while self._waiters:
+            waiting, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(waiting):
+                break
+            self._waiters.popleft()
+            self._grant(waiting)
+            future.set_result(None)
+
+    def resize(self, total_bytes: int) -> None:
+        """Change the budget (pool resized); waiters that now fit are admitted."""
+        self.total = total_bytes
+        self._release(0)
+
+    @asynccontextmanager
+    async def reserve(self, amount: int):
+        amount = min(amount, self.total)
+        if self._waiters or not self._fits(amount):
+            self.waited += 1
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append((amount, future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    self._release(0)  # Let the next waiter in line re-check
+                else:
+                    self._release(amount)  # Granted just before the cancel
+                raise
         else:
-            worker_logger.info(f"✓ LLM validation passed: {llm_length} chars ({llm_ratio:.1%} of Full Image)")
-            final_result = typhoon_combined
+            self._grant(amount)
+        try:
+            yield
+        finally:
+            self._release(amount)
 
-        worker_logger.info("[Step 5/5] Finalizing result...")
-        worker_logger.info(f"✓ Final result: {len(final_result.strip())} chars")
+    def stats(self) -> dict:
+        return {
+            "budget_mb": round(self.total / 1024 / 1024),
+            "in_use_mb": round(self.in_use / 1024 / 1024, 1),
+            "peak_mb": round(self.peak / 1024 / 1024, 1),
+            "waiting": sum(1 for _, future in self._waiters if not future.done()),
+            "waited_total": self.waited
+        }
 
-        # Log final memory usage
-        try:
-            import psutil
-            process = psutil.Process()
-            mem_info = process.memory_info()
-            worker_logger.info(f"Memory usage after processing: RSS={mem_info.rss / 1024 / 1024:.2f} MB, VMS={mem_info.vms / 1024 / 1024:.2f} MB")
-        except:
-            pass
 
-        worker_logger.info(f"OCR Worker completed successfully: {len(final_result)} chars")
-        worker_logger.info("=" * 80)
-        return final_result, 0.0
+# =============================================================================
+# SINGLE-FLIGHT COALESCING
+# =============================================================================
 
-    except Exception as e:
-        import traceback
-        error_msg = f"OCR Error: {str(e)}"
-        full_traceback = traceback.format_exc()
+class SingleFlight:
+    """
+    Coalesce identical OCR requests that are in flight at the same time.
+
+    Backend retries after a timeout, or two reviewers re-running the same
+    group, used to push the same page through the pool twice. The first
+    request for a key runs the pipeline as a task; later requests for the
+    same key await that task and get the same result (or the same error).
+    A caller that is cancelled or times out does not cancel the shared run.
+
+    The key is the image content hash plus the parameters that change the
+    output, the priority lane (an interactive request never waits behind a
+    bulk run of the same page) and the caller's API key set (dedup_scope):
+    a run is only shared by requests that would have paid for it with the
+    same keys, and only the request that ran it reports its cost.
+    """
 
-        worker_logger.error("=" * 80)
-        worker_logger.error(f"OCR Worker FAILED with exception: {error_msg}")
-        worker_logger.error("Full traceback:")
-        worker_logger.error(full_traceback)
-        worker_logger.error("=" * 80)
+    def __init__(self):
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(image_data: bytes, task_type: str, figure_language: str, priority: str = DEFAULT_LANE,
+            scope: str = "") -> str:
+        return f"{hashlib.sha256(image_data).hexdigest()}:{task_type}:{figure_language}:{priority}:{scope}"
+
+    async def run(self, key: str, factory) -> tuple:
+        """
+        Run factory() once per key at a time and share its result.
+
+        Args:
+            key: Coalescing key (see SingleFlight.key)
+            factory: Zero-argument coroutine function producing the result
+
+        Returns:
+            Tuple of (result, coalesced) - coalesced is True for a request that
+            awaited another request's run
+        """
+        task = self._in_flight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.coalesced += 1
+            logger.info(f"🔗 Coalesced with in-flight request {key[:16]}… "
+                        f"({self.coalesced} coalesced so far)")
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        # shield: one waiter giving up must not cancel the run for the others
+        return await asyncio.shield(task), coalesced
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # Mark retrieved - every waiter may have given up already
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "in_flight": len(self._in_flight),
+            "pipeline_runs": self.leaders,
+            "coalesced": self.coalesced
+        }
 
-        # Re-raise exception to propagate to parent process
-        # This allows proper error handling in perform_ocr()
-        raise RuntimeError(f"{error_msg}\n{full_traceback}") from e
 
-    finally:
-        # Clean up temp file
-        worker_logger.info("Cleanup: Removing main temporary file...")
-        try:
-            os.unlink(tmp_path)
-            worker_logger.info(f"Cleanup: Successfully removed {tmp_path}")
-        except Exception as cleanup_error:
-            worker_logger.warning(f"Cleanup: Failed to remove {tmp_path}: {cleanup_error}")
+def _estimate_page_bytes(image_data: bytes) -> int:
+    """Estimated worker memory for one page, from the image header only."""
+    try:
+        return image_decode.estimate_task_bytes(image_decode.probe(image_data))
+    except Exception:
+        # Undecodable - the worker reports the real error; reserve a typical page
+        return image_decode.WORKER_MEMORY_MB * 1024 * 1024 // 4
 
 
-async def perform_ocr(
+async def _run_ocr_worker(
     image_data: bytes,
     api_key: Union[str, List[str]],
-    task_type: str = "v1.5",
-    figure_language: str = "Thai"
-) -> tuple[str, float]:
+    task_type: str,
+    figure_language: str,
+    priority: str = DEFAULT_LANE,
+    deadline: Optional[float] = None,
+    on_provisional: Optional[Callable[[str], None]] = None,
+    token_budget: Optional[TokenBudget] = None
+) -> tuple[str, float, dict]:
     """
-    Perform OCR on image data using Multi-OCR + LLM Ensemble.
-
-    Runs in a separate process with 5 parallel OCR engines (multithreading).
-
-    Args:
-        image_data: Raw image bytes
-        api_key: Single API key or list of 4 keys [full, top, mid, bot]
-                 LLM uses keys[0] and keys[1]
-        task_type: OCR task type (v1.5, default, structure)
-        figure_language: Language for figure analysis
+    Run the OCR pipeline stages and map failures to OcrError subclasses.
+
+    The page first waits for a pool slot in its priority lane (dispatcher),
+    then for image memory (memory_budget) and, with several uvicorn workers,
+    for a host slot (host_slots), and runs ocr_stage in the pool.
+    It then reserves a place in the merge stage (stages.py) before giving
+    the pool slot back, and the LLM merge runs on the merge stage's threads.
+    Keys whose circuit breaker is open are left out of the key plan of each
+    stage, and the API call outcomes are fed back into the breakers. With a
+    deadline, the wait is bounded by it and each stage gets a Budget (stage
+    p95s) to decide which steps still fit. on_provisional is called on the
+    event loop with the Full Image OCR text as soon as the worker has it.
+    Once token_budget is used up, the Budget caps the page at tier full_only.
+    The page's cost (cost.page_cost) is added to meta["cost"], the budget and
+    the cost ledger - for a failed page from the calls it made.
 
     Returns:
-        Tuple of (text, confidence)
+        Tuple of (text, confidence, meta)
     """
     global process_pool
 
     logger.info(f"perform_ocr called: image_size={len(image_data)} bytes, task_type={task_type}")
 
     loop = asyncio.get_event_loop()
+    submitted_to: Optional[ProcessPoolExecutor] = None
+    spent: list[dict] = []  # API calls made for this page so far
+
+    def record_calls(calls: Optional[list[dict]], key_plan: Optional[dict] = None) -> None:
+        if breakers:
+            breakers.record(calls)
+            breakers.release(key_plan)  # Probes this stage claimed but did not make
+        cost_ledger.record_calls(calls)
+        spent.extend(calls or [])
+
+    def stage_budget() -> Budget:
+        budget = stage_timings.budget(deadline)
+        if token_budget is not None and token_budget.exhausted:
+            budget.max_tier = "full_only"
+        return budget
+
+    async def submit() -> tuple[str, float, dict]:
+        nonlocal submitted_to
+        # Wait for a worker slot by lane (SJF on encoded size and planned tier), then for image memory
+        async with dispatcher.slot(priority, cost=job_cost(len(image_data), stage_budget().plan_tier())):
+            async with memory_budget.reserve(estimated_bytes):
+                # Plan at dispatch time so the breakers and the remaining budget are current;
+                # the OCR stage only calls the OCR endpoint (the merge stage plans chat below)
+                key_plan = (breakers.plan(keys, ("ocr",) if merge_stage_pool else ENDPOINTS)
+                            if breakers else None)
+                budget = stage_budget()
+                try:
+                    # Other uvicorn workers on the host share this limit (multi-worker mode)
+                    async with host_slots.hold_async() if host_slots else contextlib.nullcontext():
+                        # The autoscaler may swap the pool while this page runs on the old one
+                        submitted_to = process_pool
+                        with provisional_channel.listen(on_provisional) as provisional_token:
+                            result = await loop.run_in_executor(
+                                process_pool,
+                                ocr_stage if merge_stage_pool else ocr_worker,
+                                image_data,
+                                api_key,
+                                task_type,
+                                figure_language,
+                                key_plan,
+                                budget,
+                                provisional_token
+                            )
+                except Exception as e:
+                    record_calls(getattr(e, "calls", None), key_plan)
+                    raise
+            if merge_stage_pool is None:
+                record_calls(result[2].get("calls"), key_plan)
+                return result
+            record_calls(result["calls"], key_plan)
+            chat_keys = breakers.plan(keys, ("chat",))["chat"] if breakers else None
+            # Before giving the pool slot back: a full merge queue holds this slot (backpressure)
+            await merge_stage_pool.reserve()
+
+        ocr = result
+        budget = stage_budget()
+        try:
+            if (merge_batcher is not None and budget.allows_llm()
+                    and merge_batcher.eligible(ocr, deadline)):
+                text, confidence, meta = await merge_batcher.merge(ocr, chat_keys, budget)
+            else:
+                text, confidence, meta = await merge_stage_pool.run(merge_stage, ocr, chat_keys, budget)
+        except Exception as e:
+            record_calls(getattr(e, "calls", None), {"chat": chat_keys} if chat_keys else None)
+            raise
+        record_calls(meta["calls"], {"chat": chat_keys} if chat_keys else None)
+        meta["calls"] = ocr["calls"] + meta["calls"]
+        return text, confidence, meta
+
+    def record_cost(meta: Optional[dict]) -> None:
+        """Page cost into meta, the token budget and the ledger (meta None = the page failed)."""
+        # A batched page carries its share of the batch request (whose calls reach the ledger via on_calls)
+        page = page_cost(meta["calls"], meta.get("batch")) if meta else page_cost(spent)
+        capped = meta is not None and "token_budget" in (meta.get("skipped") or {}).values()
+        if meta is not None:
+            meta["cost"] = page
+        if token_budget is not None:
+            token_budget.add(page)
+            token_budget.capped_pages += int(capped)
+        cost_ledger.capped_pages += int(capped)
+        cost_ledger.record_page(page, task_type, meta.get("tier") if meta else None, success=meta is not None)
+
+    keys = [api_key] if isinstance(api_key, str) else list(api_key[:4])
+    timeout = 300.0  # 5 minutes (includes lane + budget wait)
+    if deadline is not None:
+        tier_metrics["deadline_requests"] += 1
+        timeout = min(timeout, deadline - time.time())
+        if timeout <= 0:
+            tier_metrics["deadline_exceeded"] += 1
+            raise DeadlineExceededError("Request deadline already passed before OCR started")
 
     try:
         # Run OCR in a separate process with timeout
-        logger.info("Submitting OCR task to process pool...")
-
-        result = await asyncio.wait_for(
-            loop.run_in_executor(
-                process_pool,
-                _ocr_worker,
-                image_data,
-                api_key,
-                task_type,
-                figure_language
-            ),
-            timeout=300.0  # 5 minutes timeout
-        )
+        estimated_bytes = _estimate_page_bytes(image_data)
+        logger.info(f"Submitting OCR task to process pool (lane {priority}, estimated image memory "
+                    f"{estimated_bytes / 1024 / 1024:.0f} MB)...")
+
+        result = await asyncio.wait_for(submit(), timeout=timeout)
+        record_cost(result[2])
 
         logger.info("OCR task completed from process pool")
+        recent_outcomes.record(True)
         return result
 
     except asyncio.TimeoutError:
+        record_cost(None)
+        if deadline is not None and timeout < 300.0:
+            tier_metrics["deadline_exceeded"] += 1
+            logger.error(f"⏱️  Request deadline passed after {timeout:.1f}s without a usable result")
+            raise DeadlineExceededError(f"Request deadline passed ({timeout:.1f}s budget)")
+        recent_outcomes.record(False)
         error_msg = "OCR task timed out after 300 seconds (5 minutes)"
         logger.error("=" * 80)
         logger.error(f"⏱️  {error_msg}")
@@ -608,14 +897,18 @@ async def perform_ocr(
         raise OcrTimeoutError(error_msg)
 
     except Exception as e:
+        record_cost(None)
         logger.error("=" * 80)
         logger.error(f"perform_ocr failed with exception: {str(e)}")
         logger.exception("Full exception traceback:")
 
         error_str = str(e).lower()
+        if isinstance(e, BrokenProcessPool) and submitted_to is process_pool:
+            _schedule_pool_rebuild(str(e))
 
         # Categorize error and raise appropriate custom exception
         if any(keyword in error_str for keyword in ['pool', 'process', 'terminated', 'abruptly', 'broken']):
+            recent_outcomes.record(False)
             logger.critical("🔥 CRITICAL: Process pool crash detected!")
             logger.critical("Possible root causes:")
             logger.critical("  1. Out of Memory (OOM) - worker process killed by system")
@@ -637,65 +930,426 @@ async def perform_ocr(
             raise InvalidImageError(f"Invalid image data: {str(e)}") from e
 
         elif any(keyword in error_str for keyword in ['api', 'quota', 'rate limit', '401', '403', '429']):
+            recent_outcomes.record(False)
             logger.error("API error detected (possibly quota/rate limit)")
             logger.error("=" * 80)
             raise OcrApiError(f"API error: {str(e)}") from e
 
         else:
             # Generic OCR error
+            recent_outcomes.record(False)
             logger.error("=" * 80)
             raise OcrError(f"OCR processing failed: {str(e)}") from e
 
 
+# =============================================================================
+# DISTRIBUTED WORKER MODE (shared Postgres queue)
+# =============================================================================
+
+# Failures worth another attempt on any instance; invalid images never are
+RETRYABLE_ERROR_TYPES = {"timeout", "api_error", "process_crash", "unknown"}
+
+
+async def _execute_queued_job(job: QueuedJob) -> dict:
+    """Run a claimed queue job through the local pipeline."""
+    params = job.params
+    deadline = params.get("deadline_at")
+    on_provisional = None
+    if params.get("two_phase") and job_queue is not None:
+        pending: list[asyncio.Task] = []
+
+        def on_provisional(text: str) -> None:
+            provisional = {"text": text, "provisional": True}
+            pending.append(asyncio.create_task(job_queue.provisional(job.id, provisional)))
+            if webhooks is not None and params.get("callback_url"):
+                pending.append(asyncio.create_task(webhooks.send(
+                    params["callback_url"], "job.provisional",
+                    {"job_id": job.id, "batch_id": job.batch_id, "id": job.item_id, "status": "running",
+                     "result": provisional}
+                )))
+
+    result = await perform_ocr(
+        image_data=job.image,
+        api_key=params["api_key"],
+        task_type=params.get("task_type", "v1.5"),
+        figure_language=params.get("figure_language", "Thai"),
+        dedup=params.get("dedup", False),
+        priority=params.get("priority", DEFAULT_LANE),
+        deadline=deadline,
+        on_provisional=on_provisional
+    )
+    if on_provisional is not None and pending:
+        # The provisional write must land before complete() stores the final result
+        await asyncio.gather(*pending, return_exceptions=True)
+    return {
+        "text": result.text,
+        "confidence": result.confidence,
+        "near_duplicate": result.near_duplicate is not None,
+        "match_distance": result.near_duplicate.distance if result.near_duplicate else None,
+        "tier": result.tier,
+        "skipped_stages": result.skipped_stages,
+        "cost": result.cost
+    }
+
+
+async def _notify_job_finished(job: dict) -> None:
+    """QueueWorker completion hook: queue the job's webhook if it has a callback_url."""
+    url = job["params"].get("callback_url")
+    if webhooks is None or not url:
+        return
+    payload = {key: value for key, value in job.items() if key != "params"}
+    await webhooks.send(url, f"job.{job['status']}", payload)
+
+
+def _classify_job_error(error: Exception) -> tuple[str, bool]:
+    """Map a job failure to (error_type, retryable)."""
+    error_type = _error_type(error)
+    return error_type, error_type in RETRYABLE_ERROR_TYPES
+
+
+def _job_status(row: dict) -> JobStatusResponse:
+    return JobStatusResponse(
+        job_id=row["id"],
+        batch_id=row["batch_id"],
+        id=row["item_id"],
+        status=row["status"],
+        attempts=row["attempts"],
+        result=row["result"],
+        error=row["error"],
+        error_type=row["error_type"],
+        worker=row["lease_owner"],
+        created_at=row["created_at"].isoformat() if row["created_at"] else None,
+        started_at=row["started_at"].isoformat() if row["started_at"] else None,
+        finished_at=row["finished_at"].isoformat() if row["finished_at"] else None
+    )
+
+
 # =============================================================================
 # FASTAPI APP
 # =============================================================================
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Application lifespan handler."""
-    global process_pool
-    import multiprocessing
+async def _warm_up_pool(pool: ProcessPoolExecutor, max_workers: int) -> list[dict]:
+    """
+    Pre-spawn every worker and wait until each has run init_worker().
+
+    ProcessPoolExecutor only creates processes on submit, so without this the
+    first requests after a deploy pay for process spawn + library imports.
+    Each submitted status task spawns a worker (none are idle yet); a worker
+    that finishes early may take a second task, so rounds are repeated until
+    every PID has reported.
 
+    Returns:
+        One worker_status() dict per ready worker
+    """
+    loop = asyncio.get_running_loop()
+    ready: dict[int, dict] = {}
+    deadline = loop.time() + WORKER_WARMUP_TIMEOUT
+
+    while len(ready) < max_workers and loop.time() < deadline:
+        missing = max_workers - len(ready)
+        statuses = await asyncio.wait_for(
+            asyncio.gather(*[loop.run_in_executor(pool, worker_status) for _ in range(missing)]),
+            timeout=max(0.1, deadline - loop.time())
+        )
+        for worker in statuses:
+            ready.setdefault(worker["pid"], worker)
+
+    return list(ready.values())
+
+
+def _new_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Create the OCR process pool (not yet spawned - see _warm_up_pool)."""
     # CRITICAL FIX: Use 'spawn' instead of 'fork' to avoid native library conflicts
     # fork() has issues with OpenCV, PIL, and other native libraries
-    multiprocessing.set_start_method('spawn', force=True)
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,  # Workers import only ocr_pipeline + its libraries
+        initargs=(provisional_channel.queue,)
+    )
+
 
-    # Get max workers from env or default to 5 (for 6 cores / 12 GB RAM)
-    max_workers = int(os.environ.get('OCR_MAX_WORKERS', '5'))
+def _schedule_pool_rebuild(reason: str) -> None:
+    """Mark the pool broken and rebuild it in the background (once, however many requests saw it)."""
+    global pool_rebuild_task
+    if pool_rebuild_task is not None and not pool_rebuild_task.done():
+        return
+    pool_state.update(state="broken", broken_since=time.time(), last_error=reason[:200])
+    pool_rebuild_task = asyncio.create_task(_rebuild_pool())
+
+
+async def _rebuild_pool() -> None:
+    """
+    Replace a broken ProcessPoolExecutor (a worker was killed, e.g. OOM).
+
+    A broken executor rejects every later submit, so without this the
+    instance stays up but fails every page. Retries until a new pool warms up.
+    """
+    global process_pool, worker_readiness
+    async with pool_swap_lock:
+        max_workers = process_pool._max_workers
+        while True:
+            pool_state["state"] = "rebuilding"
+            worker_readiness = []
+            logger.critical(f"🔧 Rebuilding process pool ({max_workers} workers): {pool_state['last_error']}")
+            try:
+                process_pool.shutdown(wait=False, cancel_futures=True)
+                process_pool = _new_pool(max_workers)
+                worker_readiness = await _warm_up_pool(process_pool, max_workers)
+            except Exception as e:
+                pool_state.update(state="broken", last_error=str(e)[:200])
+                logger.error(f"✗ Pool rebuild failed, retrying in {POOL_REBUILD_RETRY_SECONDS:.0f}s: {str(e)}")
+                await asyncio.sleep(POOL_REBUILD_RETRY_SECONDS)
+                continue
+            pool_state.update(state="ready", broken_since=None)
+            pool_state["rebuilds"] += 1
+            logger.info(f"✅ Process pool rebuilt: {len(worker_readiness)}/{max_workers} workers ready")
+            return
+
+
+async def _resize_pool(workers: int, reason: str) -> bool:
+    """
+    Replace the pool with a warmed one of `workers` processes.
+
+    ProcessPoolExecutor can't change its size, so a new pool is spawned and
+    warmed first; the old one gets no new pages and its workers exit once
+    their running pages finish. Lane slots and (unless OCR_MEMORY_BUDGET_MB
+    is set) the image memory budget follow the new size.
+
+    Returns:
+        False when the pool is not ready (rebuilding) or warm-up failed
+    """
+    global process_pool, worker_readiness
+    async with pool_swap_lock:
+        current = process_pool._max_workers
+        if pool_state["state"] != "ready" or workers == current:
+            return False
+        logger.info(f"📐 Resizing process pool {current} → {workers} workers ({reason})")
+        started = time.perf_counter()
+        new_pool = _new_pool(workers)
+        try:
+            readiness = await _warm_up_pool(new_pool, workers)
+        except asyncio.CancelledError:
+            new_pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception as e:
+            new_pool.shutdown(wait=False, cancel_futures=True)
+            logger.error(f"✗ Pool resize to {workers} workers failed, keeping {current}: {str(e)}")
+            return False
+        old_pool, process_pool, worker_readiness = process_pool, new_pool, readiness
+        dispatcher.resize(workers)
+        if not MEMORY_BUDGET_MB:
+            memory_budget.resize(image_decode.WORKER_MEMORY_MB * workers * 1024 * 1024)
+        old_pool.shutdown(wait=False)
+        logger.info(f"✅ Process pool resized to {workers} workers in {time.perf_counter() - started:.2f}s "
+                    f"({len(readiness)}/{workers} warmed)")
+        return True
+
+
+async def _autoscale_loop() -> None:
+    """Re-evaluate the pool size every AUTOSCALE_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(AUTOSCALE_INTERVAL_SECONDS)
+        if pool_state["state"] != "ready" or pool_swap_lock.locked():
+            continue
+        try:
+            memory_mb = await asyncio.to_thread(available_memory_mb)
+            target = autoscaler.decide(process_pool._max_workers, dispatcher.stats(), memory_mb)
+            if target is not None:
+                await _resize_pool(target, autoscaler.last_decision["reason"])
+        except Exception as e:
+            logger.error(f"✗ Autoscaler step failed: {str(e)}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan handler."""
+    global process_pool, phash_index, worker_readiness, job_queue, queue_worker, memory_budget, single_flight, dispatcher
+    global provisional_channel, webhooks, autoscale_task, merge_stage_pool, merge_batcher, host_slots
+    mp_context = multiprocessing.get_context('spawn')
+
+    # Start at the lower bound; the autoscaler grows the pool under load.
+    # OCR_MAX_WORKERS defaults to 5 (for 6 cores / 12 GB RAM), OCR_MIN_WORKERS to OCR_MAX_WORKERS
+    max_workers = autoscaler.min_workers
 
     logger.info("=" * 80)
     logger.info("🚀 Multi-Scale OCR Microservice starting...")
-    logger.info(f"   Max workers: {max_workers} processes")
+    logger.info(f"   Workers: {max_workers} processes (bounds {autoscaler.min_workers}-{autoscaler.max_workers}, "
+                f"autoscaling {'on' if autoscaler.enabled else 'off'})")
     logger.info(f"   Multiprocessing mode: spawn (native library compatible)")
     logger.info(f"   Log level: {LOG_LEVEL}")
+    logger.info(f"   Typhoon API: {TYPHOON_BASE_URL}")
     logger.info(f"   Using: Typhoon 2.5 Multi-Scale (Full + 3 Crops) + 2-Step LLM Ensemble")
     logger.info(f"   Total: 4 Typhoon engines per image")
+    if cassette.CASSETTE_MODE != "off":
+        # replay never reaches the API: results come from recorded traffic
+        logger.warning(f"📼 Cassette mode '{cassette.CASSETTE_MODE}': Typhoon traffic "
+                       f"{'recorded to' if cassette.CASSETTE_MODE == 'record' else 'replayed from'} {cassette.CASSETTE_DIR}")
     logger.info("=" * 80)
 
+    # Shared with every worker at spawn: Full Image OCR of two-phase requests comes back over it
+    provisional_channel = ProvisionalChannel(mp_context)
+    provisional_channel.start(asyncio.get_running_loop())
+
     try:
-        process_pool = ProcessPoolExecutor(max_workers=max_workers)
+        process_pool = _new_pool(max_workers)
         logger.info(f"✓ Process pool initialized with {max_workers} workers (spawn mode)")
     except Exception as e:
         logger.error(f"✗ Failed to initialize process pool: {str(e)}")
         raise
 
+    budget_mb = MEMORY_BUDGET_MB or image_decode.WORKER_MEMORY_MB * max_workers
+    memory_budget = MemoryBudget(budget_mb * 1024 * 1024)
+    logger.info(f"✓ Image memory budget: {budget_mb} MB across {max_workers} workers "
+                f"({image_decode.WORKER_MEMORY_MB} MB per worker)")
+
+    dispatcher = PriorityDispatcher(max_workers)
+    logger.info(f"✓ Priority lanes: weights {dispatcher.weights}, SJF {'on' if dispatcher.sjf else 'off'}, "
+                f"max wait {dispatcher.max_wait_seconds:.0f}s")
+
+    if HOST_SLOTS:
+        host_slots = HostSemaphore("pages", HOST_SLOTS)
+        logger.info(f"✓ Host-wide limit: {HOST_SLOTS} page(s) in the OCR stage across all uvicorn workers "
+                    f"({COORDINATION_DIR})")
+    elif WEB_CONCURRENCY > 1:
+        logger.warning(f"{WEB_CONCURRENCY} uvicorn workers without OCR_HOST_SLOTS: each runs up to "
+                       f"{autoscaler.max_workers} pages at once with no host-wide limit")
+    if HOST_KEY_CONCURRENCY:
+        logger.info(f"✓ Host-wide key limit: {HOST_KEY_CONCURRENCY} call(s) in flight per API key")
+
+    if STAGE_SPLIT:
+        llm_concurrency = LLM_CONCURRENCY or autoscaler.max_workers
+        merge_stage_pool = PipelineStage("merge", llm_concurrency, LLM_QUEUE_SIZE or 2 * llm_concurrency)
+        try:
+            # LLM merge runs in this process: import its libraries + open connections off the request path
+            await asyncio.to_thread(init_merge_stage)
+        except Exception as e:
+            logger.error(f"✗ Merge stage warm-up failed (connections open on first use): {str(e)}")
+        logger.info(f"✓ Pipeline stages: OCR in the pool, LLM merge on {merge_stage_pool.concurrency} thread(s), "
+                    f"queue {merge_stage_pool.queue_size}")
+        if LLM_BATCH_ENABLED:
+            merge_batcher = MergeBatcher(merge_stage_pool, merge_batch, merge_stage, on_calls=_record_batch_calls)
+            logger.info(f"✓ LLM batching: up to {merge_batcher.max_pages} pages of ≤{merge_batcher.max_chars} chars "
+                        f"within {merge_batcher.window_seconds * 1000:.0f}ms")
+    else:
+        if LLM_BATCH_ENABLED:
+            logger.warning("OCR_LLM_BATCH needs OCR_STAGE_SPLIT=true - LLM batching disabled")
+        logger.info("Pipeline stages not split (OCR_STAGE_SPLIT=false): LLM merge runs in the pool worker")
+
+    if COALESCE_ENABLED:
+        single_flight = SingleFlight()
+        logger.info("✓ Identical in-flight requests are coalesced")
+    else:
+        logger.info("Request coalescing disabled (OCR_COALESCE_ENABLED=false)")
+
+    # Pre-spawn and warm all workers so the first request does not pay cold start
+    warmup_started = time.perf_counter()
+    try:
+        worker_readiness = await _warm_up_pool(process_pool, max_workers)
+    except Exception as e:
+        # Workers will still be spawned on demand - degrade instead of failing startup
+        logger.error(f"✗ Worker warm-up failed: {str(e)}")
+    warmup_seconds = time.perf_counter() - warmup_started
+    pool_state["state"] = "ready"
+    logger.info(f"✓ Workers ready: {len(worker_readiness)}/{max_workers} in {warmup_seconds:.2f}s")
+    for worker in worker_readiness:
+        logger.info(f"   PID {worker['pid']}: imports {worker['import_seconds']:.2f}s, "
+                    f"RSS {worker['rss_mb']} MB, web stack loaded: {worker['web_stack_loaded']}")
+
+    if PHASH_ENABLED:
+        try:
+            phash_index = PHashIndex(PHASH_DB_PATH, max_distance=PHASH_MAX_DISTANCE, max_entries=PHASH_MAX_ENTRIES,
+                                     ttl_seconds=PHASH_TTL_DAYS * 86400)
+            phash_index.open()
+            logger.info(f"✓ Near-duplicate index ready: {len(phash_index)} page(s), max distance {PHASH_MAX_DISTANCE}")
+        except Exception as e:
+            # Near-duplicate reuse is an optimization - never block startup on it
+            logger.error(f"✗ Failed to open perceptual-hash index, near-duplicate reuse disabled: {str(e)}")
+            phash_index = None
+    else:
+        logger.info("Near-duplicate index disabled (OCR_PHASH_ENABLED=false)")
+
+    # Always running: bounds can be widened at runtime (POST /admin/pool)
+    autoscale_task = asyncio.create_task(_autoscale_loop())
+
+    if object_fetcher.enabled:
+        logger.info(f"✓ Image references: MinIO {object_fetcher.endpoint or 'disabled'}, "
+                    f"shared volume roots {[str(root) for root in object_fetcher.volume_roots] or 'disabled'}, "
+                    f"{object_fetcher.concurrency} concurrent fetch(es)")
+
+    if QUEUE_DSN:
+        # Before the queue worker: pending callbacks from before a restart go out first
+        try:
+            outbox = WebhookOutbox(WEBHOOK_DB_PATH)
+            outbox.open()
+            # One sender per outbox on the host, whichever uvicorn worker holds the role
+            sender_role = Leadership(f"webhooks-{hashlib.sha256(str(WEBHOOK_DB_PATH.resolve()).encode()).hexdigest()[:8]}")
+            webhooks = WebhookSender(outbox, leader=sender_role)
+            webhooks.start()
+            logger.info(f"✓ Webhook outbox ready: {outbox.counts().get('pending', 0)} pending event(s)")
+        except Exception as e:
+            logger.error(f"✗ Failed to open webhook outbox, job callbacks disabled: {str(e)}")
+            webhooks = None
+        try:
+            job_queue = JobQueue(QUEUE_DSN, lease_seconds=QUEUE_LEASE_SECONDS, max_attempts=QUEUE_MAX_ATTEMPTS,
+                                 priority_seconds=QUEUE_PRIORITY_SECONDS)
+            await job_queue.open()
+            logger.info("✓ Shared job queue connected (POST /jobs enabled)")
+            if QUEUE_WORKER_ENABLED:
+                queue_worker = QueueWorker(
+                    job_queue,
+                    execute=_execute_queued_job,
+                    classify=_classify_job_error,
+                    concurrency=QUEUE_CONCURRENCY or autoscaler.max_workers,
+                    poll_interval=QUEUE_POLL_INTERVAL,
+                    on_finished=_notify_job_finished
+                )
+                queue_worker.start()
+                logger.info(f"✓ Distributed worker mode: {queue_worker.concurrency} consumer(s) as {queue_worker.instance_id}")
+        except Exception as e:
+            logger.error(f"✗ Failed to connect job queue, /jobs disabled: {str(e)}")
+            job_queue = None
+            queue_worker = None
+
     yield
 
     logger.info("=" * 80)
     logger.info("👋 Multi-OCR Microservice shutting down...")
+    if queue_worker is not None:
+        await queue_worker.stop()
+    if job_queue is not None:
+        await job_queue.close()
+    if pool_rebuild_task is not None:
+        pool_rebuild_task.cancel()
+    if autoscale_task is not None:
+        autoscale_task.cancel()
+        await asyncio.gather(autoscale_task, return_exceptions=True)
+    if webhooks is not None:
+        await webhooks.stop()
+        webhooks.outbox.close()
+        webhooks.leader.release()
+    if merge_stage_pool is not None:
+        merge_stage_pool.shutdown()
+    object_fetcher.close()
     try:
         process_pool.shutdown(wait=True)
         logger.info("✅ Process pool shut down cleanly")
     except Exception as e:
         logger.error(f"✗ Error during process pool shutdown: {str(e)}")
+    # Drop every reference to the channel queue (the pool keeps its initargs) so its
+    # semaphores are unlinked now, not reported as leaked at interpreter exit
+    process_pool = None
+    provisional_channel.close()
+    provisional_channel = None
+    if phash_index is not None:
+        phash_index.close()
     logger.info("=" * 80)
 
 
 app = FastAPI(
     title="Multi-Scale OCR Microservice",
     description="OCR service using Typhoon OCR Multi-Scale (4× OCR + LLM Ensemble) with Thai language optimization",
-    version="2.0.0",
+    version=SERVICE_VERSION,
     lifespan=lifespan
 )
 
@@ -713,15 +1367,215 @@ app.add_middleware(
 # ENDPOINTS
 # =============================================================================
 
+def _health() -> HealthResponse:
+    alive, _ = check_liveness(pool_state)
+    ready, checks = check_readiness(
+        pool_state,
+        dispatcher.stats() if dispatcher else None,
+        breakers.stats() if breakers else None,
+        recent_outcomes
+    )
+    return HealthResponse(
+        status="unhealthy" if not alive else "healthy" if ready else "degraded",
+        version=SERVICE_VERSION,
+        workers_ready=len(worker_readiness),
+        workers_total=process_pool._max_workers if process_pool else 0,
+        pool_state=pool_state["state"],
+        ready=ready,
+        checks=checks
+    )
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check endpoint."""
-    return HealthResponse(status="healthy", version="2.0.0")
+    """
+    Health summary: 200 while the instance is alive (status healthy or degraded), 503 otherwise.
+
+    Use /health/ready for load balancer routing and /health/live for restarts.
+    """
+    health = _health()
+    if health.status == "unhealthy":
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=health.model_dump())
+    return health
+
+
+@app.get("/health/live")
+async def health_live():
+    """Liveness: 503 only when the pool has stayed broken (rebuilds failing) - restart the instance."""
+    alive, checks = check_liveness(pool_state)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if alive else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "alive" if alive else "dead", "checks": checks}
+    )
+
+
+@app.get("/health/ready", response_model=HealthResponse)
+async def health_ready():
+    """Readiness: 503 while the pool is not ready, lanes are backed up, every key is open or errors spike."""
+    health = _health()
+    if not health.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=health.model_dump())
+    return health
+
+
+@app.get("/metrics")
+async def metrics():
+    """Service metrics (of this uvicorn worker; "host" is host-wide): dispatch lanes, pipeline stages, API cost, image fetches, coalescing, two-phase results, webhooks, deadline tiers, HTTP connection pooling, worker image memory, crop planning and the LLM combine step."""
+    requests = http_metrics["requests"]
+    crop_pages = crop_metrics["pages"]
+    return {
+        "dispatch": dispatcher.stats() if dispatcher else None,
+        "breakers": {
+            "enabled": breakers is not None,
+            "open": breakers.stats()["open"] if breakers else 0
+        },
+        "pool": {**pool_state, "workers_ready": len(worker_readiness)},
+        "host": {
+            "pid": os.getpid(),
+            "web_workers": WEB_CONCURRENCY,
+            "pages": host_slots.stats() if host_slots else {"enabled": False},
+            "keys": key_stats()
+        },
+        "autoscaler": {**autoscaler.stats(), "workers": process_pool._max_workers if process_pool else 0},
+        "stages": {
+            "split": merge_stage_pool is not None,
+            "ocr": {"slots": dispatcher.slots, "running": dispatcher.running} if dispatcher else None,
+            "merge": merge_stage_pool.stats() if merge_stage_pool else None,
+            "batching": merge_batcher.stats() if merge_batcher else {"enabled": False}
+        },
+        "cost": cost_ledger.stats(),
+        "fetch": object_fetcher.stats(),
+        "coalescing": single_flight.stats() if single_flight else {"enabled": False},
+        "two_phase": provisional_channel.stats() if provisional_channel else {"enabled": False},
+        "webhooks": await webhooks.stats() if webhooks else {"enabled": False},
+        "deadline": {
+            **stage_timings.stats(),
+            "requests": tier_metrics["deadline_requests"],
+            "tiers": tier_metrics["tiers"],
+            "skipped": tier_metrics["skipped"],
+            "exceeded": tier_metrics["deadline_exceeded"]
+        },
+        "crops": {
+            "pages": crop_pages,
+            "adaptive_pages": crop_metrics["adaptive"],
+            "mean_sections": round(crop_metrics["sections"] / crop_pages, 2) if crop_pages else None,
+            "mean_pixel_ratio": round(crop_metrics["pixel_ratio"] / crop_pages, 3) if crop_pages else None,
+            "whitespace_cuts": crop_metrics["whitespace_cuts"],
+            "fallback": crop_metrics["fallback"]
+        },
+        "llm": {
+            "calls": llm_metrics["calls"],
+            "streamed": llm_metrics["streamed"],
+            "mean_seconds": round(llm_metrics["seconds"] / llm_metrics["calls"], 3) if llm_metrics["calls"] else None,
+            "aborted": llm_metrics["aborted"],
+            "estimated_saved_seconds": round(llm_metrics["saved_seconds"], 1)
+        },
+        "memory": {
+            **(memory_budget.stats() if memory_budget else {}),
+            "worker_peak_rss_mb": memory_metrics["peak_rss_mb"],
+            "reduced_decode_pages": memory_metrics["reduced_pages"]
+        },
+        "http": {
+            "pool": worker_readiness[0]["http_config"] if worker_readiness else None,
+            "prewarmed_connections": sum(w.get("prewarmed_connections", 0) for w in worker_readiness),
+            "pages": http_metrics["pages"],
+            "requests": requests,
+            "new_connections": http_metrics["new_connections"],
+            "connection_reuse_rate": round(1 - http_metrics["new_connections"] / requests, 4) if requests else None
+        }
+    }
+
+
+def _require_admin(token: Optional[str]) -> None:
+    """Reject admin calls without the configured OCR_ADMIN_TOKEN (all of them when it is unset)."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Admin API disabled (set OCR_ADMIN_TOKEN to enable it)")
+    # Constant-time comparison: response timing must not reveal how much of the token matched
+    if not token or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token")
+
+
+def _require_breakers() -> BreakerBoard:
+    if breakers is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Circuit breakers are disabled (OCR_BREAKER_ENABLED=false)"
+        )
+    return breakers
+
+
+@app.get("/admin/breakers")
+async def get_breakers(x_admin_token: Optional[str] = Header(None)):
+    """Circuit breaker state per API key fingerprint and endpoint (ocr / chat)."""
+    _require_admin(x_admin_token)
+    return _require_breakers().stats()
+
+
+@app.post("/admin/breakers/reset")
+async def reset_breakers(key: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Force breakers closed - all, or those of one key fingerprint (?key=…abcd#1a2b3c)."""
+    _require_admin(x_admin_token)
+    count = _require_breakers().reset(key)
+    logger.info(f"🔌 Circuit breakers reset by admin: {count} breaker(s){f' for key {key}' if key else ''}")
+    return {"reset": count}
+
+
+class PoolBoundsRequest(BaseModel):
+    """Request model for POST /admin/pool"""
+    min_workers: int
+    max_workers: int
+
+
+def _pool_status() -> dict:
+    return {
+        "workers": process_pool._max_workers if process_pool else 0,
+        "workers_ready": len(worker_readiness),
+        "state": pool_state["state"],
+        **autoscaler.stats()
+    }
+
+
+@app.get("/admin/pool")
+async def get_pool(x_admin_token: Optional[str] = Header(None)):
+    """Current pool size, autoscaling bounds and the last scaling decision."""
+    _require_admin(x_admin_token)
+    return _pool_status()
+
+
+@app.post("/admin/pool")
+async def set_pool_bounds(request: PoolBoundsRequest, x_admin_token: Optional[str] = Header(None)):
+    """
+    Change the autoscaling bounds without a restart.
+
+    A pool outside the new bounds is resized to the nearest bound right away;
+    min_workers == max_workers pins the pool to that size. Bounds above
+    OCR_HARD_MAX_WORKERS, or a min_workers that would grow the pool beyond
+    what host memory can take, are rejected (400).
+    """
+    _require_admin(x_admin_token)
+    current = process_pool._max_workers
+    target = max(request.min_workers, min(request.max_workers, current))
+    affordable = autoscaler.affordable(available_memory_mb())
+    if target > current and affordable is not None and target > affordable:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Not enough memory for {target} workers: host can take {max(affordable, 0)} "
+                   f"at {autoscaler.worker_memory_mb} MB each"
+        )
+    try:
+        autoscaler.set_bounds(request.min_workers, request.max_workers)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    logger.info(f"📐 Pool bounds set by admin: {request.min_workers}-{request.max_workers} workers")
+    if target != current:
+        await _resize_pool(target, "admin bounds")
+    return _pool_status()
 
 
 @app.get("/test-worker")
 async def test_worker():
-    """Test if _ocr_worker function can be called (for debugging)."""
+    """Test if ocr_worker function can be called (for debugging)."""
     import base64
 
     # Create a small test image (1x1 white pixel JPEG)
@@ -729,10 +1583,10 @@ async def test_worker():
 
     try:
         image_data = base64.b64decode(test_image_base64)
-        logger.info(f"Test: Calling _ocr_worker with {len(image_data)} bytes image")
+        logger.info(f"Test: Calling ocr_worker with {len(image_data)} bytes image")
 
         # Call worker function directly (NOT through process pool)
-        result = _ocr_worker(
+        result = ocr_worker(
             image_data=image_data,
             api_key="test-key",
             task_type="v1.5",
@@ -750,57 +1604,76 @@ async def test_worker():
         }
 
 
+def _request_deadline(value: Optional[str]) -> Optional[float]:
+    """Parse the X-Request-Deadline header (400 on garbage)."""
+    try:
+        return parse_deadline(value)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {DEADLINE_HEADER}: {e}")
+
+
 @app.post("/ocr", response_model=OcrResponse)
-async def ocr_image(request: OcrRequest):
+async def ocr_image(request: OcrRequest, x_request_deadline: Optional[str] = Header(None)):
     """
     OCR a single image using Multi-OCR Ensemble.
 
     Accepts base64-encoded image and returns OCR text.
     API key is passed in the request body for flexibility with multiple keys.
+    X-Request-Deadline (seconds or Unix timestamp) lets optional stages be
+    skipped to answer in time; the response reports the tier that ran.
 
     Returns:
         - 200: Success with OCR text
-        - 400: Invalid image data
+        - 400: Invalid image data / deadline header
         - 500: Server error (OCR processing failed)
         - 504: Gateway timeout (OCR took too long)
     """
     logger.info("POST /ocr endpoint called")
+    deadline = _request_deadline(x_request_deadline)
     try:
-        # Decode base64 image
-        logger.info("Decoding base64 image...")
-        try:
-            image_data = base64.b64decode(request.image_base64)
-        except Exception as decode_error:
-            logger.error(f"Base64 decode failed: {decode_error}")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid base64 image data: {str(decode_error)}"
-            )
-
-        logger.info(f"Image decoded: {len(image_data)} bytes")
+        # Decode base64 image, or fetch the referenced object / file
+        logger.info("Loading image...")
+        image_data = await _load_image(request.model_dump())
+        logger.info(f"Image loaded: {len(image_data)} bytes")
 
         # Perform OCR
-        text, confidence = await perform_ocr(
+        result = await perform_ocr(
             image_data=image_data,
             api_key=request.api_key,
             task_type=request.task_type,
-            figure_language=request.figure_language
+            figure_language=request.figure_language,
+            dedup=request.dedup,
+            dedup_max_distance=request.dedup_max_distance,
+            priority=request.priority,
+            deadline=deadline
         )
 
-        logger.info(f"POST /ocr completed successfully: {len(text)} chars, confidence={confidence}")
+        logger.info(f"POST /ocr completed successfully: {len(result.text)} chars, confidence={result.confidence}")
         return OcrResponse(
-            text=text,
-            confidence=confidence,
-            success=True
+            text=result.text,
+            confidence=result.confidence,
+            success=True,
+            near_duplicate=result.near_duplicate is not None,
+            match_distance=result.near_duplicate.distance if result.near_duplicate else None,
+            tier=result.tier,
+            skipped_stages=result.skipped_stages,
+            cost=result.cost
         )
 
-    except InvalidImageError as e:
+    except (InvalidImageError, InvalidReferenceError) as e:
         logger.error(f"Invalid image: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
 
+    except FetchError as e:
+        logger.error(f"Image fetch failed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=str(e)
+        )
+
     except OcrTimeoutError as e:
         logger.error(f"OCR timeout: {str(e)}")
         raise HTTPException(
@@ -836,20 +1709,25 @@ async def ocr_upload(
     file: UploadFile = File(...),
     api_key: str = Form(...),
     task_type: str = Form("v1.5"),
-    figure_language: str = Form("Thai")
+    figure_language: str = Form("Thai"),
+    dedup: bool = Form(False),
+    dedup_max_distance: Optional[int] = Form(None),
+    priority: Priority = Form(DEFAULT_LANE),
+    x_request_deadline: Optional[str] = Header(None)
 ):
     """
     OCR an uploaded image file using Multi-OCR Ensemble.
 
-    Alternative endpoint for direct file upload.
+    Alternative endpoint for direct file upload (X-Request-Deadline as for /ocr).
 
     Returns:
         - 200: Success with OCR text
-        - 400: Invalid image file
+        - 400: Invalid image file / deadline header
         - 500: Server error (OCR processing failed)
         - 504: Gateway timeout (OCR took too long)
     """
     logger.info(f"POST /ocr/upload endpoint called: filename={file.filename}")
+    deadline = _request_deadline(x_request_deadline)
     try:
         # Read uploaded file
         try:
@@ -863,18 +1741,27 @@ async def ocr_upload(
             )
 
         # Perform OCR
-        text, confidence = await perform_ocr(
+        result = await perform_ocr(
             image_data=image_data,
             api_key=api_key,
             task_type=task_type,
-            figure_language=figure_language
+            figure_language=figure_language,
+            dedup=dedup,
+            dedup_max_distance=dedup_max_distance,
+            priority=priority,
+            deadline=deadline
         )
 
-        logger.info(f"POST /ocr/upload completed successfully: {len(text)} chars")
+        logger.info(f"POST /ocr/upload completed successfully: {len(result.text)} chars")
         return OcrResponse(
-            text=text,
-            confidence=confidence,
-            success=True
+            text=result.text,
+            confidence=result.confidence,
+            success=True,
+            near_duplicate=result.near_duplicate is not None,
+            match_distance=result.near_duplicate.distance if result.near_duplicate else None,
+            tier=result.tier,
+            skipped_stages=result.skipped_stages,
+            cost=result.cost
         )
 
     except InvalidImageError as e:
@@ -914,35 +1801,130 @@ async def ocr_upload(
         )
 
 
+def _sse(event: str, data: dict) -> str:
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/ocr/stream")
+async def ocr_stream(request: OcrRequest, x_request_deadline: Optional[str] = Header(None)):
+    """
+    OCR a single image in two phases, as Server-Sent Events.
+
+    Same request body (and X-Request-Deadline) as /ocr. The Full Image OCR
+    text is sent as soon as the worker has it; the multi-scale + LLM result
+    follows when the pipeline finishes:
+
+        event: provisional   data: {"text": "...", "provisional": true}
+        event: final         data: {OcrResponse fields..., "provisional": false}
+        event: error         data: {"error": "...", "error_type": "timeout"}
+
+    Near-duplicates are answered with a final event only.
+    """
+    logger.info("POST /ocr/stream endpoint called")
+    deadline = _request_deadline(x_request_deadline)
+    try:
+        image_data = await _load_image(request.model_dump())
+    except (InvalidImageError, InvalidReferenceError) as e:
+        logger.error(f"Invalid image: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except FetchError as e:
+        logger.error(f"Image fetch failed: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+
+    events: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+
+    def on_provisional(text: str) -> None:
+        logger.info(f"📨 POST /ocr/stream provisional: {len(text)} chars after {time.perf_counter() - started:.2f}s")
+        events.put_nowait(_sse("provisional", {"text": text, "provisional": True}))
+
+    async def run() -> None:
+        try:
+            result = await perform_ocr(
+                image_data=image_data,
+                api_key=request.api_key,
+                task_type=request.task_type,
+                figure_language=request.figure_language,
+                dedup=request.dedup,
+                dedup_max_distance=request.dedup_max_distance,
+                priority=request.priority,
+                deadline=deadline,
+                on_provisional=on_provisional
+            )
+            response = OcrResponse(
+                text=result.text,
+                confidence=result.confidence,
+                success=True,
+                near_duplicate=result.near_duplicate is not None,
+                match_distance=result.near_duplicate.distance if result.near_duplicate else None,
+                tier=result.tier,
+                skipped_stages=result.skipped_stages,
+                cost=result.cost
+            )
+            logger.info(f"POST /ocr/stream final: {len(result.text)} chars after {time.perf_counter() - started:.2f}s")
+            events.put_nowait(_sse("final", {**response.model_dump(), "provisional": False}))
+        except Exception as e:
+            logger.error(f"POST /ocr/stream failed: {str(e)}")
+            events.put_nowait(_sse("error", {"error": str(e), "error_type": _error_type(e)}))
+        events.put_nowait(None)
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while (message := await events.get()) is not None:
+                yield message
+        finally:
+            task.cancel()  # Client disconnected - stop waiting for the final result
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.post("/ocr/batch", response_model=BatchOcrResponse)
-async def ocr_batch(request: BatchOcrRequest):
+async def ocr_batch(request: BatchOcrRequest, x_request_deadline: Optional[str] = Header(None)):
     """
     OCR multiple images in parallel using Multi-OCR Ensemble.
 
     Useful for processing multiple pages concurrently.
     Each image should have an 'id' field for tracking.
+    X-Request-Deadline applies to the whole batch. With token_budget, pages
+    started after the batch has used up that many tokens run Full OCR only.
     """
     logger.info(f"POST /ocr/batch endpoint called: {len(request.images)} images")
+    deadline = _request_deadline(x_request_deadline)
+    token_budget = TokenBudget(request.token_budget) if request.token_budget else None
 
     async def process_single(item: dict) -> dict:
         item_id = item.get("id", "unknown")
         try:
             logger.info(f"  → Processing batch item: {item_id}")
-            image_data = base64.b64decode(item["image_base64"])
-            text, confidence = await perform_ocr(
+            # References are fetched concurrently (OCR_FETCH_CONCURRENCY) while earlier items run
+            image_data = await _load_image(item)
+            result = await perform_ocr(
                 image_data=image_data,
                 api_key=request.api_key,
                 task_type=request.task_type,
-                figure_language=request.figure_language
+                figure_language=request.figure_language,
+                dedup=request.dedup,
+                dedup_max_distance=request.dedup_max_distance,
+                priority=request.priority,
+                deadline=deadline,
+                token_budget=token_budget
             )
-            logger.info(f"  ✓ Batch item completed: {item_id} ({len(text)} chars)")
+            logger.info(f"  ✓ Batch item completed: {item_id} ({len(result.text)} chars)")
             return {
                 "id": item_id,
-                "text": text,
-                "confidence": confidence,
+                "text": result.text,
+                "confidence": result.confidence,
                 "success": True,
                 "error": None,
-                "error_type": None
+                "error_type": None,
+                "near_duplicate": result.near_duplicate is not None,
+                "match_distance": result.near_duplicate.distance if result.near_duplicate else None,
+                "tier": result.tier,
+                "skipped_stages": result.skipped_stages,
+                "cost": result.cost
             }
         except InvalidImageError as e:
             logger.error(f"  ✗ Batch item failed (invalid image): {item_id} - {str(e)}")
@@ -962,7 +1944,7 @@ async def ocr_batch(request: BatchOcrRequest):
                 "confidence": 0.0,
                 "success": False,
                 "error": str(e),
-                "error_type": "timeout"
+                "error_type": _error_type(e)
             }
         except OcrApiError as e:
             logger.error(f"  ✗ Batch item failed (API error): {item_id} - {str(e)}")
@@ -984,6 +1966,16 @@ async def ocr_batch(request: BatchOcrRequest):
                 "error": str(e),
                 "error_type": "process_crash"
             }
+        except FetchError as e:
+            logger.error(f"  ✗ Batch item failed (fetch): {item_id} - {str(e)}")
+            return {
+                "id": item_id,
+                "text": "",
+                "confidence": 0.0,
+                "success": False,
+                "error": str(e),
+                "error_type": _error_type(e)
+            }
         except Exception as e:
             logger.error(f"  ✗ Batch item failed (unknown): {item_id} - {str(e)}")
             logger.exception("Full exception traceback:")
@@ -1002,9 +1994,280 @@ async def ocr_batch(request: BatchOcrRequest):
     results = await asyncio.gather(*tasks)
 
     success_count = sum(1 for r in results if r.get("success"))
-    logger.info(f"POST /ocr/batch completed: {success_count}/{len(results)} successful")
+    total = sum_costs([r.get("cost") for r in results])
+    logger.info(f"POST /ocr/batch completed: {success_count}/{len(results)} successful, {total['tokens']} tokens")
+
+    return BatchOcrResponse(
+        results=list(results),
+        cost=total,
+        budget=token_budget.stats() if token_budget else None
+    )
+
+
+def _error_type(error: Exception) -> str:
+    """Map an OCR exception to the error_type string used in batch/PDF results."""
+    if isinstance(error, InvalidImageError):
+        return "invalid_image"
+    if isinstance(error, DeadlineExceededError):
+        return "deadline_exceeded"  # Not retryable: a later attempt is even later
+    if isinstance(error, OcrTimeoutError):
+        return "timeout"
+    if isinstance(error, OcrApiError):
+        return "api_error"
+    if isinstance(error, ProcessPoolCrashError):
+        return "process_crash"
+    if isinstance(error, PdfError):
+        return "pdf_error"
+    if isinstance(error, InvalidReferenceError):
+        return "invalid_reference"
+    if isinstance(error, FetchError):
+        return "fetch_error"
+    return "unknown"
+
+
+@app.post("/ocr/pdf")
+async def ocr_pdf(
+    file: UploadFile = File(...),
+    api_key: List[str] = Form(...),
+    dpi: int = Form(200),
+    max_concurrency: Optional[int] = Form(None),
+    task_type: str = Form("v1.5"),
+    figure_language: str = Form("Thai"),
+    dedup: bool = Form(False),
+    priority: Priority = Form(DEFAULT_LANE),
+    token_budget: Optional[int] = Form(None, gt=0),
+    x_request_deadline: Optional[str] = Header(None)
+):
+    """
+    OCR a multi-page PDF, streaming one result per page.
+
+    Pages are rasterized lazily with pdftoppm at the chosen DPI and fed into
+    the OCR pipeline as they are produced. At most max_concurrency pages are
+    in flight, so memory stays flat regardless of page count.
+
+    api_key may be repeated (4 keys for load balancing) like the JSON endpoints.
+    X-Request-Deadline and token_budget (see /ocr/batch) apply to the whole document.
+
+    Response: application/x-ndjson, one JSON object per line:
+        {"type": "document", "pages": N}
+        {"type": "page", "page": 3, "text": "...", "success": true, "cost": {...}, ...}  (completion order)
+        {"type": "summary", "pages": N, "success_count": M, "cost": {...}, "budget": {...}}
+    """
+    logger.info(f"POST /ocr/pdf endpoint called: filename={file.filename}, dpi={dpi}")
+    deadline = _request_deadline(x_request_deadline)
+
+    if not MIN_DPI <= dpi <= MAX_DPI:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"dpi must be between {MIN_DPI} and {MAX_DPI}"
+        )
+    concurrency = max(1, max_concurrency or PDF_MAX_CONCURRENCY)
+    keys: Union[str, List[str]] = api_key[0] if len(api_key) == 1 else api_key
+    budget = TokenBudget(token_budget) if token_budget else None
+
+    # Spool the upload to disk in chunks - the PDF is never held in memory
+    tmp = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    pdf_path = Path(tmp.name)
+    spooled = False
+    try:
+        with tmp:
+            while chunk := await file.read(1024 * 1024):
+                tmp.write(chunk)
+        page_count = await get_page_count(pdf_path)
+        spooled = True
+    except PdfError as e:
+        logger.error(f"Invalid PDF: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to read uploaded PDF: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Failed to read uploaded file: {str(e)}"
+        )
+    finally:
+        if not spooled:
+            # Invalid upload, or the request was cancelled while spooling / reading the page count
+            pdf_path.unlink(missing_ok=True)
+
+    logger.info(f"PDF spooled: {page_count} pages, concurrency={concurrency}")
 
-    return BatchOcrResponse(results=list(results))
+    async def process_page(page: int, slots: asyncio.Semaphore, events: asyncio.Queue) -> None:
+        """Rasterize one page, OCR it and publish the result. Holds one slot throughout."""
+        try:
+            image_data = await rasterize_page(pdf_path, page, dpi)
+            result = await perform_ocr(
+                image_data=image_data,
+                api_key=keys,
+                task_type=task_type,
+                figure_language=figure_language,
+                dedup=dedup,
+                priority=priority,
+                deadline=deadline,
+                token_budget=budget
+            )
+            del image_data
+            logger.info(f"  ✓ PDF page completed: {page}/{page_count} ({len(result.text)} chars)")
+            event = {
+                "type": "page",
+                "page": page,
+                "text": result.text,
+                "confidence": result.confidence,
+                "success": True,
+                "error": None,
+                "error_type": None,
+                "near_duplicate": result.near_duplicate is not None,
+                "match_distance": result.near_duplicate.distance if result.near_duplicate else None,
+                "tier": result.tier,
+                "skipped_stages": result.skipped_stages,
+                "cost": result.cost
+            }
+        except Exception as e:
+            logger.error(f"  ✗ PDF page failed: {page}/{page_count} - {str(e)}")
+            event = {
+                "type": "page",
+                "page": page,
+                "text": "",
+                "confidence": 0.0,
+                "success": False,
+                "error": str(e),
+                "error_type": _error_type(e)
+            }
+        finally:
+            slots.release()
+        await events.put(event)
+
+    async def stream():
+        slots = asyncio.Semaphore(concurrency)
+        events: asyncio.Queue = asyncio.Queue()
+        tasks: list[asyncio.Task] = []
+
+        async def produce():
+            # Only start rasterizing page N+1 once a slot frees up
+            for page in range(1, page_count + 1):
+                await slots.acquire()
+                tasks.append(asyncio.create_task(process_page(page, slots, events)))
+
+        producer = asyncio.create_task(produce())
+        success_count = 0
+        costs: list[Optional[dict]] = []
+        try:
+            yield json.dumps({"type": "document", "pages": page_count}, ensure_ascii=False) + "\n"
+            for _ in range(page_count):
+                event = await events.get()
+                success_count += 1 if event["success"] else 0
+                costs.append(event.get("cost"))
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            yield json.dumps(
+                {"type": "summary", "pages": page_count, "success_count": success_count,
+                 "cost": sum_costs(costs), "budget": budget.stats() if budget else None},
+                ensure_ascii=False
+            ) + "\n"
+            logger.info(f"POST /ocr/pdf completed: {success_count}/{page_count} pages successful")
+        finally:
+            # Client disconnected or finished - stop feeding pages (cancelling a page kills its
+            # pdftoppm) and drop the spooled PDF
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+            pdf_path.unlink(missing_ok=True)
+
+    # Also after the response: the generator's finally never runs if streaming never started
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(pdf_path.unlink, missing_ok=True)
+    )
+
+
+def _require_job_queue() -> JobQueue:
+    if job_queue is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Job queue is not configured (set OCR_QUEUE_DSN)"
+        )
+    return job_queue
+
+
+async def _callback_url(url: str) -> str:
+    """Validate a job callback URL (400 if unusable or not allowed, 503 if callbacks are unavailable)."""
+    if webhooks is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Webhook callbacks are not available on this instance"
+        )
+    try:
+        return await resolve_callback_url(url)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except OSError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"callback_url host does not resolve: {e}")
+
+
+@app.post("/jobs", response_model=JobSubmitResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_jobs(request: JobRequest):
+    """
+    Enqueue one page job per image on the shared Postgres queue.
+
+    Any instance running in worker mode may execute the jobs.
+    Poll GET /jobs/{job_id} or GET /jobs/batch/{batch_id} for results
+    (two_phase jobs show a provisional result while still running), or set
+    callback_url to get signed job.succeeded / job.failed webhooks instead.
+    """
+    queue = _require_job_queue()
+    logger.info(f"POST /jobs endpoint called: {len(request.images)} images")
+
+    items: list[tuple[str, bytes]] = []
+    item_params: dict[str, dict] = {}
+    for index, item in enumerate(request.images):
+        item_id = str(item.get("id", index))
+        try:
+            items.append((item_id, base64.b64decode(item["image_base64"])))
+        except Exception as decode_error:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid base64 image data for item {item_id}: {str(decode_error)}"
+            )
+        if item.get("callback_url"):
+            item_params[item_id] = {"callback_url": await _callback_url(item["callback_url"])}
+
+    params = {
+        "api_key": request.api_key,
+        "task_type": request.task_type,
+        "figure_language": request.figure_language,
+        "dedup": request.dedup,
+        "priority": request.priority,
+        "two_phase": request.two_phase
+    }
+    if request.callback_url:
+        params["callback_url"] = await _callback_url(request.callback_url)
+    if request.deadline_seconds is not None:
+        if request.deadline_seconds <= 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="deadline_seconds must be positive")
+        params["deadline_at"] = time.time() + request.deadline_seconds
+    batch_id, jobs = await queue.enqueue(items, params, batch_id=request.batch_id, item_params=item_params)
+    logger.info(f"POST /jobs queued {len(jobs)} job(s) in batch {batch_id}")
+    return JobSubmitResponse(
+        batch_id=batch_id,
+        jobs=[{"id": item_id, "job_id": job_id} for item_id, job_id in jobs]
+    )
+
+
+@app.get("/jobs/batch/{batch_id}", response_model=list[JobStatusResponse])
+async def get_job_batch(batch_id: str):
+    """Status of every job in a batch."""
+    rows = await _require_job_queue().list_batch(batch_id)
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Batch {batch_id} not found")
+    return [_job_status(row) for row in rows]
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Status (and result, once finished) of one page job."""
+    row = await _require_job_queue().get(job_id)
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} not found")
+    return _job_status(row)
 
 
 @app.post("/organizations/sync", response_model=SyncOrganizationsResponse)
@@ -1016,13 +2279,10 @@ async def sync_organizations(request: SyncOrganizationsRequest):
     used for OCR correction.
     """
     try:
-        import json
-
         org_json_path = Path(__file__).parent / "organizations.json"
 
-        # Write to organizations.json
-        with open(org_json_path, "w", encoding="utf-8") as f:
-            json.dump(request.organizations, f, ensure_ascii=False, indent=4)
+        # Atomic replace: workers of every uvicorn process read it while it is written
+        await asyncio.to_thread(write_shared_json, org_json_path, request.organizations)
 
         return SyncOrganizationsResponse(
             success=True,
@@ -1065,10 +2325,11 @@ async def get_organizations():
 # =============================================================================
 
 if __name__ == "__main__":
+    # WEB_CONCURRENCY > 1: one app per core, sharing host limits (see coordination.py); reload needs 1 worker
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
-        workers=1  # Use 1 worker, async handles concurrency
+        reload=WEB_CONCURRENCY == 1,
+        workers=WEB_CONCURRENCY
     )
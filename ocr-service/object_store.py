@@ -0,0 +1,217 @@
+"""
+Reference-based image inputs: MinIO objects and shared-volume paths.
+
+The backend used to download every page from MinIO, base64-encode it and
+POST it here, so each image crossed the network twice and grew by a third
+on the way. /ocr, /ocr/stream and /ocr/batch now also accept a reference
+instead of image_base64 and the service fetches the bytes itself:
+
+    {"bucket": "documents", "key": "scans/42/page-001.jpg"}   MinIO / S3 object
+    {"path": "/data/shared/scans/42/page-001.jpg"}            file on a shared volume
+
+    - MinIO: one client with a pooled urllib3 connection manager (keep-alive,
+      OCR_FETCH_CONCURRENCY connections) - enabled by OCR_MINIO_ENDPOINT;
+      OCR_MINIO_BUCKETS limits the buckets a request may name
+    - Paths: only below OCR_SHARED_VOLUME_ROOTS (resolved, so ../ and
+      symlinks cannot leave the roots)
+    - At most OCR_FETCH_CONCURRENCY fetches run at once; batch items start
+      fetching together as soon as the request arrives, so the images are
+      ready by the time their pool slots free up
+    - Objects above OCR_FETCH_MAX_MB are refused before they are read
+
+Requires the minio client for bucket references; imported lazily so the
+service runs without it when OCR_MINIO_ENDPOINT is not set.
+"""
+
+from __future__ import annotations
+import os
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+MINIO_ENDPOINT = os.environ.get('OCR_MINIO_ENDPOINT', '')  # host:port, '' = bucket references disabled
+MINIO_ACCESS_KEY = os.environ.get('OCR_MINIO_ACCESS_KEY', '')
+MINIO_SECRET_KEY = os.environ.get('OCR_MINIO_SECRET_KEY', '')
+MINIO_SECURE = os.environ.get('OCR_MINIO_SECURE', 'false').lower() in ('1', 'true', 'yes')
+MINIO_REGION = os.environ.get('OCR_MINIO_REGION', '') or None
+# Buckets a request may read from ('' = any bucket the credentials can read)
+MINIO_BUCKETS = [b.strip() for b in os.environ.get('OCR_MINIO_BUCKETS', '').split(',') if b.strip()]
+# Directories path references may point into ('' = path references disabled)
+SHARED_VOLUME_ROOTS = [Path(p.strip()) for p in os.environ.get('OCR_SHARED_VOLUME_ROOTS', '').split(',') if p.strip()]
+FETCH_CONCURRENCY = int(os.environ.get('OCR_FETCH_CONCURRENCY', '8'))
+FETCH_MAX_BYTES = int(float(os.environ.get('OCR_FETCH_MAX_MB', '50')) * 1024 * 1024)
+FETCH_TIMEOUT_SECONDS = float(os.environ.get('OCR_FETCH_TIMEOUT_SECONDS', '30'))
+
+
+class FetchError(Exception):
+    """The object store or shared volume could not be read (worth retrying)."""
+    pass
+
+
+class InvalidReferenceError(FetchError):
+    """The reference is malformed, not allowed, missing or too large (retrying won't help)."""
+    pass
+
+
+def reference_of(item: dict) -> Optional[dict]:
+    """
+    The image reference in a request body or batch item, None if it carries image_base64.
+
+    Raises:
+        InvalidReferenceError: Not exactly one of image_base64, bucket + key, path
+    """
+    has_ref = {"object": bool(item.get("bucket") or item.get("key")), "path": bool(item.get("path"))}
+    sources = sum(has_ref.values()) + (1 if item.get("image_base64") else 0)
+    if sources != 1:
+        raise InvalidReferenceError("Provide exactly one of image_base64, bucket + key, or path")
+    if has_ref["object"]:
+        if not item.get("bucket") or not item.get("key"):
+            raise InvalidReferenceError("Object references need both bucket and key")
+        return {"bucket": item["bucket"], "key": item["key"]}
+    if has_ref["path"]:
+        return {"path": item["path"]}
+    return None
+
+
+class ObjectFetcher:
+    """Fetches referenced images through one pooled MinIO client and the shared volume (main process)."""
+
+    def __init__(
+        self,
+        endpoint: str = MINIO_ENDPOINT,
+        volume_roots: Optional[list[Path]] = None,
+        concurrency: int = FETCH_CONCURRENCY,
+        max_bytes: int = FETCH_MAX_BYTES
+    ):
+        self.endpoint = endpoint
+        self.volume_roots = [root.resolve() for root in (SHARED_VOLUME_ROOTS if volume_roots is None else volume_roots)]
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self._slots = asyncio.Semaphore(concurrency)
+        self._client = None
+        self._http = None
+        self.in_flight = 0
+        self.fetched = {"object": 0, "path": 0}
+        self.failed = 0
+        self.bytes = 0
+        self._seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.endpoint or self.volume_roots)
+
+    def _minio(self):
+        if self._client is None:
+            if not self.endpoint:
+                raise InvalidReferenceError("Bucket references are not enabled (OCR_MINIO_ENDPOINT is not set)")
+            try:
+                import urllib3
+                from minio import Minio
+            except ImportError as e:
+                raise FetchError("Bucket references need the 'minio' package (pip install minio)") from e
+            self._http = urllib3.PoolManager(
+                maxsize=self.concurrency,
+                timeout=urllib3.Timeout(connect=5.0, read=FETCH_TIMEOUT_SECONDS),
+                retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+            )
+            self._client = Minio(
+                self.endpoint,
+                access_key=MINIO_ACCESS_KEY or None,
+                secret_key=MINIO_SECRET_KEY or None,
+                secure=MINIO_SECURE,
+                region=MINIO_REGION,
+                http_client=self._http
+            )
+        return self._client
+
+    def _get_object(self, bucket: str, key: str) -> bytes:
+        if MINIO_BUCKETS and bucket not in MINIO_BUCKETS:
+            raise InvalidReferenceError(f"Bucket '{bucket}' is not allowed (OCR_MINIO_BUCKETS)")
+        client = self._minio()
+        from minio.error import S3Error
+        try:
+            size = client.stat_object(bucket, key).size
+            if size > self.max_bytes:
+                raise InvalidReferenceError(f"Object {bucket}/{key} is {size / 1024 / 1024:.1f} MB "
+                                            f"(limit {self.max_bytes / 1024 / 1024:.0f} MB)")
+            response = client.get_object(bucket, key)
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchBucket", "AccessDenied", "InvalidObjectName", "InvalidBucketName"):
+                raise InvalidReferenceError(f"Object {bucket}/{key}: {e.code}") from e
+            raise FetchError(f"Object {bucket}/{key}: {e.code} {e.message}") from e
+        except InvalidReferenceError:
+            raise
+        except Exception as e:
+            raise FetchError(f"Object store unavailable ({self.endpoint}): {str(e)}") from e
+
+    def _read_file(self, path: str) -> bytes:
+        if not self.volume_roots:
+            raise InvalidReferenceError("Path references are not enabled (OCR_SHARED_VOLUME_ROOTS is not set)")
+        resolved = Path(path).resolve()
+        if not any(resolved.is_relative_to(root) for root in self.volume_roots):
+            raise InvalidReferenceError(f"Path {path} is outside OCR_SHARED_VOLUME_ROOTS")
+        try:
+            size = resolved.stat().st_size
+            if size > self.max_bytes:
+                raise InvalidReferenceError(f"File {path} is {size / 1024 / 1024:.1f} MB "
+                                            f"(limit {self.max_bytes / 1024 / 1024:.0f} MB)")
+            return resolved.read_bytes()
+        except (FileNotFoundError, IsADirectoryError, PermissionError) as e:
+            raise InvalidReferenceError(f"File {path}: {e.strerror}") from e
+        except OSError as e:
+            raise FetchError(f"Shared volume unavailable: {str(e)}") from e
+
+    async def fetch(self, ref: dict) -> bytes:
+        """
+        Image bytes of a reference ({"bucket", "key"} or {"path"}, see reference_of).
+
+        Raises:
+            InvalidReferenceError: Not allowed / not found / too large
+            FetchError: Store or volume unavailable
+        """
+        source = "object" if "bucket" in ref else "path"
+        async with self._slots:
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                if source == "object":
+                    data = await asyncio.to_thread(self._get_object, ref["bucket"], ref["key"])
+                else:
+                    data = await asyncio.to_thread(self._read_file, ref["path"])
+            except FetchError:
+                self.failed += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                self._seconds += time.perf_counter() - started
+        self.fetched[source] += 1
+        self.bytes += len(data)
+        return data
+
+    def close(self) -> None:
+        if self._http is not None:
+            self._http.clear()
+
+    def stats(self) -> dict:
+        done = sum(self.fetched.values()) + self.failed
+        return {
+            "enabled": self.enabled,
+            "minio": self.endpoint or None,
+            "volume_roots": [str(root) for root in self.volume_roots],
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "fetched": self.fetched,
+            "failed": self.failed,
+            "mb": round(self.bytes / 1024 / 1024, 1),
+            "mean_seconds": round(self._seconds / done, 3) if done else None
+        }
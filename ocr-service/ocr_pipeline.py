@@ -0,0 +1,952 @@
+"""
+OCR pipeline executed inside pool worker processes.
+
+Kept deliberately lean: it imports only what the pipeline needs (PIL,
+typhoon_ocr prompts, openai) and never FastAPI/pydantic/uvicorn. The pool uses the
+'spawn' start method, so every worker imports this module from scratch -
+importing main.py there used to drag the whole web stack into each worker.
+
+Workers are pre-spawned and warmed at startup (see init_worker and
+worker_status), so the first request after a deploy does not pay for
+process creation and library imports. Warming also opens keep-alive
+connections to the Typhoon API (see http_clients.py).
+
+Two-phase requests (see provisional.py) get the Full Image OCR text over a
+queue shared at pool start, before the crops and LLM merge finish.
+
+The pipeline is two stages: ocr_stage (decode, crop, region OCR - needs the
+decoded page, runs in a pool worker) and merge_stage (LLM merge + checks -
+network-bound, runs in its own executor; see stages.py). ocr_worker runs
+both back to back in one worker.
+"""
+
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import re
+import random
+import logging
+import traceback
+import threading
+import concurrent.futures
+from pathlib import Path
+from typing import Union, List, Optional, Callable
+
+import circuit_breaker
+import coordination
+import cost
+from deadline import Budget
+
+try:
+    import psutil
+except ImportError:  # Memory logging is optional
+    psutil = None
+
+
+# Typhoon API base URL (OCR + chat). Point at tools/mock_typhoon.py for offline load tests.
+TYPHOON_BASE_URL = os.environ.get('TYPHOON_BASE_URL', 'https://api.opentyphoon.ai/v1')
+
+worker_logger = logging.getLogger(f"{__name__}.worker")
+
+MIN_LLM_RATIO = 0.5  # LLM output ต้องมีความยาวอย่างน้อย 50% ของ Full Image OCR
+# Multi-page merge: each page's answer starts with this line (see merge_batch)
+BATCH_PAGE_MARKER = "<<<PAGE {number}>>>"
+_BATCH_PAGE_RE = re.compile(r"^<<<PAGE (\d+)>>>[ \t]*$", re.MULTILINE)
+
+# Set by init_worker(): seconds spent importing the heavy libraries
+_import_seconds: float = 0.0
+_prewarmed_connections: int = 0
+# Set by init_worker(): queue for provisional (Full Image) results, see provisional.py
+_provisional_queue = None
+
+# Heavy libraries, bound by init_worker()
+Image = None
+typhoon_client = None
+http_clients = None
+image_decode = None
+llm_stream = None
+crop_layout = None
+
+
+class PipelineError(RuntimeError):
+    """Worker failure carrying the page's API call outcomes (fed to the main-process circuit breakers)."""
+
+    def __init__(self, message: str, calls: Optional[list[dict]] = None):
+        # Both in args so the exception pickles back to the main process intact
+        super().__init__(message, calls or [])
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+    @property
+    def calls(self) -> list[dict]:
+        return self.args[1]
+
+
+def _configure_worker_logging() -> None:
+    """Configure logging for the child process (idempotent)."""
+    if not worker_logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s | %(levelname)-8s | PID:%(process)d | %(name)s | %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+        worker_logger.addHandler(handler)
+        worker_logger.setLevel(logging.INFO)
+        worker_logger.propagate = False
+
+
+# =============================================================================
+# WORKER LIFECYCLE
+# =============================================================================
+
+def init_worker(provisional_queue=None) -> None:
+    """
+    ProcessPoolExecutor initializer: import the heavy libraries once per worker.
+
+    Runs before the worker accepts its first task, so a warmed pool never
+    pays import cost on the request path.
+
+    Args:
+        provisional_queue: multiprocessing queue for two-phase results (None = disabled)
+    """
+    global _import_seconds, _prewarmed_connections, _provisional_queue
+    global Image, typhoon_client, http_clients, image_decode, llm_stream, crop_layout
+    _configure_worker_logging()
+    _provisional_queue = provisional_queue
+
+    started = time.perf_counter()
+    from PIL import Image
+    import typhoon_client
+    import http_clients
+    import image_decode
+    import llm_stream
+    import crop_layout
+    _import_seconds = time.perf_counter() - started
+
+    pool = http_clients.get_pool()
+    _prewarmed_connections = pool.prewarm(TYPHOON_BASE_URL)
+    worker_logger.info(f"Worker initialized: libraries imported in {_import_seconds:.2f}s, "
+                       f"{_prewarmed_connections} connection(s) pre-warmed to {TYPHOON_BASE_URL}")
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this worker process so far (MB)."""
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def worker_status() -> dict:
+    """Report readiness of the worker that runs this task (used for warm-up)."""
+    rss_mb = None
+    if psutil is not None:
+        rss_mb = round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+    return {
+        "pid": os.getpid(),
+        "import_seconds": round(_import_seconds, 3),
+        "rss_mb": rss_mb,
+        "web_stack_loaded": "fastapi" in sys.modules,
+        "prewarmed_connections": _prewarmed_connections,
+        "http_config": http_clients.get_pool().config() if http_clients else None
+    }
+
+
+# =============================================================================
+# KEY ROUTING (circuit breakers)
+# =============================================================================
+
+def _slot_key(preferred: str, allowed: list[str], slot: int) -> str:
+    """Key for a call slot: its own key unless that key's breaker is open, else a healthy one."""
+    return preferred if preferred in allowed else allowed[slot % len(allowed)]
+
+
+def _call_with_failover(
+    endpoint: str,
+    key: str,
+    candidates: list[str],
+    call: Callable[[str], object],
+    calls: list[dict],
+    name: str,
+    usage: Optional[dict] = None
+):
+    """
+    Run call(key), recording the outcome in `calls`.
+
+    An auth / quota error is specific to the key, so the call is retried
+    once per remaining candidate key; other errors are raised as before.
+    `usage` holds extra fields for the call records (bytes sent); the call
+    fills in the token usage of its response (see cost.py). Each attempt
+    waits for the key's host-wide call slot first (OCR_HOST_KEY_CONCURRENCY,
+    see coordination.py); the wait is not part of the recorded seconds.
+    """
+    tried = []
+    usage = usage if usage is not None else {}
+    while True:
+        started = time.perf_counter()
+        try:
+            with coordination.key_slot(key):
+                started = time.perf_counter()
+                result = call(key)
+        except coordination.HostSlotTimeout:
+            raise  # The host was busy, not the key: nothing to record
+        except Exception as e:
+            kind = circuit_breaker.classify_error(e)
+            calls.append({"key": circuit_breaker.key_id(key), "endpoint": endpoint, "error": kind,
+                          "seconds": round(time.perf_counter() - started, 3),
+                          "bytes": usage.get("bytes")})
+            tried.append(key)
+            spare = [k for k in candidates if k not in tried]
+            if kind in circuit_breaker.KEY_ERRORS and spare:
+                worker_logger.warning(f"  ↻ {name}: key {circuit_breaker.key_id(key)} failed ({kind}), "
+                                      f"retrying with {circuit_breaker.key_id(spare[0])}")
+                key = spare[0]
+                continue
+            raise
+        calls.append({"key": circuit_breaker.key_id(key), "endpoint": endpoint, "error": None,
+                      "seconds": round(time.perf_counter() - started, 3), **usage})
+        return result
+
+
+def _llm_usage(result: tuple, usage: dict) -> tuple:
+    """Copy the token usage of a guarded_completion result into the call record fields."""
+    usage.update(result[1].usage())
+    return result
+
+
+# =============================================================================
+# OCR FUNCTIONS (Multi-Scale Typhoon OCR + LLM Ensemble)
+# =============================================================================
+
+def ocr_worker(
+    image_data: bytes,
+    api_key: Union[str, List[str]],
+    task_type: str,
+    figure_language: str,
+    key_plan: Optional[dict[str, list[str]]] = None,
+    budget: Optional[Budget] = None,
+    provisional_token: Optional[str] = None
+) -> tuple[str, float, dict]:
+    """
+    Whole pipeline in one worker process: ocr_stage then merge_stage.
+
+    Used when the stages are not split (OCR_STAGE_SPLIT=false, see stages.py).
+    Arguments and return value as ocr_stage / merge_stage.
+
+    Raises:
+        PipelineError: Any failure; carries the API call outcomes so far
+    """
+    ocr = ocr_stage(image_data, api_key, task_type, figure_language, key_plan, budget, provisional_token)
+    try:
+        text, confidence, meta = merge_stage(ocr, budget=budget)
+    except PipelineError as e:
+        raise PipelineError(str(e), ocr["calls"] + e.calls) from e
+    meta["calls"] = ocr["calls"] + meta["calls"]
+    return text, confidence, meta
+
+
+def ocr_stage(
+    image_data: bytes,
+    api_key: Union[str, List[str]],
+    task_type: str,
+    figure_language: str,
+    key_plan: Optional[dict[str, list[str]]] = None,
+    budget: Optional[Budget] = None,
+    provisional_token: Optional[str] = None
+) -> dict:
+    """
+    Prepare + region OCR stage, runs in a pool worker process.
+    Uses Solution 5: Multi-Scale Typhoon (Full + section crops); the LLM
+    Ensemble runs afterwards in merge_stage.
+    Section crops are cut in whitespace between text lines (see crop_layout.py).
+
+    Uses multithreading (Full + one thread per section) inside this process for parallel OCR.
+
+    Args:
+        api_key: Single key or list of 4 keys [key_full, key_top, key_mid, key_bot]
+                 If list: OCR uses different keys, LLM uses random 2 keys
+        key_plan: Keys with a closed breaker per endpoint ({"ocr": [...], "chat": [...]},
+                  see circuit_breaker.BreakerBoard.plan). None = all keys.
+        budget: Request deadline + stage p95s (see deadline.py). Section crops and
+                the LLM merge are skipped when the remaining time can't cover them.
+        provisional_token: Two-phase request token; the Full Image text is sent
+                           to the main process under it as soon as it exists.
+
+    Returns:
+        Input of merge_stage: Full Image / section texts, chat keys, tier so far,
+        and the OCR side of the meta (http, memory, crops, calls, skipped, stages).
+        Small and picklable - the decoded page is released before returning.
+
+    Raises:
+        PipelineError: Any failure; carries the API call outcomes so far
+    """
+    if Image is None:
+        init_worker()
+    http_before = http_clients.get_pool().stats()
+
+    # Log memory usage
+    worker_logger.info("=" * 80)
+    worker_logger.info("OCR Worker started")
+    worker_logger.info(f"Image size: {len(image_data)} bytes, task_type: {task_type}, language: {figure_language}")
+    if psutil is not None:
+        mem_info = psutil.Process().memory_info()
+        worker_logger.info(f"Memory usage: RSS={mem_info.rss / 1024 / 1024:.2f} MB, VMS={mem_info.vms / 1024 / 1024:.2f} MB")
+    else:
+        worker_logger.info("psutil not available, memory logging disabled")
+
+    # Normalize api_key to list of 4 keys
+    if isinstance(api_key, str):
+        # Single key → use for all
+        keys = [api_key, api_key, api_key, api_key]
+        worker_logger.info("Using single API key for all OCR calls")
+    else:
+        # List of keys
+        if len(api_key) < 4:
+            # Pad with first key if not enough
+            keys = api_key + [api_key[0]] * (4 - len(api_key))
+            worker_logger.info(f"API keys padded from {len(api_key)} to 4 keys")
+        else:
+            keys = api_key[:4]
+            worker_logger.info("Using 4 different API keys for load balancing")
+
+    unique_keys = list(dict.fromkeys(keys))
+    ocr_keys = (key_plan or {}).get("ocr") or unique_keys
+    chat_keys = (key_plan or {}).get("chat") or unique_keys
+    if len(ocr_keys) < len(unique_keys) or len(chat_keys) < len(unique_keys):
+        worker_logger.warning(f"Circuit breakers open: routing OCR to {len(ocr_keys)}/{len(unique_keys)} "
+                              f"and LLM to {len(chat_keys)}/{len(unique_keys)} key(s)")
+    calls: list[dict] = []
+    budget = budget or Budget()
+    skipped: dict[str, str] = {}
+    stages: dict[str, Optional[float]] = {"full_ocr": None, "crop_ocr": None, "llm": None}
+
+    try:
+        # [1/5] Decode the page (in memory - no temp files); crops are planned while Full Image OCR runs
+        worker_logger.info("[Step 1/5] Loading image...")
+        # Decode at the smallest resolution that still feeds every region at full OCR size
+        # (JPEG draft mode; alpha flattened on white after the reduction)
+        img, decode_stats = image_decode.decode_for_ocr(image_data, sections=3)
+        worker_logger.info(f"Image loaded: mode={img.mode}, source={decode_stats['source_size']}, "
+                           f"decoded={decode_stats['decoded_size']} (1/{decode_stats['reduction']}, "
+                           f"{decode_stats['decoded_mb']} MB)")
+
+        width, height = img.size
+        overlap = max(5, 20 // decode_stats["reduction"])  # 20 px at source resolution
+        worker_logger.info(f"Image dimensions: {width}x{height}, overlap: {overlap}")
+
+        # Deadline: skip the crops up front if Full/crops + LLM won't fit in the remaining time
+        tier = budget.plan_tier()
+        if budget.deadline is not None:
+            worker_logger.info(f"⏱️  Deadline in {budget.remaining():.1f}s (p95 {budget.p95}) → tier {tier}")
+
+        # [2/5] Run OCR tasks in parallel using ThreadPoolExecutor
+        worker_logger.info("[Step 2/5] Running parallel Typhoon OCR tasks...")
+
+        # Crops dropped at the deadline: calls not started yet are skipped; a call already
+        # in flight can't be stopped, it is recorded as abandoned (its late outcome is not)
+        abandoned = threading.Event()
+        calls_lock = threading.Lock()
+        in_flight: dict[str, dict] = {}
+
+        # Resize + encode once per region in its own thread (PIL releases the GIL while
+        # resizing / encoding), then call Typhoon OCR on the pooled client right away
+        def run_typhoon(box, key, name):
+            worker_logger.info(f"  → Starting OCR task: {name} (box={box})")
+            try:
+                encoded = typhoon_client.prepare_image(img, task_type, box=box)
+                usage = {"bytes": len(encoded.base64)}  # As uploaded (base64)
+                with calls_lock:
+                    if abandoned.is_set():
+                        worker_logger.info(f"  ⏭️  OCR task skipped: {name} (abandoned at the deadline)")
+                        return None
+                    in_flight[name] = {"key": key, "bytes": usage["bytes"], "started": time.perf_counter()}
+                task_calls: list[dict] = []
+                try:
+                    result = _call_with_failover(
+                        "ocr", key, ocr_keys,
+                        lambda k: typhoon_client.ocr_encoded(
+                            http_clients.get_pool().openai(k, TYPHOON_BASE_URL),  # ✅ แยก key ตาม index
+                            encoded,
+                            task_type=task_type,
+                            figure_language=figure_language,
+                            usage=usage
+                        ),
+                        task_calls, name, usage
+                    )
+                finally:
+                    with calls_lock:
+                        if in_flight.pop(name, None) is not None:
+                            calls.extend(task_calls)
+                worker_logger.info(f"  ✓ OCR task completed: {name} ({len(result or '')} chars)")
+                return result
+            except Exception as e:
+                worker_logger.error(f"  ✗ OCR task failed: {name} - {str(e)}")
+                raise
+
+        # Not a with-block: crops abandoned at the deadline must not be waited for.
+        # Sized for the most sections a plan can have; threads are only started as tasks arrive.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1 + max(3, crop_layout.MAX_CROPS))
+        ocr_started = time.perf_counter()
+        plan = None
+        sections = []
+        try:
+            # Full Image on keys[0] starts before the crops are planned - it needs no boxes
+            future_full = executor.submit(run_typhoon, None, _slot_key(keys[0], ocr_keys, 0), "Full Image")
+
+            if tier == "multi_scale":
+                # Crop boxes only - each region is resized straight from the decoded page in its OCR thread
+                plan = crop_layout.plan_crops(img, overlap)
+                sections = plan.sections
+                if plan.adaptive:
+                    worker_logger.info(f"Adaptive crops: {len(sections)} sections from {plan.lines} text lines, "
+                                       f"{plan.whitespace_cuts} whitespace cut(s), {plan.pixel_ratio:.0%} of page pixels "
+                                       f"(planned in {time.perf_counter() - ocr_started:.2f}s)")
+                else:
+                    worker_logger.info(f"Fixed thirds (fallback: {plan.fallback_reason or 'disabled'})")
+                worker_logger.info("Crop boxes: " + ", ".join(f"{section.name}={section.box}" for section in sections))
+            else:
+                skipped["crop_ocr"] = budget.skip_reason("crop_ocr")
+                worker_logger.warning(f"⏱️  Skipping section crops ({skipped['crop_ocr']}): {budget.remaining():.1f}s left")
+
+            # Sections round-robin over keys[1:4]; each OCR call starts as soon as its own crop is encoded
+            section_futures = [
+                executor.submit(run_typhoon, section.box, _slot_key(keys[1 + i % 3], ocr_keys, 1 + i), section.name)
+                for i, section in enumerate(sections)
+            ]
+            worker_logger.info(f"Submitted {1 + len(sections)} OCR tasks (Full Image first)")
+
+            # Wait for all results
+            worker_logger.info("Waiting for all OCR tasks to complete...")
+            try:
+                full_result = future_full.result()
+                stages["full_ocr"] = round(time.perf_counter() - ocr_started, 3)
+                if provisional_token and _provisional_queue is not None and isinstance(full_result, str):
+                    # Two-phase: the caller can start from Full Image OCR while crops + LLM continue
+                    _provisional_queue.put((provisional_token, full_result))
+                    worker_logger.info(f"📨 Provisional result sent: {len(full_result)} chars "
+                                       f"after {stages['full_ocr']:.2f}s")
+                if section_futures and budget.deadline is not None:
+                    # Crops only help if the LLM can still run after them
+                    _, pending = concurrent.futures.wait(
+                        section_futures, timeout=max(0.0, budget.remaining() - budget.p95["llm"])
+                    )
+                    if pending:
+                        with calls_lock:
+                            abandoned.set()
+                            now = time.perf_counter()
+                            for call in in_flight.values():
+                                calls.append({"key": circuit_breaker.key_id(call["key"]), "endpoint": "ocr",
+                                              "error": cost.ABANDONED, "seconds": round(now - call["started"], 3),
+                                              "bytes": call["bytes"]})
+                            running = len(in_flight)
+                            in_flight.clear()
+                        worker_logger.warning(f"⏱️  {len(pending)} section crop(s) not done in time, "
+                                              f"continuing with Full Image only ({running} call(s) abandoned "
+                                              f"in flight, the rest skipped)")
+                        skipped["crop_ocr"] = "deadline"
+                        tier = "full_llm"
+                        sections, section_futures = [], []
+                section_results = [future.result() for future in section_futures]
+                if section_futures:
+                    stages["crop_ocr"] = round(time.perf_counter() - ocr_started, 3)
+            except Exception as ocr_error:
+                worker_logger.error("=" * 80)
+                worker_logger.error("❌ One or more OCR tasks failed!")
+                worker_logger.error(f"Error: {str(ocr_error)}")
+                worker_logger.error("=" * 80)
+                raise RuntimeError(f"OCR task failed: {str(ocr_error)}") from ocr_error
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        worker_logger.info(f"OCR tasks completed successfully: Full Image + {len(section_results)} section(s)")
+
+        # [VALIDATION] Check if OCR results are valid (basic checks only - length check moved to final result)
+        worker_logger.info("Validating OCR results (basic checks)...")
+
+        ocr_results = [("Full Image", full_result)] + [
+            (section.name, result) for section, result in zip(sections, section_results)
+        ]
+
+        validation_errors = []
+
+        for name, result in ocr_results:
+            if result is None:
+                validation_errors.append(f"{name}: Result is None")
+            elif not isinstance(result, str):
+                validation_errors.append(f"{name}: Result is not a string (type: {type(result)})")
+            # Note: Empty string is allowed - will be validated at final result
+
+        if validation_errors:
+            worker_logger.error("=" * 80)
+            worker_logger.error("❌ OCR VALIDATION FAILED!")
+            worker_logger.error("The following OCR results are invalid:")
+            for err in validation_errors:
+                worker_logger.error(f"  - {err}")
+            worker_logger.error("")
+            worker_logger.error("This may indicate:")
+            worker_logger.error("  1. API returned None/invalid response")
+            worker_logger.error("  2. API key quota exceeded")
+            worker_logger.error("=" * 80)
+            raise RuntimeError(f"OCR validation failed: {'; '.join(validation_errors)}")
+
+        worker_logger.info("✓ OCR basic validation passed")
+        worker_logger.info("  " + ", ".join(f"{name}: {len(result)} chars" for name, result in ocr_results))
+
+        # Release the decoded page before the LLM step
+        img.close()
+        del img
+        image_decode.release_memory()
+
+        # Log memory usage after OCR (peak is while the page is decoded)
+        if psutil is not None:
+            mem_info = psutil.Process().memory_info()
+            worker_logger.info(f"Memory usage after processing: RSS={mem_info.rss / 1024 / 1024:.2f} MB, VMS={mem_info.vms / 1024 / 1024:.2f} MB")
+
+        http_after = http_clients.get_pool().stats()
+        return {
+            "full": full_result,
+            "sections": sections,
+            "section_results": section_results,
+            "chat_keys": chat_keys,
+            "tier": tier,
+            "skipped": skipped,
+            "stages": stages,
+            "calls": calls,
+            "http": {
+                "requests": http_after["requests"] - http_before["requests"],
+                "new_connections": http_after["new_connections"] - http_before["new_connections"]
+            },
+            "memory": {
+                **decode_stats,
+                "peak_rss_mb": _peak_rss_mb()
+            },
+            "crops": plan.to_dict() if plan else None
+        }
+
+    except Exception as e:
+        error_msg = f"OCR Error: {str(e)}"
+        full_traceback = traceback.format_exc()
+
+        worker_logger.error("=" * 80)
+        worker_logger.error(f"OCR Worker FAILED with exception: {error_msg}")
+        worker_logger.error("Full traceback:")
+        worker_logger.error(full_traceback)
+        worker_logger.error("=" * 80)
+
+        # Re-raise exception to propagate to parent process
+        # This allows proper error handling in perform_ocr() (main.py)
+        raise PipelineError(f"{error_msg}\n{full_traceback}", calls) from e
+
+
+def init_merge_stage() -> None:
+    """Bind the libraries merge_stage needs in a process that never ran init_worker (main process)."""
+    global http_clients, llm_stream
+    _configure_worker_logging()
+    import http_clients
+    import llm_stream
+    http_clients.get_pool().prewarm(TYPHOON_BASE_URL)
+
+
+def _organization_section() -> str:
+    """Organization-name block of the merge prompt from organizations.json ("" when there is none)."""
+    org_json_path = Path(__file__).parent / "organizations.json"
+    if not org_json_path.exists():
+        worker_logger.info("organizations.json not found, skipping organization matching")
+        return ""
+    try:
+        with open(org_json_path, "r", encoding="utf-8") as f:
+            org_list = json.load(f)
+    except Exception as org_error:
+        worker_logger.warning(f"Failed to load organizations.json: {org_error}")
+        return ""
+    if not org_list:
+        worker_logger.info("organizations.json is empty, skipping organization matching")
+        return ""
+
+    worker_logger.info(f"Loaded {len(org_list)} organization names from organizations.json")
+    org_names = "\n".join([f"- {name}" for name in org_list])
+    return f"""
+## รายชื่อมูลนิธิที่ถูกต้อง (ใช้แก้ชื่อที่ OCR อ่านผิด):
+```
+{org_names}
+```
+
+**กฎ:** ถ้า OCR อ่านชื่อมูลนิธิผิดเล็กน้อย → จับคู่กับรายชื่อที่ถูกต้องข้างบน
+
+---
+"""
+
+
+def _section_blocks(sections: list, section_results: list[str]) -> str:
+    """Section OCR blocks of the merge prompt."""
+    return "".join(
+        f"### {section.name} OCR ({section.label}):\n```\n{result}\n```\n\n"
+        for section, result in zip(sections, section_results)
+    )
+
+
+def _compare_rule(sections: list) -> str:
+    """Rule mapping page areas to section OCRs ("" without sections)."""
+    if not sections:
+        return ""
+    section_mapping = "\n".join(
+        f"     * {section.hint} → เทียบกับ {section.name} OCR" for section in sections
+    )
+    return (
+        "   - เปรียบเทียบกับ Section OCRs เพื่อหาคำที่ถูกต้อง:\n"
+        f"{section_mapping}\n"
+        '   - ตัวอย่าง: Full อ่าน "วัดภูพระสงฆ์" แต่ Mid อ่าน "วัตถุประสงค์" → ใช้ "วัตถุประสงค์"\n'
+    )
+
+
+def _merge_rules(compare_rule: str) -> str:
+    """Rules + output requirements of the merge prompt."""
+    return f"""## ⚠️ กฎสำคัญ (ต้องปฏิบัติตาม):
+
+### 1. **ห้ามลบหรือข้ามข้อความใดๆ**
+   - ❌ ห้ามลบบรรทัด ห้ามข้ามบรรทัด ห้ามสรุป
+   - ❌ ห้ามตัดทิ้ง ห้ามย่อ ห้ามเปลี่ยนโครงสร้าง
+   - ✅ ต้องเก็บ**ทุกคำ ทุกบรรทัด ทุกข้อความ**จาก Full Image OCR
+   - ✅ Output ต้องมีจำนวนบรรทัดใกล้เคียงกับ Full Image OCR
+
+### 2. **ทำได้เฉพาะ: แก้คำผิด**
+   - แก้เฉพาะคำที่ OCR อ่านผิด (typo, คำสะกดผิด)
+{compare_rule}
+### 3. **แก้ชื่อมูลนิธิ (ถ้ามี):**
+   - **ถ้าชื่อใน OCR คล้ายกับชื่อในรายชื่อ** (เช่น แค่ผิด 1-2 ตัวอักษร) → แก้ให้ตรงกับรายชื่อ
+   - **ถ้าชื่อไม่เหมือนกันเลย** → **ห้ามแก้** ให้เก็บชื่อเดิมจาก OCR
+
+### 4. **แก้การสะกดภาษาไทย**
+   - แก้คำที่สะกดผิดชัดเจน (เช่น เคหะชุมชน → ถูกต้อง, เคหะชุมนน → ผิด)
+   - ใช้ความรู้ภาษาไทยในการแก้
+
+---
+
+## 📋 Output Requirements:
+1. ต้องมีจำนนวนบรรทัดใกล้เคียงกับ Full Image OCR (ห้ามน้อยกว่า 70% ของจำนวนบรรทัดต้นฉบับ)
+2. ต้องครบทุกส่วนของเอกสาร (หัวเรื่อง, เนื้อหา, หมายเลข, วันที่, ฯลฯ)
+3. ตอบเฉพาะข้อความที่รวมแล้ว (ไม่ต้องอธิบาย ไม่ต้องแสดงความคิดเห็น)
+"""
+
+
+def _merged_tier(ocr: dict) -> str:
+    """
+    Tier of a page whose LLM merge was used.
+
+    ocr["tier"] is what the OCR stage planned: a page planned full_only on a
+    tight deadline still gets the LLM when Full OCR came back early enough.
+    """
+    return "multi_scale" if ocr["section_results"] else "full_llm"
+
+
+def merge_stage(
+    ocr: dict,
+    chat_keys: Optional[list[str]] = None,
+    budget: Optional[Budget] = None
+) -> tuple[str, float, dict]:
+    """
+    LLM merge + postprocess stage: combine the ocr_stage texts into the final text.
+
+    Runs in the merge stage's thread pool (main process, see stages.py) or
+    right after ocr_stage in the same worker (ocr_worker). Network-bound - it
+    holds no image memory and no pool process.
+
+    Args:
+        ocr: ocr_stage() result
+        chat_keys: Keys with a closed chat breaker, planned when the stage starts
+                   (None = the keys planned for ocr_stage)
+        budget: Request deadline + stage p95s, taken when the stage starts
+
+    Returns:
+        Tuple of (text, confidence, meta). meta["http"] holds the OCR stage's
+        request / new-connection counts from the pooled HTTP clients,
+        meta["crops"] the crop plan, meta["calls"] the API call outcomes of
+        this stage, meta["tier"] / meta["skipped"] / meta["stages"] what ran
+        and how long it took.
+
+    Raises:
+        PipelineError: Any failure; carries this stage's API call outcomes
+    """
+    if llm_stream is None:
+        init_merge_stage()
+    full_result = ocr["full"]
+    sections = ocr["sections"]
+    section_results = ocr["section_results"]
+    chat_keys = chat_keys or ocr["chat_keys"]
+    tier = ocr["tier"]
+    skipped = dict(ocr["skipped"])
+    stages = dict(ocr["stages"])
+    budget = budget or Budget()
+    calls: list[dict] = []
+    worker_logger.info(f"LLM merge stage started: Full Image {len(full_result)} chars + {len(sections)} section(s)")
+
+    try:
+        # [3/5] Load organizations
+        worker_logger.info("[Step 3/5] Loading organization names...")
+        org_section = _organization_section()
+
+        # [4/5] Step 1: Combine Typhoon Multi-Scale
+        worker_logger.info("[Step 4/5] Running LLM Ensemble (Step 1: Combine Multi-Scale)...")
+        # Random 2 keys จาก keys ที่ breaker ยังปิดอยู่สำหรับ LLM
+        llm_keys = random.sample(chat_keys, min(2, len(chat_keys)))  # เลือก 2 keys แบบสุ่ม
+        worker_logger.info(f"Selected {len(llm_keys)} random API key(s) for LLM calls")
+
+        worker_logger.info("Preparing LLM prompt with OCR results...")
+        section_blocks = _section_blocks(sections, section_results)
+        rules = _merge_rules(_compare_rule(sections))
+        prompt_step1 = f"""คุณเป็นผู้เชี่ยวชาญในการรวมผลลัพธ์ OCR จากหลาย scales สำหรับเอกสารภาษาไทย
+{org_section}
+## ผลลัพธ์ Typhoon OCR:
+
+### Full Image OCR (**ใช้เป็นหลัก**):
+```
+{full_result}
+```
+
+{section_blocks}---
+
+{rules}
+ให้ผลลัพธ์ที่รวมและแก้ไขแล้ว (ต้องครบทุกบรรทัด):"""
+
+        if not budget.allows_llm():
+            skipped["llm"] = budget.skip_reason("llm")
+            tier = "full_only"
+            typhoon_combined, llm_stats = "", None
+        else:
+            worker_logger.info(f"Calling Typhoon LLM API (typhoon-v2.5-30b-a3b-instruct, "
+                               f"max_tokens={llm_stream.max_tokens_for(full_result, section_results)}, "
+                               f"stream={llm_stream.LLM_STREAM_ENABLED})...")
+            try:
+                # Streams with runaway guards: repetition / far past Full OCR length → abort early
+                # LLM Step 1 ใช้ key แรก (auth / quota error → key ถัดไป)
+                usage: dict = {}
+                typhoon_combined, llm_stats = _call_with_failover(
+                    "chat", llm_keys[0], chat_keys,
+                    lambda k: _llm_usage(llm_stream.guarded_completion(
+                        http_clients.get_pool().openai(k, TYPHOON_BASE_URL),
+                        model="typhoon-v2.5-30b-a3b-instruct",
+                        messages=[
+                            {"role": "system", "content": "รวม OCR จาก scales ต่างๆ โดย**ห้ามลบหรือข้ามข้อความใดๆ** ต้องเก็บทุกบรรทัดจาก Full Image OCR และแก้เฉพาะคำผิดเท่านั้น ตอบเฉพาะข้อความที่รวมแล้ว"},
+                            {"role": "user", "content": prompt_step1}
+                        ],
+                        reference=full_result,
+                        temperature=0.1,
+                        deadline=budget.deadline,
+                        sources=section_results
+                    ), usage),
+                    calls, "LLM Step 1", usage
+                )
+                worker_logger.info(f"LLM API call completed in {llm_stats.seconds:.2f}s "
+                                   f"(first token {llm_stats.first_token_seconds}s)")
+                if not llm_stats.aborted:
+                    stages["llm"] = llm_stats.seconds  # Only complete runs feed the p95
+            except Exception as llm_error:
+                worker_logger.error(f"LLM API call failed: {str(llm_error)}")
+                raise
+
+        worker_logger.info(f"LLM combined result: {len(typhoon_combined)} chars")
+
+        if llm_stats is None:
+            worker_logger.warning(f"⏱️  Skipping LLM merge ({skipped['llm']}): {budget.remaining():.1f}s left, "
+                                  f"p95 {budget.p95['llm']:.1f}s. Using Full Image OCR.")
+            final_result = full_result
+        elif llm_stats.aborted:
+            # Runaway, truncated or past the deadline - don't wait for / trust it
+            if llm_stats.aborted == "deadline":
+                skipped["llm"] = "deadline"
+                tier = "full_only"
+            worker_logger.warning("=" * 80)
+            worker_logger.warning(f"⚠️  LLM STREAM ABORTED: {llm_stats.aborted} {llm_stats.detail}")
+            worker_logger.warning(f"Stopped after {llm_stats.chars} chars / {llm_stats.seconds:.2f}s "
+                                  f"(Full Image OCR: {len(full_result.strip())} chars), "
+                                  f"saved ~{llm_stats.saved_seconds:.1f}s")
+            worker_logger.warning("Using Full Image OCR as fallback.")
+            worker_logger.warning("=" * 80)
+            final_result = full_result
+        else:
+            # [VALIDATION] Check LLM output
+            worker_logger.info("Validating LLM output...")
+            if not typhoon_combined or len(typhoon_combined.strip()) == 0:
+                worker_logger.error("=" * 80)
+                worker_logger.error("❌ LLM VALIDATION FAILED!")
+                worker_logger.error("LLM returned empty result!")
+                worker_logger.error("")
+                worker_logger.error("Input lengths:")
+                worker_logger.error(f"  Full: {len(full_result)} chars")
+                for section, result in zip(sections, section_results):
+                    worker_logger.error(f"  {section.name}: {len(result)} chars")
+                worker_logger.error("=" * 80)
+                raise RuntimeError("LLM returned empty result")
+
+            # Check if LLM output is too short compared to input (should be at least 50% of Full Image OCR)
+            full_length = len(full_result.strip())
+            llm_length = len(typhoon_combined.strip())
+            llm_ratio = llm_length / full_length if full_length > 0 else 0
+
+            if llm_ratio < MIN_LLM_RATIO:
+                worker_logger.warning("=" * 80)
+                worker_logger.warning("⚠️  LLM OUTPUT TOO SHORT!")
+                worker_logger.warning(f"Full Image OCR: {full_length} chars")
+                worker_logger.warning(f"LLM Output: {llm_length} chars ({llm_ratio:.1%})")
+                worker_logger.warning(f"Expected: At least {MIN_LLM_RATIO:.0%} of Full Image OCR ({int(full_length * MIN_LLM_RATIO)} chars)")
+                worker_logger.warning("")
+                worker_logger.warning("LLM may have removed content! Using Full Image OCR as fallback.")
+                worker_logger.warning("=" * 80)
+
+                # Fallback to Full Image OCR
+                final_result = full_result
+                worker_logger.info(f"✓ Using Full Image OCR as final result: {len(final_result)} chars")
+            else:
+                worker_logger.info(f"✓ LLM validation passed: {llm_length} chars ({llm_ratio:.1%} of Full Image)")
+                final_result = typhoon_combined
+                tier = _merged_tier(ocr)
+
+        worker_logger.info("[Step 5/5] Finalizing result...")
+        worker_logger.info(f"✓ Final result: {len(final_result.strip())} chars")
+        worker_logger.info(f"OCR pipeline completed successfully: {len(final_result)} chars")
+        worker_logger.info("=" * 80)
+        meta = {
+            "http": ocr["http"],
+            "memory": ocr["memory"],
+            "llm": llm_stats.to_dict() if llm_stats else None,
+            "crops": ocr["crops"],
+            "calls": calls,
+            "tier": tier,
+            "skipped": skipped,
+            "stages": stages
+        }
+        return final_result, 0.0, meta
+
+    except Exception as e:
+        error_msg = f"OCR Error: {str(e)}"
+        full_traceback = traceback.format_exc()
+
+        worker_logger.error("=" * 80)
+        worker_logger.error(f"LLM merge stage FAILED with exception: {error_msg}")
+        worker_logger.error("Full traceback:")
+        worker_logger.error(full_traceback)
+        worker_logger.error("=" * 80)
+        raise PipelineError(f"{error_msg}\n{full_traceback}", calls) from e
+
+
+def _split_batch_answer(text: str, pages: int) -> list[Optional[str]]:
+    """Per-page texts of a multi-page answer, by BATCH_PAGE_MARKER (None = page missing)."""
+    found: list[Optional[str]] = [None] * pages
+    markers = list(_BATCH_PAGE_RE.finditer(text))
+    for i, marker in enumerate(markers):
+        number = int(marker.group(1))
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        if 1 <= number <= pages and found[number - 1] is None:
+            found[number - 1] = text[marker.end():end].strip("\n")
+    return found
+
+
+def merge_batch(ocrs: list[dict], chat_keys: list[str]) -> tuple[list[Optional[tuple[str, float, dict]]], list[dict]]:
+    """
+    LLM merge of several short pages in one chat request (see stages.MergeBatcher).
+
+    The instructions and organization list are sent once; each page's OCR
+    texts are a numbered section and the model answers page by page after a
+    BATCH_PAGE_MARKER line. Every page is checked on its own (present,
+    non-empty, MIN_LLM_RATIO of its Full Image OCR).
+
+    Args:
+        ocrs: ocr_stage() results of the pages (no deadline - batching adds waiting)
+        chat_keys: Keys with a closed chat breaker
+
+    Returns:
+        Tuple of (results, calls): one merge_stage-style result per page, None
+        for pages that failed their check (retry them with merge_stage), and
+        the API call outcomes of the batch request.
+
+    Raises:
+        PipelineError: The batch request failed; carries its API call outcomes
+    """
+    if llm_stream is None:
+        init_merge_stage()
+    calls: list[dict] = []
+    worker_logger.info(f"LLM batch merge started: {len(ocrs)} page(s), "
+                       f"{sum(len(ocr['full']) for ocr in ocrs)} chars of Full Image OCR")
+
+    try:
+        org_section = _organization_section()
+        page_blocks = "".join(
+            f"## หน้า {number}\n\n"
+            f"### Full Image OCR (**ใช้เป็นหลัก**):\n```\n{ocr['full']}\n```\n\n"
+            f"{_section_blocks(ocr['sections'], ocr['section_results'])}---\n\n"
+            for number, ocr in enumerate(ocrs, start=1)
+        )
+        # Pages share the layout rules; the one with the most sections describes them best
+        rules = _merge_rules(_compare_rule(max((ocr["sections"] for ocr in ocrs), key=len)))
+        marker = BATCH_PAGE_MARKER.format(number="n")
+        prompt = f"""คุณเป็นผู้เชี่ยวชาญในการรวมผลลัพธ์ OCR จากหลาย scales สำหรับเอกสารภาษาไทย
+ข้างล่างคือผลลัพธ์ OCR ของเอกสาร {len(ocrs)} หน้าที่ไม่เกี่ยวข้องกัน ให้รวมแต่ละหน้าแยกกัน (ห้ามย้ายข้อความข้ามหน้า)
+{org_section}
+## ผลลัพธ์ Typhoon OCR:
+
+{page_blocks}{rules}4. ตอบทีละหน้าตามลำดับ: ขึ้นต้นแต่ละหน้าด้วยบรรทัด `{marker}` (n = เลขหน้าข้างบน) แล้วตามด้วยข้อความที่รวมแล้วของหน้านั้น
+
+ให้ผลลัพธ์ที่รวมและแก้ไขแล้วของทุกหน้า (ต้องครบทุกบรรทัด):"""
+
+        reference = "\n".join(BATCH_PAGE_MARKER.format(number=number) + "\n" + ocr["full"]
+                              for number, ocr in enumerate(ocrs, start=1))
+        usage: dict = {}
+        combined, llm_stats = _call_with_failover(
+            "chat", random.choice(chat_keys), chat_keys,
+            lambda k: _llm_usage(llm_stream.guarded_completion(
+                http_clients.get_pool().openai(k, TYPHOON_BASE_URL),
+                model="typhoon-v2.5-30b-a3b-instruct",
+                messages=[
+                    {"role": "system", "content": "รวม OCR จาก scales ต่างๆ ของแต่ละหน้าแยกกัน โดย**ห้ามลบหรือข้ามข้อความใดๆ** ต้องเก็บทุกบรรทัดจาก Full Image OCR ของแต่ละหน้าและแก้เฉพาะคำผิดเท่านั้น ตอบเฉพาะข้อความที่รวมแล้ว"},
+                    {"role": "user", "content": prompt}
+                ],
+                reference=reference,
+                temperature=0.1,
+                sources=[text for ocr in ocrs for text in ocr["section_results"]]
+            ), usage),
+            calls, f"LLM batch ({len(ocrs)} pages)", usage
+        )
+    except Exception as e:
+        worker_logger.error(f"LLM batch merge FAILED: {str(e)}")
+        raise PipelineError(f"LLM batch merge failed: {str(e)}", calls) from e
+
+    worker_logger.info(f"LLM batch merge completed in {llm_stats.seconds:.2f}s: {len(combined)} chars")
+    if llm_stats.aborted:
+        worker_logger.warning(f"⚠️  LLM batch stream aborted: {llm_stats.aborted} {llm_stats.detail} - "
+                              f"retrying {len(ocrs)} page(s) singly")
+        return [None] * len(ocrs), calls
+
+    results: list[Optional[tuple[str, float, dict]]] = []
+    for number, (ocr, text) in enumerate(zip(ocrs, _split_batch_answer(combined, len(ocrs))), start=1):
+        full_length = len(ocr["full"].strip())
+        if text is None or not text.strip():
+            worker_logger.warning(f"⚠️  Batch page {number}: missing from the answer - retrying singly")
+            results.append(None)
+            continue
+        ratio = len(text.strip()) / full_length if full_length > 0 else 0
+        if ratio < MIN_LLM_RATIO:
+            worker_logger.warning(f"⚠️  Batch page {number}: {len(text.strip())} chars ({ratio:.1%} of Full Image) "
+                                  f"- retrying singly")
+            results.append(None)
+            continue
+        meta = {
+            "http": ocr["http"],
+            "memory": ocr["memory"],
+            "llm": {**llm_stats.to_dict(), "batched_pages": len(ocrs)},
+            "crops": ocr["crops"],
+            "calls": [],
+            "batch": {"pages": len(ocrs), "share": len(ocr["full"]), "calls": calls},
+            "tier": _merged_tier(ocr),
+            "skipped": dict(ocr["skipped"]),
+            # A shared request says nothing about single-page LLM time - keep it out of the p95
+            "stages": {**ocr["stages"], "llm": None}
+        }
+        results.append((text, 0.0, meta))
+    # The request's cost is shared by the pages it merged, by Full Image OCR length (see cost.page_cost)
+    merged_chars = sum(result[2]["batch"]["share"] for result in results if result) or 1
+    for result in results:
+        if result:
+            result[2]["batch"]["share"] = result[2]["batch"]["share"] / merged_chars
+    worker_logger.info(f"✓ Batch merge: {sum(1 for r in results if r)}/{len(ocrs)} page(s) passed validation")
+    return results, calls
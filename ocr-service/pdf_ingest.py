@@ -0,0 +1,86 @@
+"""
+Lazy PDF rasterization using poppler-utils (pdfinfo / pdftoppm).
+
+Pages are rendered one at a time on demand, straight to stdout, so only the
+pages currently being OCR'd are held in memory - a 200-page PDF costs the
+same as a 2-page one. The PDF itself stays on disk.
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+import re
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MIN_DPI = 72
+MAX_DPI = 600
+
+
+class PdfError(Exception):
+    """PDF could not be read or rasterized."""
+    pass
+
+
+async def _run(*args: str) -> bytes:
+    """Run a poppler command and return its stdout. Cancelling the caller kills the process."""
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await proc.communicate()
+    except BaseException:
+        # Client gone / page cancelled: don't leave pdftoppm rendering for nobody
+        if proc.returncode is None:
+            proc.kill()
+            await asyncio.shield(proc.wait())
+        raise
+    if proc.returncode != 0:
+        message = stderr.decode("utf-8", errors="replace").strip()
+        raise PdfError(f"{args[0]} failed (exit {proc.returncode}): {message}")
+    return stdout
+
+
+async def get_page_count(pdf_path: Path) -> int:
+    """
+    Read the number of pages with pdfinfo.
+
+    Raises:
+        PdfError: If the file is not a readable PDF
+    """
+    output = (await _run("pdfinfo", str(pdf_path))).decode("utf-8", errors="replace")
+    match = re.search(r"^Pages:\s+(\d+)", output, re.MULTILINE)
+    if not match:
+        raise PdfError("pdfinfo did not report a page count")
+    return int(match.group(1))
+
+
+async def rasterize_page(pdf_path: Path, page: int, dpi: int = 200) -> bytes:
+    """
+    Render a single page to JPEG bytes.
+
+    Args:
+        pdf_path: Path to the PDF on disk
+        page: 1-based page number
+        dpi: Render resolution
+
+    Returns:
+        JPEG image bytes
+    """
+    data = await _run(
+        "pdftoppm",
+        "-f", str(page),
+        "-l", str(page),
+        "-r", str(dpi),
+        "-jpeg",
+        "-singlefile",
+        str(pdf_path),
+        "-"  # output root "-" writes the image to stdout
+    )
+    if not data:
+        raise PdfError(f"pdftoppm produced no output for page {page}")
+    logger.debug(f"Rasterized page {page} at {dpi} DPI: {len(data)} bytes")
+    return data
@@ -0,0 +1,308 @@
+"""
+Perceptual-hash index for near-duplicate page detection.
+
+The same physical page is often scanned twice (rescans, duplicate uploads,
+copies attached to several groups). The bytes differ, so an exact hash misses
+them. This module computes a difference hash (dHash) on a normalized grayscale
+thumbnail and keeps a Hamming-distance index of every page that was OCR'd
+successfully, so a near-duplicate can reuse the stored text.
+
+Entries are scoped to the caller (a fingerprint of its API key set): a page
+is only ever reused for the tenant that paid for its OCR. The index keeps at
+most max_entries pages for at most ttl_seconds; older entries are dropped.
+
+Index layout:
+    - SQLite table for persistence (survives restarts)
+    - In-memory band index for lookup: the 256-bit hash is split into
+      32 bands of 8 bits. Two hashes within distance < 32 must share at
+      least one band exactly (pigeonhole), so only those candidates are
+      compared bit-by-bit.
+"""
+
+from __future__ import annotations
+import io
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union, List
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# HASHING
+# =============================================================================
+
+# 16×16 gradients = 256 bits. A 64-bit dHash is too coarse for text pages:
+# two different pages of the same form template collide at 8×8.
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+BAND_BITS = 8
+BAND_COUNT = HASH_BITS // BAND_BITS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def compute_dhash(image_data: bytes, hash_size: int = HASH_SIZE) -> int:
+    """
+    Compute a difference hash (dHash) of an image.
+
+    The image is reduced to a (hash_size + 1) × hash_size grayscale thumbnail
+    and each bit records whether a pixel is brighter than its right neighbour.
+    JPEG draft mode is used so large scans are not fully decoded.
+
+    Args:
+        image_data: Raw image bytes
+        hash_size: Thumbnail height (hash has hash_size² bits)
+
+    Returns:
+        Hash as a Python int
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_data)) as img:
+        # Decode JPEGs at reduced scale - the thumbnail is tiny anyway
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            img = Image.alpha_composite(background, img)
+        thumb = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+        pixels = list(thumb.getdata())
+
+    value = 0
+    row_width = hash_size + 1
+    for row in range(hash_size):
+        offset = row * row_width
+        for col in range(hash_size):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes."""
+    return (a ^ b).bit_count()
+
+
+def _bands(phash: int) -> list[int]:
+    """Split a hash into BAND_COUNT fixed-width bands."""
+    return [(phash >> (i * BAND_BITS)) & BAND_MASK for i in range(BAND_COUNT)]
+
+
+# =============================================================================
+# INDEX
+# =============================================================================
+
+@dataclass
+class DuplicateMatch:
+    """A previously OCR'd page that matches the query hash."""
+    phash: str
+    distance: int
+    text: str
+    created_at: float
+
+
+def dedup_scope(api_key: Union[str, List[str]]) -> str:
+    """Tenant scope of an entry: fingerprint of the caller's API key set (the keys are never stored)."""
+    keys = [api_key] if isinstance(api_key, str) else api_key
+    return hashlib.sha256("\n".join(sorted(set(keys))).encode()).hexdigest()[:16]
+
+
+@dataclass
+class _Entry:
+    phash: int
+    scope: str
+    task_type: str
+    figure_language: str
+    text: str
+    created_at: float
+
+
+class PHashIndex:
+    """
+    Persistent Hamming-distance index of OCR'd pages.
+
+    Entries are partitioned by (scope, task_type, figure_language): the
+    tenant, and the parameters the OCR text for the same image depends on.
+    Thread-safe: lookups and inserts may run from asyncio.to_thread workers.
+
+    Args:
+        db_path: SQLite file
+        max_distance: Default Hamming distance threshold
+        max_entries: Pages kept; the oldest are dropped beyond it
+        ttl_seconds: Age after which a page is no longer matched and is dropped
+    """
+
+    def __init__(self, db_path: Path, max_distance: int = 16, max_entries: int = 100_000,
+                 ttl_seconds: float = 30 * 86400):
+        if max_distance >= BAND_COUNT:
+            raise ValueError(f"max_distance must be < {BAND_COUNT} for the band index to be exact")
+        self.db_path = Path(db_path)
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Pruning rebuilds the band index, so it runs once per 10% overflow or once an hour
+        self._prune_slack = max(1, max_entries // 10)
+        self._pruned_at = 0.0
+        self.pruned = 0
+        self._lock = threading.Lock()
+        self._entries: list[_Entry] = []
+        self._bands: list[dict[int, list[int]]] = [{} for _ in range(BAND_COUNT)]
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self) -> None:
+        """Open the SQLite store and load all entries into memory."""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS page_hashes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phash TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                figure_language TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(page_hashes)")}
+        if "scope" not in columns:
+            # Pages indexed before scoping belong to no tenant: never matched, dropped by the TTL / cap
+            self._conn.execute("ALTER TABLE page_hashes ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self._conn.commit()
+
+        rows = self._conn.execute(
+            "SELECT phash, scope, task_type, figure_language, text, created_at FROM page_hashes ORDER BY id"
+        ).fetchall()
+        with self._lock:
+            for phash_hex, scope, task_type, figure_language, text, created_at in rows:
+                self._insert_memory(_Entry(int(phash_hex, 16), scope, task_type, figure_language, text, created_at))
+            self._prune()
+        logger.info(f"Perceptual-hash index loaded: {len(self._entries)} page(s) from {self.db_path} "
+                    f"({self.pruned} expired / over the cap dropped)")
+
+    def close(self) -> None:
+        """Close the SQLite store."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _insert_memory(self, entry: _Entry) -> None:
+        position = len(self._entries)
+        self._entries.append(entry)
+        for i, band in enumerate(_bands(entry.phash)):
+            self._bands[i].setdefault(band, []).append(position)
+
+    def _prune(self) -> None:
+        """Drop expired entries and the oldest beyond max_entries, then rebuild the band index. Holds _lock."""
+        now = time.time()
+        self._pruned_at = now
+        cutoff = now - self.ttl_seconds
+        kept = sorted((e for e in self._entries if e.created_at >= cutoff), key=lambda e: e.created_at)
+        kept = kept[-self.max_entries:] if self.max_entries > 0 else []
+        dropped = len(self._entries) - len(kept)
+        if not dropped:
+            return
+        self.pruned += dropped
+        self._entries = []
+        self._bands = [{} for _ in range(BAND_COUNT)]
+        for entry in kept:
+            self._insert_memory(entry)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM page_hashes WHERE created_at < ?", (cutoff,))
+            self._conn.execute(
+                "DELETE FROM page_hashes WHERE id NOT IN "
+                "(SELECT id FROM page_hashes ORDER BY created_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def lookup(
+        self,
+        phash: int,
+        scope: str,
+        task_type: str,
+        figure_language: str,
+        max_distance: Optional[int] = None
+    ) -> Optional[DuplicateMatch]:
+        """
+        Find the closest unexpired stored page of the same scope within max_distance bits.
+
+        Args:
+            phash: Query hash
+            scope: Tenant scope (see dedup_scope)
+            task_type: OCR task type the stored text must have been produced with
+            figure_language: Figure language the stored text must have been produced with
+            max_distance: Override of the index default (capped to stay exact)
+
+        Returns:
+            Closest match, or None if nothing is within the threshold
+        """
+        limit = self.max_distance if max_distance is None else min(max_distance, BAND_COUNT - 1)
+        best: Optional[_Entry] = None
+        best_distance = limit + 1
+        cutoff = time.time() - self.ttl_seconds
+
+        with self._lock:
+            seen: set[int] = set()
+            for i, band in enumerate(_bands(phash)):
+                for position in self._bands[i].get(band, ()):
+                    if position in seen:
+                        continue
+                    seen.add(position)
+                    entry = self._entries[position]
+                    if (entry.scope != scope or entry.task_type != task_type
+                            or entry.figure_language != figure_language or entry.created_at < cutoff):
+                        continue
+                    distance = hamming_distance(phash, entry.phash)
+                    # Prefer the closest, then the most recent
+                    if distance < best_distance or (distance == best_distance and best and entry.created_at > best.created_at):
+                        best, best_distance = entry, distance
+
+        if best is None:
+            return None
+        return DuplicateMatch(
+            phash=f"{best.phash:0{HASH_BITS // 4}x}",
+            distance=best_distance,
+            text=best.text,
+            created_at=best.created_at
+        )
+
+    def add(self, phash: int, scope: str, task_type: str, figure_language: str, text: str) -> None:
+        """Record an OCR'd page. Exact hash repeats only refresh the stored text."""
+        entry = _Entry(phash, scope, task_type, figure_language, text, time.time())
+        phash_hex = f"{phash:0{HASH_BITS // 4}x}"
+
+        with self._lock:
+            for position in self._bands[0].get(_bands(phash)[0], ()):
+                existing = self._entries[position]
+                if (existing.phash == phash and existing.scope == scope and existing.task_type == task_type
+                        and existing.figure_language == figure_language):
+                    existing.text = text
+                    existing.created_at = entry.created_at
+                    if self._conn is not None:
+                        self._conn.execute(
+                            "UPDATE page_hashes SET text = ?, created_at = ? "
+                            "WHERE phash = ? AND scope = ? AND task_type = ? AND figure_language = ?",
+                            (text, entry.created_at, phash_hex, scope, task_type, figure_language)
+                        )
+                        self._conn.commit()
+                    return
+
+            self._insert_memory(entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT INTO page_hashes (phash, scope, task_type, figure_language, text, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (phash_hex, scope, task_type, figure_language, text, entry.created_at)
+                )
+                self._conn.commit()
+            if len(self._entries) > self.max_entries + self._prune_slack or entry.created_at - self._pruned_at > 3600:
+                self._prune()
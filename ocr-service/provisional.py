@@ -0,0 +1,106 @@
+"""
+Two-phase results: Full Image OCR first (provisional), LLM-refined text later (final).
+
+Reviewers can start working from the Full Image OCR; only the LLM-merged
+text has to wait for the section crops and the combine call. A two-phase
+request gets the Full Image text as soon as the worker has it, marked
+provisional, and the final result when the pipeline finishes:
+
+    - POST /ocr/stream: Server-Sent Events "provisional" then "final"
+    - POST /jobs with two_phase=true: the job's result holds the provisional
+      text (provisional: true) while it is still running
+
+Workers run in spawn processes, so the Full Image text travels back over a
+multiprocessing queue shared with every worker at pool start (init_worker).
+A reader thread in the main process hands each message to the request that
+registered its token.
+"""
+
+from __future__ import annotations
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProvisionalChannel:
+    """
+    Main process side: routes (token, text) messages from workers to waiting requests.
+
+    Usage:
+        with channel.listen(on_provisional) as token:
+            await loop.run_in_executor(pool, ocr_worker, ..., token)
+    """
+
+    def __init__(self, mp_context):
+        self.queue = mp_context.Queue()
+        self._listeners: dict[str, tuple[Callable[[str], None], float]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self.delivered = 0
+        self.late = 0
+        self._seconds = 0.0
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._thread = threading.Thread(target=self._read, name="provisional-reader", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.queue.close()
+        self.queue.join_thread()
+        self.queue = None
+
+    def _read(self) -> None:
+        while True:
+            try:
+                message = self.queue.get()
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            self._loop.call_soon_threadsafe(self._deliver, *message)
+
+    def _deliver(self, token: str, text: str) -> None:
+        listener = self._listeners.pop(token, None)
+        if listener is None:
+            self.late += 1  # Request finished or gave up first
+            return
+        callback, registered_at = listener
+        self.delivered += 1
+        self._seconds += time.monotonic() - registered_at
+        try:
+            callback(text)
+        except Exception as e:
+            logger.warning(f"Provisional result callback failed: {e}")
+
+    @contextmanager
+    def listen(self, callback: Optional[Callable[[str], None]]):
+        """Register a callback (called on the event loop) for one worker run; yields its token or None."""
+        if callback is None:
+            yield None
+            return
+        token = uuid.uuid4().hex
+        self._listeners[token] = (callback, time.monotonic())
+        try:
+            yield token
+        finally:
+            self._listeners.pop(token, None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "listening": len(self._listeners),
+            "delivered": self.delivered,
+            "late": self.late,
+            "mean_seconds_to_provisional": round(self._seconds / self.delivered, 3) if self.delivered else None
+        }
@@ -0,0 +1,266 @@
+"""
+Pipeline stages with their own executors and concurrency limits.
+
+The region OCR calls and the LLM merge have different rate limits,
+latencies and failure modes, but both ran inside one pool task: a page
+waiting 10-20s on the LLM kept a worker process (and its slot) that could
+have been decoding and OCR-ing the next page. The pipeline now runs as two
+stages connected by a bounded queue:
+
+    ocr   - decode, crop planning, region OCR (ocr_pipeline.ocr_stage).
+            Needs the decoded page, so it stays in the process pool; its
+            queue and limit are the priority lanes (dispatcher.py, one page
+            per worker) and the image memory budget.
+    merge - LLM merge + result checks (ocr_pipeline.merge_stage).
+            Network-bound: runs on a thread pool of OCR_LLM_CONCURRENCY in
+            the main process, at most OCR_LLM_QUEUE_SIZE pages waiting.
+
+A page reserves its place in the merge queue before it gives its pool slot
+back. When the merge queue is full the pool slot stays taken, so the OCR
+stage slows down to what the LLM can absorb instead of piling up pages.
+
+OCR for page N+1 now overlaps with the LLM for page N. OCR_STAGE_SPLIT=false
+runs the whole pipeline in the pool task as before.
+
+Batching (opt-in, OCR_LLM_BATCH=true): for short pages the fixed part of the
+merge request (instructions, organization list, round trip) outweighs the
+page itself. MergeBatcher gathers short pages that reach the merge stage
+within OCR_LLM_BATCH_WINDOW_MS into one request (ocr_pipeline.merge_batch);
+pages that fail their own check are merged again singly.
+"""
+
+from __future__ import annotations
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+STAGE_SPLIT = os.environ.get('OCR_STAGE_SPLIT', 'true').lower() in ('1', 'true', 'yes')
+# 0 = OCR_MAX_WORKERS (as many LLM calls in flight as the unsplit pipeline had at most)
+LLM_CONCURRENCY = int(os.environ.get('OCR_LLM_CONCURRENCY', '0'))
+# 0 = 2 x the merge concurrency
+LLM_QUEUE_SIZE = int(os.environ.get('OCR_LLM_QUEUE_SIZE', '0'))
+
+LLM_BATCH_ENABLED = os.environ.get('OCR_LLM_BATCH', 'false').lower() in ('1', 'true', 'yes')
+LLM_BATCH_MAX_PAGES = int(os.environ.get('OCR_LLM_BATCH_MAX_PAGES', '4'))
+LLM_BATCH_WINDOW_SECONDS = float(os.environ.get('OCR_LLM_BATCH_WINDOW_MS', '300')) / 1000
+# Pages with at most this much Full Image OCR text are batched
+LLM_BATCH_MAX_CHARS = int(os.environ.get('OCR_LLM_BATCH_MAX_CHARS', '1500'))
+
+
+class PipelineStage:
+    """
+    A stage with its own thread pool, a concurrency limit and a bounded queue.
+
+    Usage:
+        await stage.reserve()            # while still holding the previous stage's slot
+        result = await stage.run(fn, *args)
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"stage-{name}")
+        # Places in the stage (queued + running) and run slots
+        self._places = asyncio.Semaphore(concurrency + queue_size)
+        self._slots = asyncio.Semaphore(concurrency)
+        self.reserved = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.blocked = 0
+        self._wait_seconds = 0.0
+        self._run_seconds = 0.0
+
+    async def reserve(self) -> None:
+        """Wait for a place in the stage (backpressure on the previous stage when full)."""
+        if self._places.locked():
+            self.blocked += 1
+        await self._places.acquire()
+        self.reserved += 1
+
+    def release(self) -> None:
+        """Give back a reserved place without running (the page failed or was cancelled)."""
+        self.reserved -= 1
+        self._places.release()
+
+    async def run(self, fn: Callable, *args, release: bool = True):
+        """
+        Run fn(*args) on the stage's threads once a slot is free. Requires a reserve().
+
+        release=False keeps the reserved place (the caller releases it, see MergeBatcher).
+        """
+        queued_at = time.perf_counter()
+        try:
+            async with self._slots:
+                started = time.perf_counter()
+                self._wait_seconds += started - queued_at
+                self.running += 1
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.running -= 1
+                    self._run_seconds += time.perf_counter() - started
+                self.completed += 1
+                return result
+        finally:
+            if release:
+                self.release()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        done = self.completed + self.failed
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "running": self.running,
+            "waiting": self.reserved - self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "blocked_upstream": self.blocked,
+            "mean_wait_seconds": round(self._wait_seconds / done, 3) if done else None,
+            "mean_run_seconds": round(self._run_seconds / done, 3) if done else None
+        }
+
+
+# =============================================================================
+# MULTI-PAGE MERGE BATCHING
+# =============================================================================
+
+@dataclass
+class _Pending:
+    ocr: dict
+    chat_keys: Optional[list[str]]
+    budget: object
+    future: asyncio.Future
+
+
+class MergeBatcher:
+    """
+    Gather short pages entering the merge stage into multi-page LLM requests.
+
+    Each page has reserved its place in the stage; from merge() on the
+    batcher owns that place and releases it when the page's result is set.
+    Pages are only batched with pages of the same chat keys (one window
+    per key set): a request runs on its pages' keys, never another caller's.
+
+    Args:
+        stage: The merge stage the requests run on
+        batch_fn: merge_batch(ocrs, chat_keys) -> (results with None = retry singly, calls)
+        single_fn: merge_stage(ocr, chat_keys, budget) -> (text, confidence, meta)
+        on_calls: Called on the event loop with the API call outcomes of each batch request
+    """
+
+    def __init__(
+        self,
+        stage: PipelineStage,
+        batch_fn: Callable,
+        single_fn: Callable,
+        on_calls: Callable[[Optional[list[dict]]], None],
+        max_pages: int = LLM_BATCH_MAX_PAGES,
+        window_seconds: float = LLM_BATCH_WINDOW_SECONDS,
+        max_chars: int = LLM_BATCH_MAX_CHARS
+    ):
+        self.stage = stage
+        self.batch_fn = batch_fn
+        self.single_fn = single_fn
+        self.on_calls = on_calls
+        self.max_pages = max_pages
+        self.window_seconds = window_seconds
+        self.max_chars = max_chars
+        self._pending: dict[tuple, list[_Pending]] = {}
+        self._timers: dict[tuple, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.batched_pages = 0
+        self.single_retries = 0
+        self.failed_batches = 0
+
+    def eligible(self, ocr: dict, deadline: Optional[float]) -> bool:
+        """Short pages without a deadline (the window adds waiting) that still need the LLM."""
+        return deadline is None and len(ocr["full"]) <= self.max_chars and "llm" not in ocr["skipped"]
+
+    async def merge(self, ocr: dict, chat_keys: Optional[list[str]], budget) -> tuple:
+        """Merge one page, batched with the pages that arrive within the window. Requires a reserve()."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())  # Caller may have given up
+        group = tuple(chat_keys or ocr["chat_keys"])
+        pending = self._pending.setdefault(group, [])
+        pending.append(_Pending(ocr, chat_keys, budget, future))
+        if len(pending) >= self.max_pages:
+            self._flush(group)
+        elif group not in self._timers:
+            self._timers[group] = loop.call_later(self.window_seconds, self._flush, group)
+        # shield: a caller that gives up must not cancel its batch mates
+        return await asyncio.shield(future)
+
+    def _flush(self, group: tuple) -> None:
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(group, [])
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[_Pending]) -> None:
+        if len(batch) == 1:
+            await self._single(batch[0])
+            return
+        try:
+            results, calls = await self.stage.run(
+                self.batch_fn, [page.ocr for page in batch], batch[0].chat_keys or batch[0].ocr["chat_keys"],
+                release=False
+            )
+            self.on_calls(calls)
+            self.batches += 1
+        except Exception as e:
+            self.on_calls(getattr(e, "calls", None))
+            self.failed_batches += 1
+            results = [None] * len(batch)
+
+        retries = []
+        for page, result in zip(batch, results):
+            if result is None:
+                self.single_retries += 1
+                retries.append(self._single(page))
+                continue
+            self.batched_pages += 1
+            self.stage.release()
+            if not page.future.done():
+                page.future.set_result(result)
+        await asyncio.gather(*retries)
+
+    async def _single(self, page: _Pending) -> None:
+        try:
+            result = await self.stage.run(self.single_fn, page.ocr, page.chat_keys, page.budget)
+        except Exception as e:
+            if not page.future.done():
+                page.future.set_exception(e)
+            return
+        if not page.future.done():
+            page.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "max_pages": self.max_pages,
+            "window_ms": round(self.window_seconds * 1000),
+            "max_chars": self.max_chars,
+            "batches": self.batches,
+            "batched_pages": self.batched_pages,
+            "mean_batch_size": round(self.batched_pages / self.batches, 2) if self.batches else None,
+            "single_retries": self.single_retries,
+            "failed_batches": self.failed_batches
+        }
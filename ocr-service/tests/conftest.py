@@ -0,0 +1,6 @@
+"""Make the service's flat modules importable from tests/ (python -m pytest tests)."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
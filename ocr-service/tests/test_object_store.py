@@ -0,0 +1,186 @@
+"""Image reference validation and shared-volume / object-store error mapping (no MinIO needed)."""
+
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+import object_store
+from object_store import FetchError, InvalidReferenceError, ObjectFetcher, reference_of
+
+
+# -----------------------------------------------------------------------------
+# reference_of
+# -----------------------------------------------------------------------------
+
+def test_reference_of_base64_is_inline():
+    assert reference_of({"image_base64": "aGk="}) is None
+
+
+def test_reference_of_object():
+    assert reference_of({"bucket": "scans", "key": "a/b.jpg"}) == {"bucket": "scans", "key": "a/b.jpg"}
+
+
+def test_reference_of_path():
+    assert reference_of({"path": "/data/a.jpg"}) == {"path": "/data/a.jpg"}
+
+
+@pytest.mark.parametrize("item", [
+    {},
+    {"image_base64": "aGk=", "path": "/data/a.jpg"},
+    {"image_base64": "aGk=", "bucket": "scans", "key": "a.jpg"},
+    {"bucket": "scans", "key": "a.jpg", "path": "/data/a.jpg"},
+    {"bucket": "scans"},
+    {"key": "a.jpg"},
+    {"image_base64": "", "path": ""},
+])
+def test_reference_of_rejects_anything_but_one_source(item):
+    with pytest.raises(InvalidReferenceError):
+        reference_of(item)
+
+
+# -----------------------------------------------------------------------------
+# Shared volume: root containment
+# -----------------------------------------------------------------------------
+
+@pytest.fixture
+def volume(tmp_path) -> Path:
+    root = tmp_path / "volume"
+    (root / "group").mkdir(parents=True)
+    (root / "group" / "page.jpg").write_bytes(b"jpeg")
+    (tmp_path / "secret.txt").write_bytes(b"secret")
+    return root
+
+
+def test_read_file_inside_root(volume):
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[volume])
+    assert fetcher._read_file(str(volume / "group" / "page.jpg")) == b"jpeg"
+
+
+@pytest.mark.parametrize("relative", ["../secret.txt", "group/../../secret.txt"])
+def test_read_file_rejects_traversal(volume, relative):
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[volume])
+    with pytest.raises(InvalidReferenceError, match="outside"):
+        fetcher._read_file(f"{volume}/{relative}")
+
+
+def test_read_file_rejects_absolute_path_outside(volume):
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[volume])
+    with pytest.raises(InvalidReferenceError, match="outside"):
+        fetcher._read_file("/etc/passwd")
+
+
+def test_read_file_rejects_sibling_with_root_prefix(volume):
+    # /…/volume-other must not pass as inside /…/volume
+    sibling = volume.parent / f"{volume.name}-other"
+    sibling.mkdir()
+    (sibling / "page.jpg").write_bytes(b"jpeg")
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[volume])
+    with pytest.raises(InvalidReferenceError, match="outside"):
+        fetcher._read_file(str(sibling / "page.jpg"))
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="no symlinks")
+def test_read_file_rejects_symlink_escaping_root(volume):
+    link = volume / "group" / "escape.txt"
+    link.symlink_to(volume.parent / "secret.txt")
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[volume])
+    with pytest.raises(InvalidReferenceError, match="outside"):
+        fetcher._read_file(str(link))
+
+
+def test_read_file_disabled_without_roots(volume):
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[])
+    with pytest.raises(InvalidReferenceError, match="not enabled"):
+        fetcher._read_file(str(volume / "group" / "page.jpg"))
+
+
+def test_read_file_missing_and_directory(volume):
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[volume])
+    with pytest.raises(InvalidReferenceError):
+        fetcher._read_file(str(volume / "group" / "missing.jpg"))
+    with pytest.raises(InvalidReferenceError):
+        fetcher._read_file(str(volume / "group"))
+
+
+def test_read_file_size_limit(volume):
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[volume], max_bytes=3)
+    with pytest.raises(InvalidReferenceError, match="limit"):
+        fetcher._read_file(str(volume / "group" / "page.jpg"))
+
+
+def test_fetch_counts_failures(volume):
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[volume])
+    assert asyncio.run(fetcher.fetch({"path": str(volume / "group" / "page.jpg")})) == b"jpeg"
+    with pytest.raises(InvalidReferenceError):
+        asyncio.run(fetcher.fetch({"path": str(volume.parent / "secret.txt")}))
+    stats = fetcher.stats()
+    assert stats["fetched"]["path"] == 1
+    assert stats["failed"] == 1
+
+
+# -----------------------------------------------------------------------------
+# Object store: S3 error classification
+# -----------------------------------------------------------------------------
+
+class _FakeMinio:
+    """Stands in for the Minio client: stat_object raises the given error."""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    def stat_object(self, bucket, key):
+        raise self.error
+
+
+def _s3_error(code: str) -> Exception:
+    from minio.error import S3Error
+
+    return S3Error(None, code, f"{code} message", f"/{code}", "request-id", "host-id")
+
+
+@pytest.fixture
+def fetcher_with(monkeypatch):
+    pytest.importorskip("minio")
+    monkeypatch.setattr(object_store, "MINIO_BUCKETS", [])
+
+    def make(error: Exception) -> ObjectFetcher:
+        fetcher = ObjectFetcher(endpoint="minio:9000", volume_roots=[])
+        fetcher._client = _FakeMinio(error)
+        return fetcher
+    return make
+
+
+@pytest.mark.parametrize("code", ["NoSuchKey", "NoSuchBucket", "AccessDenied", "InvalidObjectName",
+                                  "InvalidBucketName"])
+def test_s3_client_errors_are_invalid_references(fetcher_with, code):
+    with pytest.raises(InvalidReferenceError, match=code):
+        fetcher_with(_s3_error(code))._get_object("scans", "a.jpg")
+
+
+@pytest.mark.parametrize("code", ["InternalError", "SlowDown", "ServiceUnavailable"])
+def test_s3_server_errors_are_retryable(fetcher_with, code):
+    with pytest.raises(FetchError) as raised:
+        fetcher_with(_s3_error(code))._get_object("scans", "a.jpg")
+    assert not isinstance(raised.value, InvalidReferenceError)
+
+
+def test_connection_errors_are_retryable(fetcher_with):
+    with pytest.raises(FetchError, match="unavailable") as raised:
+        fetcher_with(ConnectionRefusedError("refused"))._get_object("scans", "a.jpg")
+    assert not isinstance(raised.value, InvalidReferenceError)
+
+
+def test_bucket_allowlist(monkeypatch):
+    monkeypatch.setattr(object_store, "MINIO_BUCKETS", ["scans"])
+    fetcher = ObjectFetcher(endpoint="minio:9000", volume_roots=[])
+    with pytest.raises(InvalidReferenceError, match="not allowed"):
+        fetcher._get_object("other", "a.jpg")
+
+
+def test_bucket_references_disabled_without_endpoint(monkeypatch):
+    monkeypatch.setattr(object_store, "MINIO_BUCKETS", [])
+    fetcher = ObjectFetcher(endpoint="", volume_roots=[])
+    with pytest.raises(InvalidReferenceError, match="not enabled"):
+        fetcher._get_object("scans", "a.jpg")
@@ -0,0 +1,78 @@
+"""
+Request parity: typhoon_client.build_messages vs typhoon_ocr.prepare_ocr_messages.
+
+The offline half of tools/typhoon_parity.py - no API or mock server needed.
+The OCR text comparison through the API stays in the script.
+"""
+
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+typhoon_ocr = pytest.importorskip("typhoon_ocr")
+
+import typhoon_client  # noqa: E402
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+CASES = [
+    ("v1.5", "Thai"),
+    ("v1.5", "English"),
+    ("default", "Thai"),
+    ("structure", "Thai"),
+]
+
+
+def _sample_images(workdir: Path) -> list[Path]:
+    """Repo test images plus synthetic edge cases (RGBA, tiny, landscape crop)."""
+    images = [p for p in sorted(SERVICE_DIR.glob("test*.*")) if p.suffix.lower() in (".jpg", ".jpeg", ".png")]
+
+    rgba = Image.new("RGBA", (640, 900), (255, 255, 255, 0))
+    rgba.paste((20, 20, 20, 255), (100, 100, 540, 140))
+    rgba.save(workdir / "rgba.png")
+
+    Image.new("RGB", (240, 180), (250, 250, 250)).save(workdir / "tiny.jpg")  # <= 300 px: never resized
+    Image.new("RGB", (2400, 700), (255, 255, 255)).save(workdir / "landscape.jpg")
+
+    if images:
+        with Image.open(images[0]) as img:
+            width, height = img.size
+            img.convert("RGB").crop((0, 0, width, height // 3 + 20)).save(workdir / "crop.jpg", "JPEG")
+
+    return images + [workdir / name for name in ("rgba.png", "tiny.jpg", "landscape.jpg")] + (
+        [workdir / "crop.jpg"] if images else [])
+
+
+@pytest.fixture(scope="module")
+def sample_images(tmp_path_factory) -> list[Path]:
+    return _sample_images(tmp_path_factory.mktemp("parity"))
+
+
+@pytest.mark.parametrize("task_type,figure_language", CASES)
+def test_messages_match_library(sample_images, task_type, figure_language):
+    for path in sample_images:
+        expected = typhoon_ocr.prepare_ocr_messages(str(path), task_type=task_type, figure_language=figure_language)
+        actual = typhoon_client.build_messages(
+            typhoon_client.prepare_bytes(path.read_bytes(), task_type), task_type, figure_language
+        )
+        assert actual == expected, f"{path.name} {task_type} {figure_language}"
+
+
+def test_region_box_matches_cropped_image():
+    img = Image.new("RGB", (1600, 2200), (255, 255, 255))
+    img.paste((0, 0, 0), (200, 800, 1400, 900))
+    box = (0, 700, 1600, 1500)
+    assert typhoon_client.prepare_image(img, "v1.5", box=box) == typhoon_client.prepare_image(img.crop(box), "v1.5")
+
+
+def test_invalid_task_type():
+    image = typhoon_client.EncodedImage(base64="", width=10, height=10)
+    with pytest.raises(ValueError):
+        typhoon_client.build_messages(image, "v2")
+
+
+def test_v15_rejects_other_figure_languages():
+    image = typhoon_client.EncodedImage(base64="", width=10, height=10)
+    with pytest.raises(ValueError):
+        typhoon_client.build_messages(image, "v1.5", "Japanese")
@@ -0,0 +1,192 @@
+"""
+Open-loop load generator for the OCR service.
+
+Drives /ocr, /ocr/upload or /ocr/batch at a target request rate and reports
+throughput, latency percentiles and errors. Combine with mock_typhoon.py to
+reproduce capacity planning offline:
+
+    python tools/mock_typhoon.py --port 9100 &
+    TYPHOON_BASE_URL=http://localhost:9100/v1 OCR_MAX_WORKERS=5 python main.py &
+    python tools/loadtest.py --endpoint ocr --rps 2 --duration 60 --image test.jpg
+
+Arrivals are open-loop (requests are fired on schedule regardless of how many
+are still in flight), so queueing inside the service shows up as latency.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import base64
+import json
+import random
+import statistics
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+ENDPOINT_PATHS = {"ocr": "/ocr", "upload": "/ocr/upload", "batch": "/ocr/batch"}
+
+
+@dataclass
+class Sample:
+    """Outcome of one request."""
+    started: float
+    latency: float
+    status: int
+    items: int
+    failed_items: int
+    error: Optional[str] = None
+
+
+@dataclass
+class Report:
+    samples: list[Sample] = field(default_factory=list)
+
+    def summary(self, wall_seconds: float) -> dict:
+        ok = [s for s in self.samples if s.error is None and s.status == 200]
+        latencies = sorted(s.latency for s in ok)
+        errors = Counter(s.error or f"http_{s.status}" for s in self.samples if s not in ok)
+        items = sum(s.items - s.failed_items for s in ok)
+
+        def pct(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            index = min(len(latencies) - 1, max(0, int(round(p / 100 * len(latencies) + 0.5)) - 1))
+            return round(latencies[index], 3)
+
+        return {
+            "requests": len(self.samples),
+            "succeeded": len(ok),
+            "failed": len(self.samples) - len(ok),
+            "pages_ok": items,
+            "pages_failed": sum(s.failed_items for s in ok),
+            "wall_seconds": round(wall_seconds, 2),
+            "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds else 0.0,
+            "throughput_pages_per_min": round(items / wall_seconds * 60, 2) if wall_seconds else 0.0,
+            "latency_s": {
+                "p50": pct(50),
+                "p95": pct(95),
+                "p99": pct(99),
+                "mean": round(statistics.fmean(latencies), 3) if latencies else None,
+                "max": round(latencies[-1], 3) if latencies else None,
+            },
+            "errors": dict(errors),
+        }
+
+
+async def _fire(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    image: bytes,
+    image_b64: str,
+    keys: list[str],
+    sequence: int
+) -> Sample:
+    started = time.perf_counter()
+    api_key = keys[0] if len(keys) == 1 else keys
+    items = 1
+    try:
+        if args.endpoint == "ocr":
+            response = await client.post(ENDPOINT_PATHS["ocr"], json={
+                "image_base64": image_b64,
+                "api_key": api_key,
+                "task_type": args.task_type,
+                "dedup": args.dedup,
+            })
+        elif args.endpoint == "upload":
+            response = await client.post(
+                ENDPOINT_PATHS["upload"],
+                files={"file": (f"page-{sequence}.jpg", image, "image/jpeg")},
+                data={"api_key": keys[0], "task_type": args.task_type, "dedup": str(args.dedup).lower()},
+            )
+        else:
+            items = args.batch_size
+            response = await client.post(ENDPOINT_PATHS["batch"], json={
+                "images": [{"id": f"{sequence}-{i}", "image_base64": image_b64} for i in range(items)],
+                "api_key": api_key,
+                "task_type": args.task_type,
+                "dedup": args.dedup,
+            })
+        latency = time.perf_counter() - started
+        failed_items = 0
+        if response.status_code == 200 and args.endpoint == "batch":
+            failed_items = sum(1 for r in response.json().get("results", []) if not r.get("success"))
+        return Sample(started, latency, response.status_code, items, failed_items)
+    except httpx.TimeoutException:
+        return Sample(started, time.perf_counter() - started, 0, items, items, error="client_timeout")
+    except httpx.HTTPError as e:
+        return Sample(started, time.perf_counter() - started, 0, items, items, error=type(e).__name__)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    image = Path(args.image).read_bytes()
+    image_b64 = base64.b64encode(image).decode()
+    keys = args.api_key or ["sk-mock"]
+    rng = random.Random(args.seed)
+
+    report = Report()
+    tasks: list[asyncio.Task] = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        next_at = start
+        sequence = 0
+        while next_at - start < args.duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(_fire(client, args, image, image_b64, keys, sequence)))
+            sequence += 1
+            # Poisson arrivals by default, constant spacing with --constant
+            gap = 1.0 / args.rps if args.constant else rng.expovariate(args.rps)
+            next_at += gap
+
+        for sample in await asyncio.gather(*tasks):
+            report.samples.append(sample)
+        wall = time.perf_counter() - start
+
+    return report.summary(wall)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load generator for the OCR service")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", choices=["ocr", "upload", "batch"], default="ocr")
+    parser.add_argument("--rps", type=float, default=1.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to generate load")
+    parser.add_argument("--constant", action="store_true", help="Constant inter-arrival time instead of Poisson")
+    parser.add_argument("--batch-size", type=int, default=4, help="Images per /ocr/batch request")
+    parser.add_argument("--image", default=str(Path(__file__).resolve().parent.parent / "test.jpg"))
+    parser.add_argument("--api-key", action="append", help="Repeat for multiple keys (default: sk-mock)")
+    parser.add_argument("--task-type", default="v1.5")
+    parser.add_argument("--dedup", action="store_true", help="Allow near-duplicate reuse (off by default: the same image is sent every time)")
+    parser.add_argument("--timeout", type=float, default=330.0, help="Client timeout per request (s)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON only")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    latency = summary["latency_s"]
+    print("=" * 60)
+    print(f"Endpoint:    {ENDPOINT_PATHS[args.endpoint]}")
+    print(f"Target:      {args.rps} rps for {args.duration:.0f}s ({'constant' if args.constant else 'poisson'})")
+    print("-" * 60)
+    print(f"Requests:    {summary['requests']} ({summary['succeeded']} ok, {summary['failed']} failed)")
+    print(f"Pages:       {summary['pages_ok']} ok, {summary['pages_failed']} failed")
+    print(f"Throughput:  {summary['throughput_rps']} req/s, {summary['throughput_pages_per_min']} pages/min")
+    print(f"Latency (s): p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    if summary["errors"]:
+        print(f"Errors:      {summary['errors']}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
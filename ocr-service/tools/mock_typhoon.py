@@ -0,0 +1,341 @@
+"""
+Local stand-in for the Typhoon API (OCR + OpenAI-compatible chat).
+
+Emulates POST /v1/chat/completions as used by typhoon_ocr.ocr_document
+(model "typhoon-ocr", image in the message) and by the LLM ensemble step
+(any other model, text only). Latency, 429 rate, error injection and response
+size are configurable, so capacity planning and OCR_MAX_WORKERS tuning can be
+done without burning real quota.
+
+Chat requests with "stream": true are answered as server-sent events, with the
+latency spread over the chunks. --chat-rate-runaway makes a fraction of chat
+replies loop on one line until max_tokens (exercises the early-abort guard).
+Multi-page merge prompts ("## หน้า n" sections, OCR_LLM_BATCH) are answered
+page by page after "<<<PAGE n>>>" lines. Responses report `usage` (streams
+with stream_options.include_usage, in a final chunk without choices).
+
+Usage:
+    python tools/mock_typhoon.py --port 9100 --ocr-latency-ms 4000 --rate-429 0.05
+
+    # Point the service at the mock
+    TYPHOON_BASE_URL=http://localhost:9100/v1 python main.py
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+@dataclass
+class EndpointProfile:
+    """Behaviour of one emulated endpoint (OCR or chat)."""
+    latency_ms: float = 3000.0       # Median latency
+    latency_dist: str = "lognormal"  # fixed | uniform | lognormal
+    latency_spread: float = 0.4      # uniform: ±fraction, lognormal: sigma
+    rate_429: float = 0.0            # Fraction of requests answered with 429
+    rate_5xx: float = 0.0            # Fraction of requests answered with 500/502/503
+    rate_hang: float = 0.0           # Fraction of requests that hang for hang_seconds
+    hang_seconds: float = 120.0
+    response_chars: int = 2500       # OCR: generated text size. Chat: used when no Full OCR block is found
+    rate_runaway: float = 0.0        # Chat only: fraction of replies that repeat a line until max_tokens
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """Draw one latency in seconds."""
+        base = self.latency_ms / 1000.0
+        if self.latency_dist == "fixed":
+            return base
+        if self.latency_dist == "uniform":
+            return max(0.0, rng.uniform(base * (1 - self.latency_spread), base * (1 + self.latency_spread)))
+        return rng.lognormvariate(0.0, self.latency_spread) * base
+
+
+@dataclass
+class MockConfig:
+    """Global mock server configuration."""
+    ocr: EndpointProfile = field(default_factory=EndpointProfile)
+    chat: EndpointProfile = field(default_factory=lambda: EndpointProfile(latency_ms=8000.0))
+    revoked_keys: set[str] = field(default_factory=set)  # Always answered with 401
+    seed: Optional[int] = None
+
+
+config = MockConfig()
+rng = random.Random()
+stats = {"ocr": 0, "chat": 0, "429": 0, "5xx": 0, "401": 0, "hang": 0, "stream": 0, "runaway": 0, "disconnect": 0}
+CHARS_PER_TOKEN = 3
+
+
+# =============================================================================
+# RESPONSE GENERATION
+# =============================================================================
+
+_THAI_WORDS = [
+    "มูลนิธิ", "หมวดที่", "ข้อ", "วัตถุประสงค์", "ทรัพย์สิน", "คณะกรรมการ", "ประธาน",
+    "เลขานุการ", "เหรัญญิก", "การประชุม", "ข้อบังคับ", "ชื่อ", "สำนักงาน", "ตั้งอยู่",
+    "เลขที่", "ถนน", "แขวง", "เขต", "กรุงเทพมหานคร", "เพื่อ", "ส่งเสริม", "การศึกษา",
+    "สาธารณประโยชน์", "ไม่เกี่ยวข้องกับการเมือง", "วาระ", "ปี", "ดำรงตำแหน่ง", "ลงชื่อ",
+]
+
+
+def _generate_text(seed_bytes: bytes, chars: int) -> str:
+    """Deterministic Thai-looking text - the same image always yields the same text."""
+    local = random.Random(hashlib.sha256(seed_bytes).digest())
+    lines: list[str] = []
+    size = 0
+    while size < chars:
+        line = " ".join(local.choice(_THAI_WORDS) for _ in range(local.randint(4, 12)))
+        if local.random() < 0.15:
+            line = f"ข้อ {local.randint(1, 40)} {line}"
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)[:chars]
+
+
+def _extract_full_ocr(prompt: str) -> Optional[str]:
+    """Return the first fenced block after the Full Image heading of the ensemble prompt."""
+    marker = prompt.find("Full Image OCR")
+    if marker < 0:
+        return None
+    start = prompt.find("```", marker)
+    end = prompt.find("```", start + 3) if start >= 0 else -1
+    if start < 0 or end < 0:
+        return None
+    return prompt[start + 3:end].strip("\n")
+
+
+def _batch_answer(prompt: str) -> Optional[str]:
+    """Answer of a multi-page merge prompt: each page's Full Image OCR after its <<<PAGE n>>> line."""
+    parts = re.split(r"^## หน้า (\d+)$", prompt, flags=re.MULTILINE)
+    if len(parts) < 3:
+        return None
+    pages = [(parts[i], _extract_full_ocr(parts[i + 1]) or "") for i in range(1, len(parts) - 1, 2)]
+    return "\n".join(f"<<<PAGE {number}>>>\n{text}" for number, text in pages)
+
+
+def _runaway(content: str, max_chars: int) -> str:
+    """Reply that starts normally, then loops on one line until the token limit."""
+    lines = [line for line in content.splitlines() if line.strip()] or ["ข้อความซ้ำ"]
+    looped = lines[len(lines) // 2] + "\n"
+    head = "\n".join(lines[:len(lines) // 2]) + "\n"
+    return (head + looped * (max_chars // len(looped) + 1))[:max_chars]
+
+
+def _usage(content: str, prompt_tokens: int) -> dict:
+    completion_tokens = max(1, len(content) // CHARS_PER_TOKEN)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+def _completion(model: str, content: str, prompt_tokens: int, finish_reason: str = "stop") -> dict:
+    return {
+        "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason
+        }],
+        "usage": _usage(content, prompt_tokens)
+    }
+
+
+async def _stream_events(model: str, content: str, seconds: float, finish_reason: str,
+                         usage: Optional[dict] = None):
+    """Server-sent chat.completion.chunk events, spreading `seconds` over the chunks (usage: final chunk)."""
+    completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+    chunk_chars = 24
+    pieces = [content[i:i + chunk_chars] for i in range(0, len(content), chunk_chars)] or [""]
+    delay = seconds / len(pieces)
+
+    def event(delta: Optional[dict], finish: Optional[str] = None) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish}]
+        }
+        if delta is None:
+            chunk["usage"] = usage
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    try:
+        yield event({"role": "assistant", "content": ""})
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            yield event({"content": piece})
+        yield event({}, finish_reason)
+        if usage is not None:
+            yield event(None)
+        yield "data: [DONE]\n\n"
+    except asyncio.CancelledError:
+        stats["disconnect"] += 1  # Client aborted the stream
+        raise
+
+
+# =============================================================================
+# APP
+# =============================================================================
+
+app = FastAPI(title="Mock Typhoon API")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy", "stats": stats}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "")
+    messages = body.get("messages", [])
+    api_key = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+
+    # OCR requests carry the image inside a content list
+    text_parts: list[str] = []
+    image_parts: list[str] = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            text_parts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    text_parts.append(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    image_parts.append(part.get("image_url", {}).get("url", ""))
+    prompt = "\n".join(text_parts)
+    is_ocr = bool(image_parts) or model.startswith("typhoon-ocr")
+    profile = config.ocr if is_ocr else config.chat
+    stats["ocr" if is_ocr else "chat"] += 1
+
+    if api_key in config.revoked_keys:
+        stats["401"] += 1
+        return JSONResponse(status_code=401, content={"error": {"message": "Invalid API key", "type": "invalid_request_error"}})
+
+    roll = rng.random()
+    if roll < profile.rate_hang:
+        stats["hang"] += 1
+        await asyncio.sleep(profile.hang_seconds)
+    elif roll < profile.rate_hang + profile.rate_429:
+        stats["429"] += 1
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": "1"},
+            content={"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}}
+        )
+    elif roll < profile.rate_hang + profile.rate_429 + profile.rate_5xx:
+        stats["5xx"] += 1
+        code = rng.choice([500, 502, 503])
+        return JSONResponse(status_code=code, content={"error": {"message": f"Injected error {code}", "type": "server_error"}})
+
+    latency = profile.sample_latency(rng)
+    finish_reason = "stop"
+
+    if is_ocr:
+        seed = (image_parts[0] if image_parts else prompt).encode()
+        content = _generate_text(seed, profile.response_chars)
+        if "natural_text" in prompt:  # default/structure prompts expect JSON
+            content = json.dumps({"natural_text": content}, ensure_ascii=False)
+    else:
+        full = _batch_answer(prompt) or _extract_full_ocr(prompt)
+        content = full if full is not None else _generate_text(prompt.encode(), profile.response_chars)
+
+    max_chars = int(body.get("max_tokens") or 1_000_000) * CHARS_PER_TOKEN
+    if not is_ocr and rng.random() < profile.rate_runaway:
+        stats["runaway"] += 1
+        normal_chars = max(1, len(content))
+        content = _runaway(content, max_chars)
+        latency *= len(content) / normal_chars  # Same generation speed, far more tokens
+    if len(content) > max_chars:
+        content = content[:max_chars]
+        finish_reason = "length"
+
+    prompt_tokens = max(1, len(prompt) // 3) + 1000 * len(image_parts)
+    if body.get("stream"):
+        stats["stream"] += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        return StreamingResponse(
+            _stream_events(model, content, latency, finish_reason, _usage(content, prompt_tokens) if include_usage else None),
+            media_type="text/event-stream"
+        )
+
+    await asyncio.sleep(latency)
+    return _completion(model, content, prompt_tokens=prompt_tokens, finish_reason=finish_reason)
+
+
+# =============================================================================
+# MAIN
+# =============================================================================
+
+def _add_profile_args(parser: argparse.ArgumentParser, prefix: str, defaults: EndpointProfile) -> None:
+    group = parser.add_argument_group(f"{prefix} endpoint")
+    group.add_argument(f"--{prefix}-latency-ms", type=float, default=defaults.latency_ms)
+    group.add_argument(f"--{prefix}-latency-dist", choices=["fixed", "uniform", "lognormal"], default=defaults.latency_dist)
+    group.add_argument(f"--{prefix}-latency-spread", type=float, default=defaults.latency_spread)
+    group.add_argument(f"--{prefix}-rate-429", type=float, default=defaults.rate_429)
+    group.add_argument(f"--{prefix}-rate-5xx", type=float, default=defaults.rate_5xx)
+    group.add_argument(f"--{prefix}-rate-hang", type=float, default=defaults.rate_hang)
+    group.add_argument(f"--{prefix}-hang-seconds", type=float, default=defaults.hang_seconds)
+    group.add_argument(f"--{prefix}-response-chars", type=int, default=defaults.response_chars)
+    group.add_argument(f"--{prefix}-rate-runaway", type=float, default=defaults.rate_runaway)
+
+
+def _profile_from_args(args: argparse.Namespace, prefix: str) -> EndpointProfile:
+    values = vars(args)
+    return EndpointProfile(**{
+        name: values[f"{prefix}_{name}"]
+        for name in EndpointProfile.__dataclass_fields__
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock Typhoon OCR / chat API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--rate-429", type=float, default=None, help="Shortcut: 429 rate for both endpoints")
+    parser.add_argument("--revoked-key", action="append", default=[], help="Key that always gets 401 (repeatable)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency/error injection")
+    _add_profile_args(parser, "ocr", EndpointProfile())
+    _add_profile_args(parser, "chat", EndpointProfile(latency_ms=8000.0))
+    args = parser.parse_args()
+
+    config.ocr = _profile_from_args(args, "ocr")
+    config.chat = _profile_from_args(args, "chat")
+    if args.rate_429 is not None:
+        config.ocr.rate_429 = config.chat.rate_429 = args.rate_429
+    config.revoked_keys = set(args.revoked_key)
+    config.seed = args.seed
+    if args.seed is not None:
+        rng.seed(args.seed)
+
+    print(f"Mock Typhoon API on http://{args.host}:{args.port}/v1")
+    print(f"  OCR:  {config.ocr}")
+    print(f"  Chat: {config.chat}")
+    # Keep idle connections open like a real API gateway would (uvicorn default is 5s)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", timeout_keep_alive=75)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Run the whole OCR pipeline (ocr_pipeline.ocr_worker) in-process on cassettes.
+
+Record a page once against the real API (or the mock), then reproduce,
+profile or regression-test it offline - same OCR texts, same LLM stream,
+same result every run (see cassette.py):
+
+    # 1. Record (real keys, every OCR + chat request/response is stored)
+    python tools/replay_page.py --mode record --api-key sk-1 --api-key sk-2 test.jpg
+
+    # 2. Replay offline at the recorded pace, or as fast as possible with a profile
+    python tools/replay_page.py test.jpg
+    python tools/replay_page.py --latency zero --repeat 5 --profile test.jpg
+
+    # 3. Regression check: first run writes <golden>/<image>.txt, later runs compare
+    python tools/replay_page.py --latency zero --golden data/golden test.jpg
+
+Exits non-zero when a page fails, a request has no cassette or a text
+differs from its golden file.
+"""
+
+from __future__ import annotations
+import argparse
+import cProfile
+import hashlib
+import os
+import pstats
+import sys
+import time
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run ocr_worker on recorded / replayed Typhoon traffic")
+    parser.add_argument("images", nargs="+", type=Path)
+    parser.add_argument("--mode", choices=("replay", "record"), default="replay")
+    parser.add_argument("--cassettes", type=Path, default=SERVICE_DIR / "data" / "cassettes")
+    parser.add_argument("--latency", choices=("recorded", "zero"), default="recorded", help="Replay pace")
+    parser.add_argument("--api-key", action="append", help="Record mode: Typhoon key (repeat for up to 4)")
+    parser.add_argument("--task-type", default="v1.5")
+    parser.add_argument("--figure-language", default="Thai")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per image (replay)")
+    parser.add_argument("--profile", action="store_true",
+                        help="cProfile the runs (calling thread: decode, crop planning, merge), print the top functions")
+    parser.add_argument("--golden", type=Path, help="Directory of expected texts (written when missing)")
+    args = parser.parse_args()
+
+    if args.mode == "record" and not args.api_key:
+        parser.error("--mode record needs at least one --api-key")
+
+    # Read at import time by cassette.py (via ocr_pipeline -> http_clients)
+    os.environ["OCR_CASSETTE_MODE"] = args.mode
+    os.environ["OCR_CASSETTE_DIR"] = str(args.cassettes)
+    os.environ["OCR_CASSETTE_LATENCY"] = args.latency
+    os.environ.setdefault("OCR_HTTP_PREWARM_CONNECTIONS", "0")
+
+    import ocr_pipeline
+    ocr_pipeline.init_worker()
+    transport = ocr_pipeline.http_clients.get_pool().transport
+    keys = args.api_key or ["sk-replay"]
+
+    profiler = cProfile.Profile() if args.profile else None
+    failures = 0
+    for path in args.images:
+        data = path.read_bytes()
+        for run in range(args.repeat if args.mode == "replay" else 1):
+            started = time.perf_counter()
+            if profiler:
+                profiler.enable()
+            try:
+                text, confidence, meta = ocr_pipeline.ocr_worker(data, keys, args.task_type, args.figure_language)
+            except Exception as e:
+                failures += 1
+                print(f"FAIL {path.name} run {run + 1}: {e}")
+                continue
+            finally:
+                if profiler:
+                    profiler.disable()
+            seconds = time.perf_counter() - started
+            digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+            status = "ok  "
+            if args.golden and run == 0:
+                golden = args.golden / f"{path.name}.txt"
+                if golden.exists():
+                    if golden.read_text(encoding="utf-8") != text:
+                        status = "DIFF"
+                        failures += 1
+                else:
+                    args.golden.mkdir(parents=True, exist_ok=True)
+                    golden.write_text(text, encoding="utf-8")
+                    status = "new "
+            print(f"{status} {path.name} run {run + 1}: {seconds:.2f}s tier {meta.get('tier')} "
+                  f"calls {len(meta.get('calls') or [])} chars {len(text)} sha256 {digest}")
+
+    stats = transport.stats()
+    print("-" * 60)
+    print(f"Cassettes ({stats['directory']}): recorded {stats['recorded']}, replayed {stats['replayed']}, "
+          f"missing {stats['misses']}")
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    sys.exit(1 if failures or stats["misses"] else 0)
+
+
+if __name__ == "__main__":
+    main()
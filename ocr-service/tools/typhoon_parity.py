@@ -0,0 +1,114 @@
+"""
+Parity check: typhoon_client.py vs typhoon_ocr.ocr_document.
+
+For every sample image x task type it checks that
+  1. build_messages(prepare_bytes(...)) produces exactly the request that
+     typhoon_ocr.prepare_ocr_messages() builds from the same file, and
+  2. the text returned through the API is identical for both clients.
+
+Step 2 runs against tools/mock_typhoon.py (deterministic text per image), so
+no API quota is needed:
+
+    python tools/mock_typhoon.py --port 9100 --ocr-latency-ms 50 &
+    python tools/typhoon_parity.py --base-url http://localhost:9100/v1
+
+Exits non-zero on any mismatch. Run it after upgrading typhoon-ocr.
+Step 1 also runs without a server as tests/test_typhoon_client.py
+(python -m pytest tests).
+"""
+
+from __future__ import annotations
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+from openai import OpenAI
+from typhoon_ocr import ocr_document, prepare_ocr_messages
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+import typhoon_client  # noqa: E402
+
+CASES = [
+    ("v1.5", "Thai"),
+    ("v1.5", "English"),
+    ("default", "Thai"),
+    ("structure", "Thai"),
+]
+
+
+def _sample_images(workdir: Path) -> list[Path]:
+    """Repo test images plus synthetic edge cases (RGBA, tiny, landscape crop)."""
+    images = [p for p in sorted(SERVICE_DIR.glob("test*.*")) if p.suffix.lower() in (".jpg", ".jpeg", ".png")]
+
+    rgba = Image.new("RGBA", (640, 900), (255, 255, 255, 0))
+    rgba.paste((20, 20, 20, 255), (100, 100, 540, 140))
+    rgba.save(workdir / "rgba.png")
+
+    Image.new("RGB", (240, 180), (250, 250, 250)).save(workdir / "tiny.jpg")  # <= 300 px: never resized
+
+    if images:
+        with Image.open(images[0]) as img:
+            width, height = img.size
+            img.convert("RGB").crop((0, 0, width, height // 3 + 20)).save(workdir / "crop.jpg", "JPEG")
+
+    return images + [workdir / "rgba.png", workdir / "tiny.jpg"] + ([workdir / "crop.jpg"] if images else [])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Parity check between typhoon_client and typhoon_ocr")
+    parser.add_argument("--base-url", default="http://localhost:9100/v1", help="Mock (or real) Typhoon API")
+    parser.add_argument("--api-key", default="sk-mock")
+    parser.add_argument("--offline", action="store_true", help="Only compare request messages (no API calls)")
+    args = parser.parse_args()
+
+    client = OpenAI(base_url=args.base_url, api_key=args.api_key)
+    failures = 0
+    timings = {"library": 0.0, "native": 0.0}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in _sample_images(Path(tmp)):
+            data = path.read_bytes()
+            for task_type, figure_language in CASES:
+                label = f"{path.name:<14} {task_type:<9} {figure_language:<7}"
+
+                started = time.perf_counter()
+                expected = prepare_ocr_messages(str(path), task_type=task_type, figure_language=figure_language)
+                timings["library"] += time.perf_counter() - started
+
+                started = time.perf_counter()
+                actual = typhoon_client.build_messages(
+                    typhoon_client.prepare_bytes(data, task_type), task_type, figure_language
+                )
+                timings["native"] += time.perf_counter() - started
+
+                problems = []
+                if actual != expected:
+                    problems.append("messages differ")
+
+                if not args.offline:
+                    library_text = ocr_document(
+                        str(path), task_type=task_type, base_url=args.base_url,
+                        api_key=args.api_key, figure_language=figure_language
+                    )
+                    native_text = typhoon_client.ocr_encoded(
+                        client, typhoon_client.prepare_bytes(data, task_type), task_type, figure_language
+                    )
+                    if native_text != library_text:
+                        problems.append("OCR text differs")
+
+                failures += bool(problems)
+                print(f"{'FAIL' if problems else 'ok  '} {label} {'; '.join(problems)}")
+
+    print("-" * 60)
+    print(f"Request preparation: library {timings['library']:.2f}s, native {timings['native']:.2f}s")
+    print(f"{failures} failure(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+First-party Typhoon OCR client working on in-memory images.
+
+typhoon_ocr.ocr_document() only accepts a filesystem path: the worker had to
+write every crop to a temp file so the library could read it back, resize it
+and re-encode it. This client sends the same request (same prompt, image
+preparation and sampling parameters as typhoon_ocr 0.4.x) straight from a PIL
+image or from an image that is already encoded.
+
+Prompt templates come from typhoon_ocr.get_prompt so they stay in sync with
+the library. tests/test_typhoon_client.py checks request parity with
+prepare_ocr_messages(); tools/typhoon_parity.py also checks result parity
+against ocr_document() through the mock server.
+"""
+
+from __future__ import annotations
+import io
+import json
+import base64
+from dataclasses import dataclass
+from typing import Optional
+
+from PIL import Image
+from openai import OpenAI
+from typhoon_ocr import get_prompt
+
+
+DEFAULT_MODEL = "typhoon-ocr"
+TARGET_IMAGE_DIM = 1800   # Longest side sent for v1.5 (ocr_document default)
+MAX_TOKENS = 16384
+TASK_TYPES = ("v1.5", "default", "structure")
+
+
+@dataclass
+class EncodedImage:
+    """Image ready to be sent: base64 JPEG plus the size it was encoded at."""
+    base64: str
+    width: int
+    height: int
+
+    @property
+    def num_bytes(self) -> int:
+        return len(self.base64) * 3 // 4
+
+
+def _resize_for_v15(img: Image.Image, max_size: int, box: Optional[tuple[int, int, int, int]] = None) -> Image.Image:
+    """Same rule as typhoon_ocr.resize_if_needed: scale the longest side to max_size."""
+    width, height = (box[2] - box[0], box[3] - box[1]) if box else img.size
+    if width <= 300 and height <= 300:
+        return img.crop(box) if box else img
+    if width >= height:
+        new_size = (max_size, int(height * (max_size / float(width))))
+    else:
+        new_size = (int(width * (max_size / float(height))), max_size)
+    # Resizing straight from the box avoids a full-resolution crop copy
+    return img.resize(new_size, Image.Resampling.LANCZOS, box=box)
+
+
+def prepare_image(
+    img: Image.Image,
+    task_type: str = "v1.5",
+    target_image_dim: int = TARGET_IMAGE_DIM,
+    box: Optional[tuple[int, int, int, int]] = None
+) -> EncodedImage:
+    """
+    Resize (v1.5 only) and JPEG-encode an image exactly like typhoon_ocr does.
+
+    Args:
+        img: Decoded image (any mode)
+        task_type: OCR task type - resizing only applies to "v1.5"
+        target_image_dim: Longest side after resizing
+        box: Optional (left, upper, right, lower) region of img to send
+
+    Returns:
+        EncodedImage
+    """
+    if task_type == "v1.5":
+        region = _resize_for_v15(img, target_image_dim, box)
+    else:
+        region = img.crop(box) if box else img
+    buffer = io.BytesIO()
+    # convert() copies even when the mode already matches - skip it for RGB regions
+    rgb = region if region.mode == "RGB" else region.convert("RGB")
+    rgb.save(buffer, format="JPEG")
+    if rgb is not region:
+        rgb.close()
+    encoded = EncodedImage(
+        base64=base64.b64encode(buffer.getvalue()).decode("utf-8"),
+        width=region.width,
+        height=region.height
+    )
+    if region is not img:
+        region.close()
+    return encoded
+
+
+def prepare_bytes(
+    image_data: bytes,
+    task_type: str = "v1.5",
+    target_image_dim: int = TARGET_IMAGE_DIM
+) -> EncodedImage:
+    """Decode encoded image bytes and prepare them (see prepare_image)."""
+    with Image.open(io.BytesIO(image_data)) as img:
+        return prepare_image(img, task_type, target_image_dim)
+
+
+def build_messages(image: EncodedImage, task_type: str = "v1.5", figure_language: str = "Thai") -> list[dict]:
+    """
+    Chat messages for one OCR request (same shape as typhoon_ocr.prepare_ocr_messages).
+
+    Raises:
+        ValueError: Unknown task_type or unsupported figure_language for v1.5
+    """
+    if task_type not in TASK_TYPES:
+        raise ValueError(f"Invalid task_type '{task_type}', expected one of {', '.join(TASK_TYPES)}")
+
+    prompt_fn = get_prompt(task_type)
+    if task_type == "v1.5":
+        if figure_language not in ("Thai", "English"):
+            raise ValueError("figure_language must be 'Thai' or 'English' for v1.5")
+        prompt_text = prompt_fn(figure_language=figure_language)
+    else:
+        # Anchor text for images only carries the page dimensions
+        anchor_text = (f"Page dimensions: {float(image.width):.1f}x{float(image.height):.1f}\n"
+                       f"[Image 0x0 to {image.width:.0f}x{image.height:.0f}]\n")
+        prompt_text = prompt_fn(anchor_text)
+
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt_text},
+                # typhoon_ocr labels the JPEG payload as PNG; kept for identical requests
+                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image.base64}"}},
+            ],
+        }
+    ]
+
+
+def ocr_encoded(
+    client: OpenAI,
+    image: EncodedImage,
+    task_type: str = "v1.5",
+    figure_language: str = "Thai",
+    model: str = DEFAULT_MODEL,
+    usage: Optional[dict] = None
+) -> Optional[str]:
+    """
+    Run Typhoon OCR on an already prepared image.
+
+    Args:
+        client: OpenAI client pointed at the Typhoon API (see http_clients.py)
+        image: Output of prepare_image / prepare_bytes
+        task_type: "v1.5", "default" or "structure"
+        figure_language: Figure description language for v1.5
+        model: OCR model name
+        usage: Filled with the response's prompt_tokens / completion_tokens
+               (left untouched when the API reports no usage)
+
+    Returns:
+        Extracted text (None if the API returned no content, like ocr_document)
+    """
+    if "typhoon-ocr-preview" in model and task_type not in ("default", "structure"):
+        raise ValueError("task_type must be 'default' or 'structure' for typhoon-ocr-preview models")
+
+    response = client.chat.completions.create(
+        model=model,
+        messages=build_messages(image, task_type, figure_language),
+        max_tokens=MAX_TOKENS,
+        extra_body={
+            "repetition_penalty": 1.1 if task_type == "v1.5" else 1.2,
+            "temperature": 0.1,
+            "top_p": 0.6,
+        },
+    )
+    if usage is not None and response.usage is not None:
+        usage["prompt_tokens"] = response.usage.prompt_tokens
+        usage["completion_tokens"] = response.usage.completion_tokens
+    text_output = response.choices[0].message.content
+    if task_type == "v1.5" or text_output is None:
+        return text_output
+    # default/structure prompts ask for {"natural_text": ...}
+    return json.loads(text_output)["natural_text"]
+
+
+def ocr_image(
+    client: OpenAI,
+    img: Image.Image,
+    task_type: str = "v1.5",
+    figure_language: str = "Thai",
+    model: str = DEFAULT_MODEL,
+    target_image_dim: int = TARGET_IMAGE_DIM,
+    box: Optional[tuple[int, int, int, int]] = None
+) -> Optional[str]:
+    """Prepare a decoded image (or a box of it) and run Typhoon OCR on it (see ocr_encoded)."""
+    return ocr_encoded(client, prepare_image(img, task_type, target_image_dim, box), task_type, figure_language, model)
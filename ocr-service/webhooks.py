@@ -0,0 +1,351 @@
+"""
+Signed webhook callbacks with a persistent outbox.
+
+The task runner used to poll GET /jobs/{job_id} (or hold a connection open)
+until a page finished. Jobs may now carry a callback_url; when a job reaches
+a final state on this instance a payload is written to a local SQLite outbox
+and POSTed from there:
+
+    - Signing: X-OCR-Signature: sha256=HMAC(OCR_WEBHOOK_SECRET, "<timestamp>.<body>"),
+      with X-OCR-Timestamp (Unix seconds) so receivers can reject replays
+    - Idempotency: X-OCR-Delivery is stable across retries of the same event
+    - Retries: 408 / 429 / 5xx / network errors back off exponentially
+      (WEBHOOK_BACKOFF_SECONDS doubling up to WEBHOOK_BACKOFF_MAX_SECONDS, with
+      jitter) until WEBHOOK_MAX_ATTEMPTS; other 4xx responses are not retried
+    - Durability: undelivered events stay in the outbox across restarts;
+      events that exhaust their attempts are kept as 'dead' for inspection
+
+Events: job.provisional (two-phase jobs), job.succeeded, job.failed
+
+Callback URLs come from clients, so they are checked at submit time and
+again before every attempt (the host may resolve elsewhere by then): the
+host must match OCR_WEBHOOK_ALLOWED_HOSTS when set, and every address it
+resolves to must be public - loopback / private only with
+OCR_WEBHOOK_ALLOW_PRIVATE, link-local (cloud metadata), multicast and
+reserved ranges never. Redirects are not followed.
+
+With several uvicorn workers every one of them writes to the outbox but
+only the holder of the sender role (coordination.Leadership) delivers, so
+an event is never POSTed twice.
+"""
+
+from __future__ import annotations
+import os
+import hmac
+import json
+import time
+import uuid
+import random
+import asyncio
+import socket
+import hashlib
+import logging
+import ipaddress
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+WEBHOOK_SECRET = os.environ.get('OCR_WEBHOOK_SECRET', '')
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('OCR_WEBHOOK_MAX_ATTEMPTS', '12'))
+WEBHOOK_BACKOFF_SECONDS = float(os.environ.get('OCR_WEBHOOK_BACKOFF_SECONDS', '2'))
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.environ.get('OCR_WEBHOOK_BACKOFF_MAX_SECONDS', '600'))
+WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get('OCR_WEBHOOK_TIMEOUT_SECONDS', '10'))
+# Comma-separated callback hosts ("backend.example.com", ".example.com" = any subdomain); empty = any host
+WEBHOOK_ALLOWED_HOSTS = [h.strip().lower() for h in os.environ.get('OCR_WEBHOOK_ALLOWED_HOSTS', '').split(',') if h.strip()]
+# Allow callbacks to loopback / private addresses (receiver on the same host or cluster network)
+WEBHOOK_ALLOW_PRIVATE = os.environ.get('OCR_WEBHOOK_ALLOW_PRIVATE', 'false').lower() in ('1', 'true', 'yes')
+WEBHOOK_CONCURRENCY = 8
+POLL_SECONDS = 1.0
+
+SIGNATURE_HEADER = "X-OCR-Signature"
+TIMESTAMP_HEADER = "X-OCR-Timestamp"
+DELIVERY_HEADER = "X-OCR-Delivery"
+EVENT_HEADER = "X-OCR-Event"
+RETRYABLE_STATUS = (408, 429)
+
+
+def _host_allowed(host: str) -> bool:
+    if not WEBHOOK_ALLOWED_HOSTS:
+        return True
+    for allowed in WEBHOOK_ALLOWED_HOSTS:
+        if allowed.startswith("*."):
+            allowed = allowed[1:]
+        if host == allowed or (allowed.startswith(".") and host.endswith(allowed)):
+            return True
+    return False
+
+
+def check_address(address: str) -> None:
+    """
+    Reject callback targets inside the service's own network.
+
+    Raises:
+        ValueError: Link-local, multicast, reserved or unspecified address, or
+                    loopback / private without OCR_WEBHOOK_ALLOW_PRIVATE
+    """
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    if ip.is_link_local or ip.is_multicast or ip.is_reserved or ip.is_unspecified:
+        raise ValueError(f"callback_url resolves to a forbidden address ({ip})")
+    if not ip.is_global and not WEBHOOK_ALLOW_PRIVATE:
+        raise ValueError(f"callback_url resolves to a private address ({ip}); "
+                         f"set OCR_WEBHOOK_ALLOW_PRIVATE=true for receivers on the internal network")
+
+
+def validate_callback_url(url: str) -> str:
+    """
+    Check a callback URL supplied by a client (without DNS, see resolve_callback_url).
+
+    Raises:
+        ValueError: Not an absolute http(s) URL, host not in OCR_WEBHOOK_ALLOWED_HOSTS,
+                    or a literal IP that check_address rejects
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError(f"callback_url must be an absolute http(s) URL, got '{url}'")
+    host = parsed.hostname.lower()
+    if not _host_allowed(host):
+        raise ValueError(f"callback_url host '{host}' is not allowed (OCR_WEBHOOK_ALLOWED_HOSTS)")
+    try:
+        ipaddress.ip_address(host.split("%", 1)[0])
+    except ValueError:
+        return url  # A name: checked once resolved
+    check_address(host)
+    return url
+
+
+async def resolve_callback_url(url: str) -> str:
+    """
+    validate_callback_url, then check every address the host resolves to.
+
+    Raises:
+        ValueError: Rejected URL or address
+        OSError: The host does not resolve
+    """
+    validate_callback_url(url)
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    infos = await asyncio.get_running_loop().getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+    for info in infos:
+        check_address(info[4][0])
+    return url
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    """Signature header value for a payload: sha256=<hex HMAC over '<timestamp>.<body>'>."""
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before the next attempt after `attempts` failed ones (exponential, ±20% jitter)."""
+    delay = min(WEBHOOK_BACKOFF_MAX_SECONDS, WEBHOOK_BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+# =============================================================================
+# OUTBOX
+# =============================================================================
+
+class WebhookOutbox:
+    """
+    SQLite outbox of webhook events.
+
+    Thread-safe: all methods may run from asyncio.to_thread workers.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self) -> None:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_outbox (
+                id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                event TEXT NOT NULL,
+                body BLOB NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due ON webhook_outbox (next_attempt_at) "
+            "WHERE status = 'pending'"
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add(self, url: str, event: str, payload: dict) -> str:
+        """Store an event for delivery. Returns its delivery id."""
+        delivery_id = uuid.uuid4().hex
+        body = json.dumps({"event": event, "delivery_id": delivery_id, **payload}, ensure_ascii=False).encode()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO webhook_outbox (id, url, event, body, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (delivery_id, url, event, body, now, now)
+            )
+            self._conn.commit()
+        return delivery_id
+
+    def due(self, limit: int) -> list[tuple[str, str, str, bytes, int]]:
+        """Pending events whose next attempt is due: [(id, url, event, body, attempts), ...]"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, url, event, body, attempts FROM webhook_outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+
+    def delivered(self, delivery_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_outbox WHERE id = ?", (delivery_id,))
+            self._conn.commit()
+
+    def failed(self, delivery_id: str, attempts: int, error: str, retry: bool) -> str:
+        """Record a failed attempt. Returns the new status ('pending' or 'dead')."""
+        status = "pending" if retry and attempts < WEBHOOK_MAX_ATTEMPTS else "dead"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE webhook_outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ? "
+                "WHERE id = ?",
+                (status, attempts, error[:500], time.time() + backoff_seconds(attempts), delivery_id)
+            )
+            self._conn.commit()
+        return status
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, count(*) FROM webhook_outbox GROUP BY status").fetchall()
+        return dict(rows)
+
+
+# =============================================================================
+# SENDER
+# =============================================================================
+
+class WebhookSender:
+    """Delivers outbox events in the background (one asyncio task per instance)."""
+
+    def __init__(self, outbox: WebhookOutbox, secret: str = WEBHOOK_SECRET, leader=None):
+        self.outbox = outbox
+        self.secret = secret
+        self.leader = leader  # coordination.Leadership; None = always deliver
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._client = None
+        self.sent = 0
+        self.retried = 0
+        self.given_up = 0
+
+    def start(self) -> None:
+        import httpx
+
+        self._client = httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS)
+        self._task = asyncio.create_task(self._run())
+        if not self.secret:
+            logger.warning("OCR_WEBHOOK_SECRET is not set - webhook callbacks are sent unsigned")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def send(self, url: str, event: str, payload: dict) -> None:
+        """Queue an event (persisted before returning) and wake the sender."""
+        await asyncio.to_thread(self.outbox.add, url, event, payload)
+        self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            if self.leader is not None and not self.leader.is_leader():
+                # Another uvicorn worker delivers; take over when it exits
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            try:
+                batch = await asyncio.to_thread(self.outbox.due, WEBHOOK_CONCURRENCY)
+                if batch:
+                    await asyncio.gather(*[self._deliver(*row) for row in batch])
+                    continue
+            except Exception as e:
+                logger.error(f"Webhook outbox poll failed: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, delivery_id: str, url: str, event: str, body: bytes, attempts: int) -> None:
+        timestamp = int(time.time())
+        headers = {
+            "Content-Type": "application/json",
+            TIMESTAMP_HEADER: str(timestamp),
+            DELIVERY_HEADER: delivery_id,
+            EVENT_HEADER: event
+        }
+        if self.secret:
+            headers[SIGNATURE_HEADER] = sign(self.secret, timestamp, body)
+
+        attempts += 1
+        try:
+            # Checked before every attempt: the name may resolve elsewhere than at submit time
+            await resolve_callback_url(url)
+            response = await self._client.post(url, content=body, headers=headers)
+            if response.is_success:
+                await asyncio.to_thread(self.outbox.delivered, delivery_id)
+                self.sent += 1
+                logger.info(f"📬 Webhook {event} delivered to {urlparse(url).netloc} (attempt {attempts})")
+                return
+            error = f"HTTP {response.status_code}"
+            retry = response.status_code in RETRYABLE_STATUS or response.status_code >= 500
+        except ValueError as e:
+            error = f"Refused: {e}"
+            retry = False
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            retry = True
+
+        status = await asyncio.to_thread(self.outbox.failed, delivery_id, attempts, error, retry)
+        if status == "dead":
+            self.given_up += 1
+            logger.error(f"✗ Webhook {event} to {urlparse(url).netloc} gave up after {attempts} attempt(s): {error}")
+        else:
+            self.retried += 1
+            logger.warning(f"Webhook {event} to {urlparse(url).netloc} failed (attempt {attempts}): {error} - will retry")
+
+    async def stats(self) -> dict:
+        counts = await asyncio.to_thread(self.outbox.counts)
+        return {
+            "enabled": True,
+            "signed": bool(self.secret),
+            "delivering": self.leader is None or self.leader.is_leader(),
+            "pending": counts.get("pending", 0),
+            "dead": counts.get("dead", 0),
+            "sent": self.sent,
+            "retried": self.retried,
+            "given_up": self.given_up
+        }